@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark copying trees with the different methods of Tree.copy().
+
+The "fast", "fast-deep" and "cow" (copy-on-write) methods create the
+new nodes directly, instead of serializing the tree (with pickle or as
+a newick) and reading it back.
+"""
+
+import time
+import random
+from argparse import ArgumentParser
+
+from ete4 import Tree
+
+
+def main():
+    args = get_args()
+
+    print('%8s' % 'leaves' + ''.join('%12s' % m for m in args.methods))
+    for size in args.sizes:
+        t = Tree()
+        t.populate(size, dist_fn=random.random, support_fn=random.random)
+
+        times = [timeit(t.copy, method, repeat=args.repeat) for method in args.methods]
+
+        print('%8d' % size + ''.join('%12s' % fmt(dt) for dt in times))
+
+
+def timeit(f, *args, repeat=1):
+    """Return the best time of calling f(*args) repeat times."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = f(*args)
+        dt = time.perf_counter() - t0
+        del result  # so its deallocation does not count in the next call
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def fmt(dt):
+    return '%.3fs' % dt
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+        help='number of leaves of the trees')
+    add('--methods', nargs='+',
+        default=['cpickle', 'newick', 'fast', 'fast-deep', 'cow'],
+        help='copy methods to compare')
+    add('--repeat', type=int, default=3,
+        help='number of times to repeat each copy (the best is shown)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the encodings of the graphics sent by the smartview server.
+
+For drawings of a tree at different zooms (with more elements as we
+zoom in), show the size of the graphics and the time to encode them as
+json and in binary (see ete4/smartview/gui/wireformat.py), and then
+to compress them with brotli, as the server does.
+"""
+
+import time
+import json
+import random
+from argparse import ArgumentParser
+
+import brotli
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview.renderer.drawer import DrawerRectFaces
+from ete4.smartview.renderer.layouts.default_layouts import (
+    LayoutLeafName, LayoutNumberLeaves)
+from ete4.smartview.gui import wireformat
+
+
+ENCODINGS = {
+    'json': lambda graphics: json.dumps(graphics).encode('utf8'),
+    'binary': wireformat.encode,
+}
+
+
+def main():
+    args = get_args()
+
+    random.seed(0)
+    t = Tree()
+    t.populate(args.size, dist_fn=random.random)
+    ops.update_sizes_all(t)
+
+    layouts = [LayoutLeafName(), LayoutNumberLeaves()]
+
+    print('%8s %9s %7s %11s %10s %11s %10s' % (
+        'zoom y', 'elements', 'format', 'size', 'encode', 'compressed',
+        'compress'))
+    for zy in args.zooms:
+        drawer = DrawerRectFaces(t, (0, 0, 20, args.size), zoom=(100, zy, 1),
+                                 layouts=layouts)
+        graphics = list(drawer.draw())
+
+        for name in args.formats:
+            t0 = time.perf_counter()
+            data = ENCODINGS[name](graphics)
+            t1 = time.perf_counter()
+            compressed = brotli.compress(data, quality=args.quality)
+            t2 = time.perf_counter()
+
+            print('%8g %9d %7s %11d %9.3fs %11d %9.3fs' % (
+                zy, len(graphics), name, len(data), t1 - t0,
+                len(compressed), t2 - t1))
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--size', type=int, default=20000,
+        help='number of leaves of the tree')
+    add('--zooms', nargs='+', type=float, default=[0.05, 0.3, 1],
+        help='zooms in y (pixels per leaf) of the drawings')
+    add('--formats', nargs='+', choices=list(ENCODINGS),
+        default=list(ENCODINGS), help='encodings to compare')
+    add('--quality', type=int, default=11,
+        help='brotli quality (the server uses the default, 11)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark drawing small viewports (deep zooms) of trees with big polytomies.
+
+For each tree size, show the time to draw a few viewports with the
+rectangular drawer when visiting all the children of each node (full),
+when using a new index of children positions (fresh index, as when the
+drawer is used alone), and when reusing the index (as in the server).
+"""
+
+import time
+import random
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview.renderer.drawer import DrawerRectFaces
+from ete4.smartview.renderer.drawindex import DrawIndex
+
+
+class NoIndex(DrawIndex):
+    """Index that never has offsets, so all children are visited."""
+    def offsets(self, node):
+        return None
+
+
+def main():
+    args = get_args()
+
+    print('%9s %9s %12s %12s %12s' % ('leaves', 'children',
+                                      'full', 'fresh index', 'reused index'))
+    for size in args.sizes:
+        t = make_tree(size, args.children)
+
+        rng = random.Random(0)
+        viewports = [(0, rng.uniform(0, size - 20), 5, 20)
+                     for _ in range(args.nviews)]  # 20 leaves high
+
+        reused = DrawIndex()
+        times = [timeit(t, viewports, lambda: NoIndex()),
+                 timeit(t, viewports, lambda: DrawIndex()),
+                 timeit(t, viewports, lambda: reused)]
+
+        print('%9d %9d' % (size, args.children) +
+              ''.join('%12s' % fmt(dt) for dt in times))
+
+
+def make_tree(nleaves, nchildren):
+    """Return a tree with nleaves leaves in polytomies of nchildren nodes."""
+    nodes = [Tree({'name': f'leaf{i}', 'dist': 1}) for i in range(nleaves)]
+    while len(nodes) > 1:
+        parents = []
+        for i in range(0, len(nodes), nchildren):
+            parent = Tree({'dist': 1})
+            for node in nodes[i:i+nchildren]:
+                parent.add_child(node)
+            parents.append(parent)
+        nodes = parents
+    ops.update_sizes_all(nodes[0])
+    return nodes[0]
+
+
+def timeit(tree, viewports, get_index):
+    """Return the average time of drawing the given viewports of tree."""
+    t0 = time.perf_counter()
+    for viewport in viewports:
+        drawer = DrawerRectFaces(tree, viewport, zoom=(100, 50, 1),
+                                 draw_index=get_index())
+        for _ in drawer.draw():
+            pass
+    return (time.perf_counter() - t0) / len(viewports)
+
+
+def fmt(dt):
+    return '%.2fms' % (dt * 1000)
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000],
+        help='number of leaves of the trees')
+    add('--children', type=int, default=1000,
+        help='number of children of each internal node')
+    add('--nviews', type=int, default=20,
+        help='number of viewports to draw (their average time is shown)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark reading newick trees: recursive reader vs iterative reader.
+
+It times newick.loads() (which uses the iterative reader) against the
+old recursive read_nodes(), on balanced and ladder (caterpillar) trees.
+The recursive reader cannot read ladders much deeper than a few
+thousand levels (it overflows the stack), so it is skipped for those.
+"""
+
+import time
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.parser import newick
+
+
+def main():
+    args = get_args()
+
+    print('%-9s %10s %12s %12s %8s' %
+          ('shape', 'leaves', 'recursive', 'iterative', 'speedup'))
+    for shape in args.shapes:
+        for size in args.sizes:
+            text = make_newick(shape, size)
+
+            if shape == 'ladder' and size > args.max_recursive_depth:
+                t_rec = 'too deep'  # it would crash the interpreter
+            else:
+                t_rec = timeit(read_recursive, text)
+            t_ite = timeit(newick.loads, text)
+
+            speedup = ('%.2fx' % (t_rec / t_ite)
+                       if type(t_rec) == float else '-')
+            print('%-9s %10d %12s %12s %8s' %
+                  (shape, size, fmt(t_rec), fmt(t_ite), speedup))
+
+
+def read_recursive(text, parser=None):
+    """Return tree from newick text using the recursive reader."""
+    nodes, pos = newick.read_nodes(text, parser, 0)
+    content, pos = newick.read_content(text, pos)
+    props = newick.get_props(content, not nodes, parser) if content else {}
+    return Tree(props, nodes)
+
+
+def timeit(f, *args):
+    """Return the time it takes to run f(*args), or the error it raises."""
+    try:
+        t0 = time.perf_counter()
+        f(*args)
+        return time.perf_counter() - t0
+    except (RecursionError, MemoryError) as e:
+        return type(e).__name__
+
+
+def fmt(t):
+    return '%.3fs' % t if type(t) == float else t
+
+
+def make_newick(shape, size):
+    """Return a newick with the given shape ("balanced"/"ladder") and leaves."""
+    leaf = lambda i: 'n%d:0.1' % i
+
+    if shape == 'ladder':  # (((n0,n1),n2),n3);
+        return ('(' * (size - 1) + leaf(0) + ',' +
+                '):0.1,'.join(leaf(i) for i in range(1, size)) + ');')
+    elif shape == 'balanced':  # ((n0,n1),(n2,n3));
+        parts = [leaf(i) for i in range(size)]
+        while len(parts) > 1:
+            pairs = ['(%s,%s):0.1' % (parts[i], parts[i+1])
+                     for i in range(0, len(parts) - 1, 2)]
+            parts = pairs + (parts[-1:] if len(parts) % 2 else [])
+        return parts[0].rsplit(':', 1)[0] + ';'
+    else:
+        raise ValueError(f'unknown shape: {shape}')
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[10**4, 10**5, 10**6],
+        help='number of leaves of the trees (try also 10000000)')
+    add('--shapes', nargs='+', default=['balanced', 'ladder'],
+        choices=['balanced', 'ladder'], help='shapes of the trees')
+    add('--max-recursive-depth', type=int, default=5000,
+        help='do not run the recursive reader on deeper ladders')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
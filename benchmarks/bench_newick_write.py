@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark writing newick trees: recursive writer vs iterative writer.
+
+It times newick.dumps() and newick.dump() (which use the iterative
+writer) against a recursive writer like the old one, on balanced and
+ladder (caterpillar) trees, and shows the throughput in MB/s. The
+recursive writer cannot write ladders deeper than the recursion limit,
+so it is skipped for those.
+"""
+
+import os
+import sys
+from tempfile import TemporaryDirectory
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.parser import newick
+
+from bench_newick_read import make_newick, timeit, fmt
+
+
+def main():
+    args = get_args()
+
+    print('%-9s %10s %9s %12s %12s %12s %10s' %
+          ('shape', 'leaves', 'MB', 'recursive', 'dumps', 'dump', 'MB/s'))
+    with TemporaryDirectory() as tmpdir:
+        fname = os.path.join(tmpdir, 'tree.nw')
+        for shape in args.shapes:
+            for size in args.sizes:
+                t = Tree(make_newick(shape, size))
+                mb = len(newick.dumps(t)) / 1e6
+
+                if shape == 'ladder' and size > sys.getrecursionlimit() // 2:
+                    t_rec = 'too deep'
+                else:
+                    t_rec = timeit(write_recursive, t)
+                t_dumps = timeit(newick.dumps, t)
+                t_dump = timeit(write_file, t, fname)
+
+                print('%-9s %10d %9.1f %12s %12s %12s %10.1f' %
+                      (shape, size, mb, fmt(t_rec), fmt(t_dumps), fmt(t_dump),
+                       mb / t_dump))
+
+
+def write_recursive(tree):
+    """Return newick text of tree using a recursive writer."""
+    content = newick.content_repr(tree)
+    if tree.children:
+        return ('(' + ','.join(write_recursive(node).rstrip(';')
+                               for node in tree.children) +
+                ')' + content + ';')
+    else:
+        return content + ';'
+
+
+def write_file(tree, fname):
+    with open(fname, 'w') as fp:
+        newick.dump(tree, fp)
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[10**4, 10**5, 10**6],
+        help='number of leaves of the trees')
+    add('--shapes', nargs='+', default=['balanced', 'ladder'],
+        choices=['balanced', 'ladder'], help='shapes of the trees')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
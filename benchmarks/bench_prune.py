@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark finding nodes by name and pruning big trees, with and without
+an index of the nodes (Tree.build_index()).
+
+Without the index, each t[name] traverses the tree, and prune() (like
+all the functions that accept names instead of nodes) traverses it once
+to translate the names.
+
+It also times pruned(), which builds the pruned tree as a new one,
+without changing (or copying) the original.
+"""
+
+import time
+import random
+from argparse import ArgumentParser
+
+from ete4 import Tree
+
+
+def main():
+    args = get_args()
+
+    print('%8s %8s %-10s %10s %10s %10s %10s %10s' %
+          ('leaves', 'kept', 'index', 'build', 't[name]', 'pruned', 'prune',
+           'total'))
+    for size in args.sizes:
+        t = random_tree(size)
+        names = list(t.leaf_names())
+        for kept in args.kept:
+            kept_names = random.sample(names, min(kept, size))
+            lookups = random.sample(names, min(args.lookups, size))
+            for indexed in [False, True]:
+                tree = t.copy('cpickle')  # so all prune the same tree
+
+                t0 = time.perf_counter()
+                if indexed:
+                    tree.build_index()
+                t1 = time.perf_counter()
+                for name in lookups:
+                    tree[name]
+                t2 = time.perf_counter()
+                new_tree = tree.pruned(kept_names, args.preserve)
+                t3 = time.perf_counter()
+                tree.prune(kept_names, args.preserve)
+                t4 = time.perf_counter()
+
+                assert set(tree.leaf_names()) == set(kept_names)
+                assert new_tree.write() == tree.write()
+
+                print('%8d %8d %-10s %10s %10s %10s %10s %10s' %
+                      (size, len(kept_names), indexed, fmt(t1 - t0),
+                       fmt(t2 - t1), fmt(t3 - t2), fmt(t4 - t3),
+                       fmt((t2 - t0) + (t4 - t3))))
+
+
+def random_tree(size):
+    t = Tree()
+    t.populate(size, names=['n%d' % i for i in range(size)],
+               dist_fn=random.random)
+    return t
+
+
+def fmt(dt):
+    return '%.3fs' % dt
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[10000, 100000],
+        help='number of leaves of the trees')
+    add('--kept', nargs='+', type=int, default=[10, 1000, 50000],
+        help='number of leaves to keep when pruning')
+    add('--preserve', action='store_true',
+        help='preserve the branch lengths when pruning')
+    add('--lookups', type=int, default=100,
+        help='number of nodes to find by name before pruning')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
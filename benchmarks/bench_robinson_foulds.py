@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the Robinson-Foulds distance between big trees.
+
+It compares the time (and peak memory) of the previous way of computing
+the edges (as sorted tuples of leaf names, rebuilding the complement
+of each clade for unrooted trees) with Tree.robinson_foulds(), which
+uses bitsets, and with the splits alone computed with bitsets or with
+128-bit fingerprints (bipartitions.get_splits()), which is all that is
+needed for the distance.
+
+With --matrix N, it instead compares N trees all against all, calling
+Tree.robinson_foulds() for each pair or using bipartitions.rf_matrix().
+"""
+
+import time
+import random
+import tracemalloc
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.core import bipartitions as bp
+
+
+def main():
+    args = get_args()
+
+    global MEASURE_MEMORY
+    MEASURE_MEMORY = args.memory
+
+    if args.matrix:
+        return bench_matrix(args.matrix, args.sizes[0], args.jobs)
+
+    print('%8s %9s %16s %16s %16s %16s' %
+          ('leaves', 'unrooted', 'tuples', 'robinson_foulds',
+           'splits (bitset)', 'splits (hash)'))
+    for size in args.sizes:
+        t1, t2 = random_tree(size), random_tree(size)
+        for unrooted in [False, True]:
+            if size > args.max_tuples_size:
+                t_tuples = 'skipped'
+            else:
+                t_tuples, result = measure(rf_tuples, t1, t2, unrooted)
+            t_rf, result_rf = measure(t1.robinson_foulds, t2,
+                                      unrooted_trees=unrooted)
+            if size <= args.max_tuples_size:
+                assert list(result) == list(result_rf[:2]), 'different results'
+
+            t_bitset, _ = measure(rf_splits, t1, t2, unrooted, 'bitset')
+            t_hash, _ = measure(rf_splits, t1, t2, unrooted, 'hash')
+
+            print('%8d %9s %16s %16s %16s %16s' %
+                  (size, unrooted, fmt(t_tuples), fmt(t_rf),
+                   fmt(t_bitset), fmt(t_hash)))
+
+
+def bench_matrix(ntrees, size, jobs):
+    """Compare ntrees trees of the given size all against all."""
+    trees = [random_tree(size) for _ in range(ntrees)]
+
+    print('%8s %8s %9s %16s %16s' %
+          ('trees', 'leaves', 'unrooted', 'robinson_foulds', 'rf_matrix'))
+    for unrooted in [False, True]:
+        t_pairs, _ = measure(lambda: [[t1.robinson_foulds(t2, unrooted_trees=unrooted)
+                                       for t2 in trees] for t1 in trees])
+        t_matrix, _ = measure(bp.rf_matrix, trees, unrooted=unrooted, jobs=jobs)
+
+        print('%8d %8d %9s %16s %16s' %
+              (ntrees, size, unrooted, fmt(t_pairs), fmt(t_matrix)))
+
+
+def random_tree(size):
+    t = Tree()
+    t.populate(size, names=['n%d' % i for i in range(size)])
+    t.resolve_polytomy()  # so it can also be compared as rooted
+    return t
+
+
+def rf_tuples(t1, t2, unrooted):
+    """Return rf and max_rf, using edges as tuples of leaf names."""
+    common = set(t1.leaf_names()) & set(t2.leaf_names())
+
+    def get_edges(t):
+        content = t.get_cached_content('name')
+        everything = content[t]
+        if unrooted:
+            edges = {tuple(sorted([tuple(sorted(leaves & common)),
+                                   tuple(sorted((everything - leaves) & common))]))
+                     for leaves in content.values()}
+            edges.discard(((), ()))
+        else:
+            edges = {tuple(sorted(leaves & common)) for leaves in content.values()}
+            edges.discard(())
+        return edges
+
+    edges1, edges2 = get_edges(t1), get_edges(t2)
+
+    rf = len(edges1 ^ edges2)
+    if unrooted:
+        max_parts = sum(1 for edges in [edges1, edges2] for p in edges
+                        if len(p[0]) > 1 and len(p[1]) > 1)
+    else:
+        max_parts = sum(1 for edges in [edges1, edges2] for p in edges
+                        if len(p) > 1) - 2
+
+    return rf, max_parts
+
+
+def rf_splits(t1, t2, unrooted, method):
+    """Return rf and max_rf, using only the splits."""
+    common = set(t1.leaf_names()) & set(t2.leaf_names())
+    keys = bp.get_keys(common, method)
+    splits1, _ = bp.get_splits(t1, 'name', keys, unrooted)
+    splits2, _ = bp.get_splits(t2, 'name', keys, unrooted)
+    return bp.rf(splits1, splits2, unrooted=unrooted)
+
+
+def measure(f, *args, **kwargs):
+    """Return the time (and peak memory if asked) of f(*args), and its result."""
+    t0 = time.perf_counter()
+    result = f(*args, **kwargs)
+    dt = time.perf_counter() - t0
+
+    peak = None
+    if MEASURE_MEMORY:  # run again, since tracing the memory slows it down
+        tracemalloc.start()
+        f(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return (dt, peak), result
+
+MEASURE_MEMORY = False
+
+
+def fmt(measurement):
+    if type(measurement) == str:
+        return measurement
+    dt, peak = measurement
+    return '%.2fs' % dt if peak is None else '%.2fs %4dMB' % (dt, peak / 1e6)
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[1000, 10000, 50000],
+        help='number of leaves of the trees')
+    add('--max-tuples-size', type=int, default=10000,
+        help='do not run the tuples version on bigger trees')
+    add('--matrix', type=int, metavar='N',
+        help='compare N trees (of the first size) all against all')
+    add('--jobs', type=int, default=1,
+        help='number of processes for the all-against-all comparison')
+    add('--memory', action='store_true',
+        help='also measure the peak memory used')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark creating the taxonomy database from a taxdump file.
+
+It writes a synthetic taxdump.tar.gz (with nodes.dmp, names.dmp and
+merged.dmp files like the ones from the NCBI) with a random taxonomy
+of the given size, and times building the database from it.
+
+The full NCBI taxonomy has about 2.6 million nodes, 4 million names
+and 80 thousand merged taxids.
+"""
+
+import io
+import os
+import time
+import random
+import tarfile
+import tempfile
+from argparse import ArgumentParser
+
+from ete4.ncbi_taxonomy import ncbiquery
+
+
+def main():
+    args = get_args()
+
+    print('%10s %15s' % ('nodes', 'update_db'))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            taxdump = os.path.join(tmpdir, 'taxdump.tar.gz')
+            write_taxdump(taxdump, size)
+
+            dbfile = os.path.join(tmpdir, 'taxa.sqlite')
+            t0 = time.perf_counter()
+            ncbiquery.update_db(dbfile, taxdump)
+            dt = time.perf_counter() - t0
+
+        print('%10d %14.2fs' % (size, dt))
+
+
+def write_taxdump(fname, size, seed=0):
+    """Write in fname a taxdump file with a random taxonomy of size nodes."""
+    rng = random.Random(seed)
+
+    nodes, names = [], []
+    for taxid in range(1, size + 1):
+        # Parents have lower taxids, and the tree is deep enough.
+        parent = 1 if taxid == 1 else rng.randint(max(1, taxid - 1000), taxid - 1)
+        rank = 'species' if rng.random() < 0.7 else 'no rank'
+        nodes.append(f'{taxid}\t|\t{parent}\t|\t{rank}\t|\t\t|\t8\t|\n')
+
+        names.append(f'{taxid}\t|\ttaxon {taxid}\t|\t\t|\tscientific name\t|\n')
+        if rng.random() < 0.3:
+            names.append(f'{taxid}\t|\tsyn {taxid}\t|\t\t|\tsynonym\t|\n')
+        if rng.random() < 0.1:
+            names.append(f'{taxid}\t|\tcommon {taxid}\t|\t\t|\tgenbank common name\t|\n')
+
+    merged = [f'{size + i}\t|\t{rng.randint(1, size)}\t|\n'
+              for i in range(1, size // 30 + 1)]
+
+    with tarfile.open(fname, 'w:gz') as tar:
+        for member, lines in [('nodes.dmp', nodes), ('names.dmp', names),
+                              ('merged.dmp', merged)]:
+            data = ''.join(lines).encode()
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000],
+        help='number of nodes in the taxonomy')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
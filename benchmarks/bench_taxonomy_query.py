@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark querying the taxonomy database for the taxids of a big tree.
+
+It creates a synthetic taxonomy database (with the same tables as the
+NCBI one), and a tree whose leaves are taxids from it. Then it times the
+queries that annotate_tree() does (names, lineages, ranks and common
+names of all the taxids in the tree), passing the values in a single
+statement, in chunks, and in a temporary table. Finally, it times the
+full annotation of the tree.
+"""
+
+import os
+import time
+import random
+import sqlite3
+import tempfile
+from argparse import ArgumentParser
+
+from ete4 import Tree, PhyloTree, NCBITaxa
+from ete4.ncbi_taxonomy import ncbiquery, bulkquery
+
+
+DEFAULTS = (bulkquery.CHUNK_SIZE, bulkquery.TEMP_TABLE_MIN)
+
+MODES = {  # name -> (chunk_size, temp_table_min)
+    'one statement': (10**9, 10**9),
+    'chunks': (bulkquery.CHUNK_SIZE, 10**9),
+    'temp table': (bulkquery.CHUNK_SIZE, 1),
+}
+
+
+def main():
+    args = get_args()
+
+    print('%8s' % 'leaves' + ''.join('%15s' % m for m in MODES) +
+          ('%15s' % 'annotate_tree' if args.annotate else ''))
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, 'taxa.sqlite')
+            taxids = create_taxonomy(dbfile, size)
+            ncbi = NCBITaxa(dbfile, update=False)
+
+            tree = PhyloTree()
+            tree.populate(size, names=random.choices(taxids, k=size))
+
+            times = []
+            for chunk_size, temp_table_min in MODES.values():
+                set_mode(chunk_size, temp_table_min)
+                times.append(timeit(query_all, ncbi, taxids))
+
+            set_mode(*DEFAULTS)
+            if args.annotate:
+                times.append(timeit(ncbi.annotate_tree, tree))
+
+            ncbi.db.close()
+
+        print('%8d' % size + ''.join('%15s' % fmt(dt) for dt in times))
+
+
+def create_taxonomy(dbfile, size):
+    """Create a taxonomy database in dbfile and return its leaf taxids."""
+    t = Tree()
+    t.populate(size)
+
+    db = sqlite3.connect(dbfile)
+    db.executescript("""
+        CREATE TABLE stats (version INT PRIMARY KEY);
+        CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
+        CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
+        CREATE TABLE merged (taxid_old INT, taxid_new INT);
+        CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
+        CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
+    """)
+    db.execute('INSERT INTO stats (version) VALUES (?)', [ncbiquery.DB_VERSION])
+
+    rows = []
+    taxid = {}  # node -> taxid
+    track = {}  # node -> 'taxid,parent,...,1'
+    for i, node in enumerate(t.traverse('preorder')):
+        taxid[node] = i + 1
+        parent = taxid[node.up] if node.up else 1
+        track[node] = str(i + 1) + (',' + track[node.up] if node.up else '')
+        rank = 'species' if node.is_leaf else 'no rank'
+        rows.append((i + 1, parent, f'taxon {i + 1}', '', rank, track[node]))
+
+    db.executemany('INSERT INTO species VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    # Old taxids merged into existing ones (the NCBI has ~80k of them).
+    n = len(rows)
+    db.executemany('INSERT INTO merged VALUES (?, ?)',
+                   [(n + i + 1, random.randint(1, n)) for i in range(n // 10)])
+    db.commit()
+    db.close()
+
+    return [str(taxid[leaf]) for leaf in t.leaves()]
+
+
+def query_all(ncbi, taxids):
+    """Query the database as annotate_tree() does for the given taxids."""
+    taxids, _ = ncbi._translate_merged(taxids)
+    tax2name = ncbi.get_taxid_translator(taxids)
+    tax2track = ncbi.get_lineage_translator(taxids)
+    all_taxids = {tax for lineage in tax2track.values() for tax in lineage}
+    tax2name.update(ncbi.get_taxid_translator(all_taxids - set(tax2name)))
+    ncbi.get_common_names(tax2name)
+    ncbi.get_rank(tax2name)
+
+
+def set_mode(chunk_size, temp_table_min):
+    bulkquery.CHUNK_SIZE = chunk_size
+    bulkquery.TEMP_TABLE_MIN = temp_table_min
+
+
+def timeit(f, *args):
+    """Return the time it takes to call f(*args), or None if it fails."""
+    try:
+        t0 = time.perf_counter()
+        f(*args)
+        return time.perf_counter() - t0
+    except sqlite3.OperationalError:
+        return None
+
+
+def fmt(dt):
+    return '%.3fs' % dt if dt is not None else 'failed'
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+        help='number of leaves of the trees (and taxa in the taxonomy)')
+    add('--no-annotate', dest='annotate', action='store_false',
+        help='do not time the full annotation of the tree')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
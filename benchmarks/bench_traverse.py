@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the different ways of traversing a tree.
+
+For each tree size, show the time to go through all the nodes with each
+strategy of Tree.traverse(), with Tree.iter_prepostorder(), with the
+walker used by the smartview drawers, and with Tree.traverse_ids().
+"""
+
+import time
+from argparse import ArgumentParser
+
+from ete4 import Tree
+from ete4.core import operations as ops
+
+
+STRATEGIES = {
+    'levelorder': lambda t: t.traverse('levelorder'),
+    'preorder': lambda t: t.traverse('preorder'),
+    'postorder': lambda t: t.traverse('postorder'),
+    'prepostorder': lambda t: t.iter_prepostorder(),
+    'walk': lambda t: ops.walk(t),
+    'ids-pre': lambda t: t.traverse_ids('preorder'),
+    'ids-post': lambda t: t.traverse_ids('postorder'),
+    'ids-level': lambda t: t.traverse_ids('levelorder'),
+}
+
+
+def main():
+    args = get_args()
+
+    print('%8s' % 'leaves' + ''.join('%14s' % s for s in args.strategies))
+    for size in args.sizes:
+        t = Tree()
+        t.populate(size)
+
+        times = [timeit(STRATEGIES[s], t, repeat=args.repeat)
+                 for s in args.strategies]
+
+        print('%8d' % size + ''.join('%14s' % fmt(dt) for dt in times))
+
+
+def timeit(traversal, tree, repeat=1):
+    """Return the best time of going through traversal(tree)."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in traversal(tree):
+            pass
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def fmt(dt):
+    return '%.3fs' % dt
+
+
+def get_args():
+    parser = ArgumentParser(description=__doc__)
+
+    add = parser.add_argument  # shortcut
+    add('--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+        help='number of leaves of the trees')
+    add('--strategies', nargs='+', choices=list(STRATEGIES),
+        default=list(STRATEGIES),
+        help='traversals to compare')
+    add('--repeat', type=int, default=3,
+        help='number of times to repeat each traversal (the best is shown)')
+
+    return parser.parse_args()
+
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@ from .phyloxml import Phyloxml, PhyloxmlTree
 from .nexml import Nexml, NexmlTree
 from .evol import EvolTree
 from .core.arraytable import *
+from .core.arraytree import *
 from .clustering.clustertree import *
 from .utils import SVG_COLORS, COLOR_SCHEMES, random_color
 
@@ -0,0 +1,533 @@
+"""
+Read-only trees backed by arrays, for very big trees.
+
+An ArrayTree reads a tree saved in ete format (see ete4.parser.ete_format)
+without creating a Tree object for each node. If the file is not
+compressed, it is memory-mapped, so opening it is almost immediate and
+only the parts of the tree that are used are read from disk.
+
+The nodes are identified by their index in preorder (the root is 0),
+and accessed through light ArrayNode objects. A subtree can be turned
+into a normal Tree with ArrayNode.to_tree().
+
+Example::
+
+  t.write(outfile='big.ete', format='ete')  # save a (big) tree
+
+  with ArrayTree('big.ete') as at:
+      node = at.common_ancestor(['A', 'B'])
+      subtree = node.to_tree()  # only this part becomes a Tree
+"""
+
+import mmap
+import pickle
+from collections import deque
+
+import numpy as np
+
+from .tree import Tree, TreeError
+from ..parser import ete_format, newick
+
+__all__ = ['ArrayTree', 'ArrayNode']
+
+
+DTYPES = {'i': '<i4', 'q': '<i8', 'd': '<f8', 'B': 'u1'}
+
+
+class ArrayTree:
+    """Read-only tree whose structure and properties are stored in arrays."""
+
+    def __init__(self, source):
+        """
+        :param source: Name of a file with a tree in ete format, or
+            the contents (bytes) of one.
+        """
+        if type(source) == str:
+            with open(source, 'rb') as fp:
+                self._data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = source
+
+        self._view = memoryview(self._data)
+        self._manifest, self._start = ete_format.read_manifest(self._view)
+
+        self.parents = self._block('parents')
+        self.num_nodes = n = len(self.parents)  # number of nodes
+
+        # first_child[i] is the index of the first child of node i (or -1).
+        # Since the nodes are in preorder, it is the next node (if a child).
+        self.first_child = np.full(n, -1, dtype=np.int32)
+        has_child = self.parents[1:] == np.arange(n - 1)
+        self.first_child[:-1][has_child] = np.flatnonzero(has_child) + 1
+
+        # next_sibling[i] is the index of the next node with the same parent.
+        order = np.argsort(self.parents, kind='stable')  # grouped by parent
+        same = self.parents[order[1:]] == self.parents[order[:-1]]
+        self.next_sibling = np.full(n, -1, dtype=np.int32)
+        self.next_sibling[order[:-1][same]] = order[1:][same]
+
+        self.is_leaf = self.first_child == -1
+
+        self._strings_offsets = self._block('strings_offsets')
+        self._strings_data = self._block('strings_data')
+
+        self._columns = {prop['name']: Column(self, prop)
+                         for prop in self._manifest['props']}
+
+    def close(self):
+        """Release the data of the tree (and unmap its file, if mapped).
+
+        The tree cannot be used afterwards. Raises BufferError if
+        there are still arrays from it in use elsewhere.
+        """
+        self.parents = self._strings_offsets = self._strings_data = None
+        self._columns = {}  # the columns with their arrays go away too
+
+        self._view.release()
+        if type(self._data) == mmap.mmap:
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _block(self, name):
+        """Return a numpy array with the contents of the named block."""
+        block = self._manifest['blocks'][name]
+        dtype = np.dtype(DTYPES[block['type']])
+
+        if block['codec'] is None:  # use the (mapped) data directly
+            return np.frombuffer(self._view, dtype=dtype,
+                                 count=block['size'] // dtype.itemsize,
+                                 offset=self._start + block['offset'])
+        else:
+            data = ete_format.read_block(self._view, self._start, block)
+            return np.frombuffer(bytes(data), dtype=dtype)
+
+    def string(self, i):
+        """Return the string with index i in the string table."""
+        start, end = self._strings_offsets[i:i+2]
+        return bytes(self._strings_data[start:end]).decode('utf8', 'surrogatepass')
+
+    def string_index(self, text):
+        """Return the index of text in the string table (or -1 if not there)."""
+        target = text.encode('utf8', 'surrogatepass')
+        offsets = self._strings_offsets
+
+        block = self._manifest['blocks']['strings_data']
+        if block['codec'] is None:  # search directly in the (mapped) data
+            data = self._data
+            base = self._start + block['offset']
+        else:
+            data = self._strings_data.tobytes()
+            base = 0
+        end = base + offsets[-1]
+
+        # Look for the bytes, and check that they are a full string.
+        pos = data.find(target, base, end)
+        while pos != -1:
+            i = np.searchsorted(offsets, pos - base)
+            for k in [i, i + 1]:  # (i may be the empty string)
+                if (k < len(offsets) - 1 and offsets[k] == pos - base and
+                    offsets[k+1] == pos - base + len(target)):
+                    return int(k)
+            pos = data.find(target, pos + 1, end)
+
+        return -1
+
+    @property
+    def prop_names(self):
+        """Names of the properties of the nodes."""
+        return list(self._columns)
+
+    def column(self, prop):
+        """Return the Column with the values of property prop for all nodes."""
+        try:
+            return self._columns[prop]
+        except KeyError:
+            raise TreeError(f'No property {prop!r} in tree')
+
+    @property
+    def root(self):
+        return ArrayNode(self, 0)
+
+    def node(self, i):
+        """Return the node with index i (in preorder)."""
+        if not 0 <= i < self.num_nodes:
+            raise TreeError(f'Invalid node index: {i}')
+        return ArrayNode(self, int(i))
+
+    def __len__(self):
+        """Return the number of leaves."""
+        return int(np.count_nonzero(self.is_leaf))
+
+    def __iter__(self):
+        """Yield all the terminal nodes (leaves)."""
+        yield from self.leaves()
+
+    def __getitem__(self, node_id):
+        """Return the node that matches the given node_id (name or path)."""
+        return self.root[node_id]
+
+    def traverse(self, strategy='levelorder'):
+        """Yield all the nodes (see Tree.traverse())."""
+        yield from self.root.traverse(strategy)
+
+    def leaves(self):
+        """Yield all the leaves."""
+        yield from self.root.leaves()
+
+    def leaf_names(self):
+        """Yield the names of all the leaves."""
+        yield from self.root.leaf_names()
+
+    def search_by_name(self, name, start=0, end=None):
+        """Return array with the indices of the nodes with the given name."""
+        names = self._columns.get('name')
+        i = self.string_index(name) if names else -1
+        if i == -1 or names.kind != 'str':
+            return np.array([], dtype=np.int64)
+        return np.flatnonzero(names.values[start:end] == i) + start
+
+    def common_ancestor(self, nodes):
+        """Return the last node common to the lineages of the given nodes."""
+        return self.root.common_ancestor(nodes)
+
+    def get_distance(self, node1, node2, topological=False):
+        """Return the distance between the given nodes (see Tree.get_distance)."""
+        return self.root.get_distance(node1, node2, topological)
+
+    def to_tree(self):
+        """Return the full tree as a normal Tree."""
+        return self.root.to_tree()
+
+    def _subtree_end(self, i):
+        """Return the index (in preorder) after the last descendant of i."""
+        while i != -1:
+            if self.next_sibling[i] != -1:
+                return int(self.next_sibling[i])
+            i = self.parents[i]
+        return self.num_nodes
+
+    def _children(self, i):
+        j = self.first_child[i]
+        while j != -1:
+            yield int(j)
+            j = self.next_sibling[j]
+
+    def _lineage(self, i):
+        """Yield the index of node i and of all its ancestors."""
+        while i != -1:
+            yield int(i)
+            i = self.parents[i]
+
+    def _translate_nodes(self, nodes, start=0, end=None):
+        """Return the indices of the given nodes (names or ArrayNodes)."""
+        indices = []
+        for node in nodes:
+            if type(node) == str:
+                found = self.search_by_name(node, start, end)
+                if len(found) == 0:
+                    raise TreeError(f'No node found with name: {node}')
+                assert len(found) == 1, f'Ambiguous node name: {node}'
+                indices.append(int(found[0]))
+            elif type(node) == ArrayNode and node.tree is self:
+                indices.append(node.index)
+            else:
+                raise TreeError(f'Invalid node: {node}')
+        return indices
+
+
+class ArrayNode:
+    """A node of an ArrayTree. It can be used much like a (read-only) Tree."""
+
+    __slots__ = ['tree', 'index']
+
+    def __init__(self, tree, index):
+        self.tree = tree  # the ArrayTree
+        self.index = index  # position in preorder
+
+    def __eq__(self, other):
+        return (type(other) == ArrayNode and
+                self.tree is other.tree and self.index == other.index)
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self):
+        return f'<ArrayNode {self.index} {self.name!r}>'
+
+    @property
+    def props(self):
+        """Dict with all the properties of the node (created on access)."""
+        props = {}
+        for name, column in self.tree._columns.items():
+            value = column.get(self.index)
+            if value is not MISSING:
+                props[name] = value
+        return props
+
+    def get_prop(self, prop, default=None):
+        value = (self.tree._columns[prop].get(self.index)
+                 if prop in self.tree._columns else MISSING)
+        return value if value is not MISSING else default
+
+    @property
+    def name(self):
+        name = self.get_prop('name')
+        return str(name) if name is not None else None
+
+    @property
+    def dist(self):
+        dist = self.get_prop('dist')
+        return float(dist) if dist is not None else None
+
+    @property
+    def support(self):
+        support = self.get_prop('support')
+        return float(support) if support is not None else None
+
+    @property
+    def up(self):
+        i = self.tree.parents[self.index]
+        return ArrayNode(self.tree, int(i)) if i != -1 else None
+
+    @property
+    def children(self):
+        return [ArrayNode(self.tree, i) for i in self.tree._children(self.index)]
+
+    @property
+    def is_leaf(self):
+        return bool(self.tree.is_leaf[self.index])
+
+    @property
+    def is_root(self):
+        return self.index == 0
+
+    def __len__(self):
+        """Return the number of leaves."""
+        end = self.tree._subtree_end(self.index)
+        return int(np.count_nonzero(self.tree.is_leaf[self.index:end]))
+
+    def __iter__(self):
+        """Yield all the terminal nodes (leaves)."""
+        yield from self.leaves()
+
+    def __getitem__(self, node_id):
+        """Return the node that matches the given node_id.
+
+        Like in Tree, it can be the name of a node, the index of a
+        child, or a list of indices of children to go through.
+        """
+        tree = self.tree
+        if type(node_id) == str:
+            end = tree._subtree_end(self.index)
+            found = tree.search_by_name(node_id, self.index, end)
+            if len(found) == 0:
+                raise TreeError(f'No node found with name: {node_id}')
+            return ArrayNode(tree, int(found[0]))
+
+        try:
+            path = [node_id] if type(node_id) == int else node_id
+            i = self.index
+            for pos in path:
+                i = list(tree._children(i))[pos]
+            return ArrayNode(tree, i)
+        except (IndexError, TypeError):
+            raise TreeError(f'Invalid node_id: {node_id}')
+
+    def traverse(self, strategy='levelorder'):
+        """Yield the nodes under this one (see Tree.traverse())."""
+        tree = self.tree
+        if strategy == 'preorder':  # they are stored in preorder
+            end = tree._subtree_end(self.index)
+            for i in range(self.index, end):
+                yield ArrayNode(tree, i)
+        elif strategy == 'levelorder':
+            pending = deque([self.index])
+            while pending:
+                i = pending.popleft()
+                yield ArrayNode(tree, i)
+                pending.extend(tree._children(i))
+        elif strategy == 'postorder':
+            pending = [(self.index, False)]
+            while pending:
+                i, visited = pending.pop()
+                if visited or tree.is_leaf[i]:
+                    yield ArrayNode(tree, i)
+                else:
+                    pending.append((i, True))
+                    pending.extend((j, False) for j in
+                                   reversed(list(tree._children(i))))
+        else:
+            raise TreeError(f'Unknown strategy: {strategy}')
+
+    def leaves(self):
+        """Yield the leaves under this node."""
+        end = self.tree._subtree_end(self.index)
+        for i in np.flatnonzero(self.tree.is_leaf[self.index:end]):
+            yield ArrayNode(self.tree, self.index + int(i))
+
+    def leaf_names(self):
+        """Yield the names of the leaves under this node."""
+        for node in self.leaves():
+            yield node.name
+
+    def lineage(self):
+        """Yield this node and all its ancestors."""
+        for i in self.tree._lineage(self.index):
+            yield ArrayNode(self.tree, i)
+
+    def common_ancestor(self, nodes):
+        """Return the last node common to the lineages of the given nodes.
+
+        All the nodes should be under this one, or an error is raised.
+        """
+        tree = self.tree
+        end = tree._subtree_end(self.index)
+        indices = tree._translate_nodes(nodes, self.index, end)
+
+        if not indices:
+            raise TreeError('No nodes given')
+
+        ancestors = list(tree._lineage(indices[0]))[::-1]  # from root
+        depth = {i: d for d, i in enumerate(ancestors)}
+
+        last = len(ancestors) - 1  # position of the common ancestor so far
+        for i in indices[1:]:
+            while i not in depth:
+                i = tree.parents[i]
+            last = min(last, depth[int(i)])
+
+        root = ancestors[last]
+        if not self.index <= root < end:
+            raise TreeError(f'No common ancestor for nodes: {nodes}')
+
+        return ArrayNode(tree, root)
+
+    def get_distance(self, node1, node2, topological=False):
+        """Return the distance between the given nodes (see Tree.get_distance)."""
+        tree = self.tree
+        root = self.common_ancestor([node1, node2]).index
+
+        if topological:
+            d = lambda i: 1
+        else:
+            dists = tree.column('dist').array(default=np.nan)
+            d = lambda i: dists[i]
+
+        total = 0
+        for node in [node1, node2]:
+            i = tree._translate_nodes([node])[0]
+            while i != root:
+                total += d(i)
+                i = tree.parents[i]
+        return total if topological else float(total)
+
+    def to_tree(self, tree_class=Tree):
+        """Return the subtree under this node as a normal Tree."""
+        tree = self.tree
+        start, end = self.index, tree._subtree_end(self.index)
+
+        parents = (tree.parents[start:end] - start).tolist()
+        parents[0] = -1
+
+        props = [{} for _ in range(end - start)]
+        for name, column in tree._columns.items():
+            for node_props, value in zip(props, column.get_range(start, end)):
+                if value is not MISSING:
+                    node_props[name] = value
+
+        return newick.unflatten(props, parents, tree_class)
+
+
+MISSING = ete_format.MISSING  # for the nodes that do not have a property
+
+
+class Column:
+    """Values of a property for all the nodes of an ArrayTree."""
+
+    def __init__(self, tree, prop):
+        self.tree = tree
+        self.name = prop['name']
+        self.kind = prop['kind']
+        self._values_block = prop['values']
+        self._mask_block = prop['mask']
+        self._values = None
+        self._mask = None
+        self._rank = None
+        self._arrays = {}  # saved results of array(), per default value
+
+    @property
+    def values(self):
+        """Array with the (present) values (list if they are pickled)."""
+        if self._values is None:
+            if self.kind == 'pickle':
+                block = self.tree._block(self._values_block)
+                self._values = pickle.loads(block.tobytes())
+            else:
+                self._values = self.tree._block(self._values_block)
+        return self._values
+
+    @property
+    def mask(self):
+        """Array of bools that says which nodes have values (or None if all)."""
+        if self._mask is None and self._mask_block is not None:
+            self._mask = self.tree._block(self._mask_block).view(bool)
+        return self._mask
+
+    def position(self, i):
+        """Return the position of the value of node i in values, or -1."""
+        if self.kind == 'str':  # no mask, missing strings have index -1
+            return i if self.values[i] != -1 else -1
+        if self.mask is None:
+            return i
+        if not self.mask[i]:
+            return -1
+        if self._rank is None:  # rank[i] = number of values before node i
+            self._rank = np.cumsum(self.mask) - 1
+        return int(self._rank[i])
+
+    def get(self, i):
+        """Return the value for node i (or MISSING)."""
+        pos = self.position(i)
+        return MISSING if pos == -1 else self.decode(self.values[pos])
+
+    def get_range(self, start, end):
+        """Return list with the values of nodes from start to end."""
+        if self.kind == 'str':
+            string = self.tree.string
+            return [string(x) if x != -1 else MISSING
+                    for x in self.values[start:end].tolist()]
+        elif self.mask is None and self.kind != 'pickle':
+            values = self.values[start:end].tolist()
+            return values if self.kind != 'bool' else [bool(x) for x in values]
+        else:
+            return [self.get(i) for i in range(start, end)]
+
+    def array(self, default):
+        """Return array with the values for all nodes, default if missing."""
+        assert self.kind in ['float', 'int', 'bool'], 'values are not numbers'
+        if self.mask is None:
+            return self.values
+
+        key = repr(default)  # (so nan works as a key too)
+        if key not in self._arrays:
+            full = np.full(self.tree.num_nodes, default, dtype=float)
+            full[self.mask] = self.values
+            full.flags.writeable = False  # it is shared by all callers
+            self._arrays[key] = full
+        return self._arrays[key]
+
+    def decode(self, value):
+        if self.kind == 'str':
+            return self.tree.string(value)
+        elif self.kind == 'bool':
+            return bool(value)
+        elif self.kind == 'pickle':
+            return value
+        else:
+            return value.item()
+
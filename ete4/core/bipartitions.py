@@ -0,0 +1,298 @@
+"""
+Bipartitions (splits) of trees, to compare them (Robinson-Foulds distance).
+
+Each leaf value (like its name) that is common to the compared trees
+gets a key, and the key of a clade is the xor of the keys of its
+leaves. The keys can be bitsets (leaf i is bit i, and the clade is the
+set of its leaves), or random 128-bit fingerprints (which take much
+less memory for big trees, with a negligible chance of collisions).
+
+In unrooted trees, each branch separates the leaves in two sides. The
+split is represented by the key of the side that contains the first
+leaf value (in sorted order), or 0 if one of the sides is empty.
+
+To compare many trees all against all, rf_matrix() extracts the splits
+of each tree only once, and computes the distances from the number of
+splits shared by each pair of trees.
+"""
+
+import random
+import multiprocessing as mp
+from operator import itemgetter
+
+import numpy as np
+
+from . import operations as ops
+
+
+def get_keys(values, method='bitset'):
+    """Return dict that assigns a key to each of the (sortable) values."""
+    if method == 'bitset':
+        return {value: 1 << i for i, value in enumerate(sorted(values))}
+    elif method == 'hash':
+        rng = random.Random(len(values))  # deterministic, for reproducibility
+        return {value: rng.getrandbits(128) for value in sorted(values)}
+    else:
+        raise ValueError(f'unknown method: {method}')
+
+
+def get_splits(tree, prop, keys, unrooted=False):
+    """Return the splits of tree and the supports of its clades.
+
+    The splits are a dict {key: sizes}, with sizes the number of leaves
+    in the side represented by the key (and in the other side too, if
+    unrooted). The supports are a dict {clade_key: support} with the
+    support of the branch that goes to each clade (None if it has none).
+
+    :param prop: Property of the leaves that identifies them (like "name").
+    :param keys: Dict {value: key} for the values of prop to consider.
+    :param unrooted: If True, consider the tree as unrooted.
+    """
+    nodes, parents, _ = ops.flatten(tree)
+    n = len(nodes)
+
+    m = len(keys)  # number of leaves considered
+    first = keys[min(keys)] if keys else 0  # key of the first leaf value
+    total = total_key(keys)  # key of all the leaves
+
+    # Find, from the leaves up, the key and size of each clade.
+    clades = [0] * n  # key of the clade of each node
+    sizes = [0] * n  # number of (considered) leaves in it
+    has_first = [False] * n  # does the clade contain the first leaf value?
+    for i in range(n - 1, -1, -1):  # reverse preorder: children come first
+        node = nodes[i]
+        if not node.children and (hasattr(node, prop) or prop in node.props):
+            key = keys.get(node.get_prop(prop))
+            if key is not None:
+                clades[i], sizes[i], has_first[i] = key, 1, key == first
+
+        parent = parents[i]
+        if parent >= 0:
+            clades[parent] ^= clades[i]
+            sizes[parent] += sizes[i]
+            has_first[parent] = has_first[parent] or has_first[i]
+
+    splits = {}
+    supports = {}
+    for i in range(n):  # in preorder
+        clade, size = clades[i], sizes[i]
+        if not unrooted:
+            splits[clade] = (size,)
+        elif size == 0 or size == m:  # one side is empty
+            splits[0] = (0, m)
+        elif has_first[i]:
+            splits[clade] = (size, m - size)
+        else:
+            splits[total ^ clade] = (m - size, size)
+        supports[clade] = nodes[i].support
+
+    if not unrooted or m == 0:
+        splits.pop(0, None)  # the empty clade is not a split
+
+    return splits, supports
+
+
+def total_key(keys):
+    """Return the key of the clade with all the leaves."""
+    total = 0
+    for key in keys.values():
+        total ^= key
+    return total
+
+
+def discarded(splits, supports, min_support, total, unrooted=False):
+    """Return set of splits whose branch has a support below min_support.
+
+    Branches without support are never discarded.
+
+    :param total: Key of the clade with all the leaves (see total_key()).
+    """
+    if not min_support:
+        return set()
+
+    def is_weak(support):
+        return support is not None and support < min_support
+
+    if unrooted:  # the branch support can come from either side
+        return {s for s in splits if
+                is_weak(supports[s] if s in supports else supports.get(total ^ s))}
+    else:
+        return {s for s in splits if is_weak(supports[s])}
+
+
+def count_parts(splits, unrooted=False):
+    """Return the number of splits that are informative (>1 leaf per side)."""
+    if unrooted:
+        return sum(1 for sizes in splits.values()
+                   if sizes[0] > 1 and sizes[1] > 1)
+    else:
+        return sum(1 for sizes in splits.values() if sizes[0] > 1)
+
+
+def rf(splits1, splits2, discard1=frozenset(), discard2=frozenset(),
+       unrooted=False):
+    """Return the Robinson-Foulds distance and its maximum, from the splits."""
+    dist = len((splits1.keys() ^ splits2.keys()) - discard1 - discard2)
+
+    max_parts = (count_parts({k: v for k, v in splits1.items()
+                              if k not in discard1}, unrooted) +
+                 count_parts({k: v for k, v in splits2.items()
+                              if k not in discard2}, unrooted))
+    if not unrooted:
+        max_parts -= 2  # do not count the root partition of the two trees
+
+    return dist, max_parts
+
+
+def to_values(key, values):
+    """Return tuple with the values whose bits are set in bitset key."""
+    positions = []
+    while key and len(positions) < 16:  # few bits: find them one by one
+        lowest = key & -key
+        positions.append(lowest.bit_length() - 1)
+        key ^= lowest
+
+    if key:  # many bits: find the rest all at once
+        data = key.to_bytes((key.bit_length() + 7) // 8, 'little')
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8),
+                             bitorder='little')
+        positions += np.flatnonzero(bits).tolist()
+
+    return tuple(itemgetter(*positions)(values)) if len(positions) > 1 else \
+        tuple(values[i] for i in positions)
+
+
+def to_edges(splits, values, unrooted=False):
+    """Return the bitset splits as tuples of values (as robinson_foulds())."""
+    if unrooted:
+        total = (1 << len(values)) - 1
+        return {(to_values(s, values), to_values(total ^ s, values))
+                for s in splits}
+    else:
+        return {to_values(s, values) for s in splits}
+
+
+def rf_matrix(trees, prop='name', unrooted=False, method='hash',
+              normalized=False, jobs=1, out=None):
+    """Return matrix with the Robinson-Foulds distances between all trees.
+
+    Only the leaves whose values of prop are in all the trees are used.
+
+    :param trees: Iterable with the trees to compare.
+    :param prop: Property of the leaves that identifies them (like "name").
+    :param unrooted: If True, consider the trees as unrooted.
+    :param method: How to represent the splits, "hash" or "bitset".
+    :param normalized: If True, divide each distance by its maximum.
+    :param jobs: Number of processes used to compute the distances.
+    :param out: If given, name of the file (.npy) where the matrix is
+        written as it is computed, and which is returned memory-mapped.
+    """
+    incidence, counts = get_incidence(trees, prop, unrooted, method)
+
+    n = len(counts)
+    dtype = np.float64 if normalized else np.int32
+    if out is None:
+        matrix = np.empty((n, n), dtype=dtype)
+    else:
+        matrix = np.lib.format.open_memmap(out, mode='w+',
+                                           dtype=dtype, shape=(n, n))
+
+    for start, rows in iter_rf_rows(incidence, counts, normalized, jobs):
+        matrix[start:start + len(rows)] = rows
+
+    if out is not None:
+        matrix.flush()
+
+    return matrix
+
+
+def get_incidence(trees, prop='name', unrooted=False, method='hash'):
+    """Return the incidence matrix of the informative splits in trees.
+
+    Returns the sparse matrix (with a row per tree and a column per
+    split in any tree, with 1 if the tree has the split) and an array
+    with the number of informative splits (the ones with more than 1
+    leaf per side) in each tree.
+
+    Raises TreeError if a tree has repeated values among the common ones.
+    """
+    from scipy.sparse import csr_matrix  # imported here, as it is slow
+
+    from .tree import TreeError  # imported here, as tree imports this module
+
+    trees = list(trees)
+
+    values = [list(leaf_values(t, prop)) for t in trees]
+    common = set.intersection(*[set(v) for v in values]) if trees else set()
+
+    for i, tree_values in enumerate(values):  # as in robinson_foulds()
+        if sum(1 for v in tree_values if v in common) > len(common):
+            raise TreeError(f'Duplicated items found in tree {i}.')
+
+    keys = get_keys(common, method)
+    m = len(keys)
+
+    columns = {}  # split key -> its column in the matrix (for all trees)
+    indices = []  # the columns of each tree, one after the other
+    indptr = [0]  # where the columns of each tree start in indices
+    for tree in trees:
+        splits, _ = get_splits(tree, prop, keys, unrooted)
+        for key, sizes in splits.items():
+            if 1 < sizes[0] < m and (not unrooted or sizes[1] > 1):
+                indices.append(columns.setdefault(key, len(columns)))
+        indptr.append(len(indices))
+
+    incidence = csr_matrix((np.ones(len(indices), dtype=np.int32),
+                            indices, indptr), shape=(len(trees), len(columns)))
+
+    return incidence, np.diff(indptr).astype(np.int32)
+
+
+def leaf_values(tree, prop):
+    """Yield the values of prop in the leaves of tree that have it."""
+    for leaf in tree.leaves():
+        if hasattr(leaf, prop) or prop in leaf.props:
+            yield leaf.get_prop(prop)
+
+
+def iter_rf_rows(incidence, counts, normalized=False, jobs=1, size=256):
+    """Yield (start, rows) with consecutive rows of the rf matrix.
+
+    The rows are computed in blocks of the given size, in parallel in
+    several processes if jobs > 1.
+
+    :param incidence: Sparse matrix of splits per tree (see get_incidence()).
+    :param counts: Number of informative splits per tree.
+    """
+    starts = range(0, len(counts), size)
+    args = (incidence, counts, normalized, size)
+
+    if jobs == 1 or len(starts) < 2:
+        init_rf_worker(*args)
+        yield from map(rf_rows, starts)
+    else:
+        with mp.Pool(jobs, initializer=init_rf_worker, initargs=args) as pool:
+            yield from pool.imap(rf_rows, starts)
+
+
+def init_rf_worker(incidence, counts, normalized, size):
+    """Store the data that rf_rows() uses (once per process)."""
+    global _rf_data
+    _rf_data = (incidence, incidence.T.tocsc(), counts, normalized, size)
+
+_rf_data = None
+
+
+def rf_rows(start):
+    """Return start and the block of rows of the rf matrix that begins there."""
+    incidence, incidence_t, counts, normalized, size = _rf_data
+
+    shared = (incidence[start:start+size] @ incidence_t).toarray()
+    max_rf = counts[start:start+size, None] + counts[None, :]
+    rows = max_rf - 2 * shared  # the splits in only one of the trees
+
+    if normalized:
+        rows = np.divide(rows, max_rf, out=np.zeros(rows.shape),
+                         where=max_rf > 0)
+
+    return start, rows
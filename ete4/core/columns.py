@@ -0,0 +1,211 @@
+"""
+Properties of the nodes of a tree as numpy arrays (columns).
+
+The nodes are indexed by their position in preorder, so the nodes of
+any clade are contiguous: the ones from node i to end[i]. That allows
+vectorised queries on the whole tree, and per-clade statistics.
+
+Example::
+
+  cols = t.to_columns(['dist', 'support'])
+
+  weak = cols.filter(cols.mask('support', '<', 0.5))  # list of nodes
+  deepest = cols.clade_max('dist')  # for each node, max dist in its clade
+"""
+
+import operator
+
+import numpy as np
+
+from . import operations as ops
+
+
+OPERATORS = {'<': operator.lt, '<=': operator.le, '>': operator.gt,
+             '>=': operator.ge, '==': operator.eq, '!=': operator.ne}
+
+NUMBER_TYPES = {type(None), float, int, bool, np.float64, np.float32,
+                np.int64, np.int32}
+
+
+class Columns:
+    """Arrays with properties of all the nodes of a tree, in preorder."""
+
+    def __init__(self, tree, props=()):
+        """
+        :param tree: Tree whose nodes' properties will be exported.
+        :param props: Names of the properties to export.
+        """
+        self.tree = tree
+        self.columns = {}  # prop name -> array with its values in all nodes
+        self.update(props)
+
+    def update(self, props=None):
+        """Export again the nodes and properties from the tree.
+
+        Use it after changing the tree. If props is given, export those
+        properties (in addition to the ones already exported).
+        """
+        nodes, parents, ends = ops.flatten(self.tree)
+
+        self.nodes = nodes
+        self.parents = np.frombuffer(parents, dtype=np.int64)
+        self.end = np.frombuffer(ends, dtype=np.int64)  # clade i is [i, end[i])
+        self.is_leaf = self.end == np.arange(1, len(nodes) + 1)
+        self._index = None
+
+        names = list(self.columns) + [p for p in props or []
+                                      if p not in self.columns]
+        self.columns = {name: self.export(name) for name in names}
+
+    def export(self, prop):
+        """Return array with the values of prop for all the nodes.
+
+        If all the values are numbers, the array is of floats (with nan
+        for the missing ones). Otherwise it is an array of objects.
+        """
+        values = [node.props.get(prop) for node in self.nodes]
+        if set(map(type, values)) <= NUMBER_TYPES:
+            return np.array(values, dtype=float)  # None -> nan
+        else:
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            return column
+
+    def store(self, prop, values=None):
+        """Set the values of prop in the nodes of the tree from its column.
+
+        If values is given, first set the column to those values. Nodes
+        with a missing value (nan or None) will not have the property.
+        """
+        if values is not None:
+            self.columns[prop] = np.asarray(values)
+
+        column = self[prop]
+        is_number = column.dtype != object
+        for node, value in zip(self.nodes, column.tolist()):
+            if value is None or (is_number and value != value):  # nan
+                node.props.pop(prop, None)
+            else:
+                node.props[prop] = value
+
+    def __getitem__(self, prop):
+        """Return the column (array) of values of prop."""
+        if prop not in self.columns:
+            self.columns[prop] = self.export(prop)
+        return self.columns[prop]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index(self, node):
+        """Return the index (position in preorder) of the given node."""
+        if self._index is None:
+            self._index = {id(n): i for i, n in enumerate(self.nodes)}
+        return self._index[id(node)]
+
+    def mask(self, prop, op, value):
+        """Return array of bools saying which nodes satisfy the condition.
+
+        Example::
+
+          cols.mask('support', '>=', 0.9)
+        """
+        if op in ['==', '!=']:
+            column = self[prop]
+        else:  # compare as numbers
+            column = self._values(prop, leaves_only=False)
+
+        with np.errstate(invalid='ignore'):
+            result = np.asarray(OPERATORS[op](column, value), dtype=bool)
+
+        if op == '!=':  # missing values never satisfy it
+            result &= (~np.isnan(column) if column.dtype != object else
+                       np.array([x is not None for x in column]))
+        return result
+
+    def clade_mask(self, node):
+        """Return array of bools that is True for the nodes in node's clade."""
+        i = self.index(node)
+        mask = np.zeros(len(self.nodes), dtype=bool)
+        mask[i:self.end[i]] = True
+        return mask
+
+    def filter(self, mask):
+        """Return list of nodes where mask is True."""
+        return [self.nodes[i] for i in np.flatnonzero(mask)]
+
+    def search(self, **conditions):
+        """Return list of nodes whose props equal the given values."""
+        mask = np.ones(len(self.nodes), dtype=bool)
+        for prop, value in conditions.items():
+            mask &= self.mask(prop, '==', value)
+        return self.filter(mask)
+
+    def clade_sum(self, prop, leaves_only=False):
+        """Return array with the sum of the values of prop in each clade."""
+        values = self._values(prop, leaves_only)
+        cumsum = np.concatenate([[0], np.cumsum(np.nan_to_num(values))])
+        return cumsum[self.end] - cumsum[:-1]
+
+    def clade_count(self, prop, leaves_only=False):
+        """Return array with the number of values of prop in each clade."""
+        present = ~np.isnan(self._values(prop, leaves_only))
+        cumsum = np.concatenate([[0], np.cumsum(present)])
+        return cumsum[self.end] - cumsum[:-1]
+
+    def clade_mean(self, prop, leaves_only=False):
+        """Return array with the mean of the values of prop in each clade."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.clade_sum(prop, leaves_only) /
+                    self.clade_count(prop, leaves_only))
+
+    def clade_min(self, prop, leaves_only=False):
+        """Return array with the minimum of the values of prop in each clade."""
+        return self._clade_reduce(np.fmin, prop, leaves_only)
+
+    def clade_max(self, prop, leaves_only=False):
+        """Return array with the maximum of the values of prop in each clade."""
+        return self._clade_reduce(np.fmax, prop, leaves_only)
+
+    def stats(self, prop, leaves_only=False):
+        """Return dict with number of values, min, max, mean and var of prop."""
+        values = self._values(prop, leaves_only)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            raise ValueError(f'no node has the property {prop!r}')
+        return {'n': len(values), 'min': float(values.min()),
+                'max': float(values.max()), 'mean': float(values.mean()),
+                'var': float(values.var())}
+
+    def _values(self, prop, leaves_only):
+        """Return the numeric values of prop (only for leaves if asked)."""
+        values = self[prop]
+        if values.dtype == object:  # maybe numbers as text (as read from nhx)
+            try:
+                values = np.array([np.nan if x is None else float(x)
+                                   for x in values])
+            except (TypeError, ValueError):
+                raise ValueError(f'property {prop!r} is not numeric')
+        return np.where(self.is_leaf, values, np.nan) if leaves_only else values
+
+    def _clade_reduce(self, ufunc, prop, leaves_only):
+        """Return array with the reduction of prop by ufunc in each clade."""
+        # Each clade is the range [i, end[i]) in preorder. We reduce them
+        # with a "sparse table": for ranges of length L, with 2**k <= L,
+        # the result is ufunc(level[i], level[end - 2**k]), where level
+        # has the reductions of all the ranges of length 2**k.
+        values = self._values(prop, leaves_only)
+        starts = np.arange(len(values))
+        lengths = self.end - starts
+        ks = np.frexp(lengths)[1] - 1  # largest k with 2**k <= length
+
+        result = np.empty(len(values))
+        level = values  # level[j] = reduction of values[j:j+2**k]
+        for k in range(ks.max() + 1):
+            if k > 0:
+                half = 2**(k - 1)
+                level = ufunc(level[:-half], level[half:])
+            selected = np.flatnonzero(ks == k)
+            result[selected] = ufunc(level[selected],
+                                     level[self.end[selected] - 2**k])
+        return result
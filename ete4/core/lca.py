@@ -0,0 +1,188 @@
+"""
+Lowest common ancestors and distances between nodes, in constant time.
+
+A DistanceIndex precomputes, for all the nodes of a tree, their position
+in preorder, their depth and their distance to the root. The lowest
+common ancestor (lca) of two nodes is then found with a range minimum
+query over the depths (with a "sparse table"), and their distance is::
+
+  d(a, b) = d(root, a) + d(root, b) - 2 * d(root, lca(a, b))
+
+Example::
+
+  index = t.build_distance_index()
+
+  index.lca('A', 'B')  # same as t.common_ancestor(['A', 'B'])
+  index.distance('A', 'B')  # same as t.get_distance('A', 'B')
+  index.distances([('A', 'B'), ('A', 'C'), ...])  # numpy array
+
+The index is updated automatically (the next time it is used) after
+the topology or the branch lengths of the tree change with the
+functions of Tree (add_child(), detach(), prune(), set_outgroup(),
+setting node.dist, etc.).
+"""
+
+import numpy as np
+
+from . import operations as ops
+
+
+class DistanceIndex:
+    """Index of a tree to find common ancestors and distances quickly."""
+
+    def __init__(self, tree):
+        """
+        :param tree: Tree whose nodes will be indexed.
+        """
+        self.tree = tree
+        self.update()
+
+    def update(self):
+        """Compute again the index from the current tree."""
+        nodes, parents, _ = ops.flatten(self.tree)
+        n = len(nodes)
+
+        levels = [0] * n  # number of branches from the root to each node
+        depths = [0.0] * n  # distance from the root to each node
+        for i in range(1, n):
+            node = nodes[i]
+            levels[i] = levels[parents[i]] + 1
+            depths[i] = depths[parents[i]] + (node.dist if 'dist' in node.props
+                                              else 1)
+
+        self.nodes = nodes
+        self.parents = np.frombuffer(parents, dtype=np.int64)
+        self.levels = np.array(levels, dtype=np.int64)
+        self.depths = np.array(depths)
+
+        self._position = {id(node): i for i, node in enumerate(nodes)}
+        self._names = None  # name -> position (computed when needed)
+
+        # Sparse table: table[k, i] is the position of the node with the
+        # smallest level among the ones in positions [i, i + 2**k).
+        table = [np.arange(n)]
+        half = 1
+        while 2 * half <= n:
+            prev = table[-1]
+            a, b = prev[:-half], prev[half:]
+            table.append(np.where(self.levels[a] <= self.levels[b], a, b))
+            half *= 2
+        self._table = np.zeros((len(table), n), dtype=np.int64)
+        for k, row in enumerate(table):
+            self._table[k, :len(row)] = row
+
+        self.valid = True
+
+    def tree_changed(self, event, node, arg):
+        """Mark the index as outdated if the change affects its nodes."""
+        if event == 'prop' and arg != 'dist':
+            return  # only the topology and the distances matter
+
+        if id(node) in self._position or (event == 'add' and
+                                          id(arg) in self._position):
+            self.valid = False
+
+    def lca(self, node1, node2):
+        """Return the lowest common ancestor of the given nodes (or names)."""
+        i, j = self.positions([node1, node2]).tolist()
+        return self.nodes[self._lca1(i, j)]
+
+    def lcas(self, pairs):
+        """Return list with the lowest common ancestor of each pair of nodes."""
+        nodes = self.nodes
+        return [nodes[i] for i in self._lca(*self._pair_positions(pairs)).tolist()]
+
+    def distance(self, node1, node2, topological=False):
+        """Return the distance between the given nodes (or names).
+
+        :param topological: If True, return the number of branches
+            between the nodes instead of the sum of their lengths.
+        """
+        i, j = self.positions([node1, node2]).tolist()
+        values = self.levels if topological else self.depths
+        return (values.item(i) + values.item(j) -
+                2 * values.item(self._lca1(i, j)))
+
+    def distances(self, pairs, topological=False):
+        """Return array with the distance between each pair of nodes (or names).
+
+        :param pairs: List of pairs of nodes, like [(n1, n2), (n1, n3), ...]
+        :param topological: If True, return the number of branches
+            between the nodes instead of the sum of their lengths.
+        """
+        return self._distances(*self._pair_positions(pairs), topological)
+
+    def positions(self, nodes):
+        """Return array with the positions (in preorder) of the given nodes."""
+        if not self.valid:
+            self.update()
+
+        return np.array([self._position_of(node) for node in nodes],
+                        dtype=np.int64)
+
+    def _position_of(self, node):
+        """Return the position of the given node (or name)."""
+        if type(node) != str:
+            try:
+                return self._position[id(node)]
+            except KeyError:
+                raise tree_error(f'Node not in the indexed tree: {node.name!r}')
+
+        if self._names is None:
+            self._names = {}
+            for i, n in enumerate(self.nodes):
+                # Ambiguous names map to -1.
+                self._names[n.name] = -1 if n.name in self._names else i
+
+        i = self._names.get(node)
+        if i is None:
+            raise tree_error(f'Node not found: {node!r}')
+        elif i == -1:
+            raise tree_error(f'Ambiguous node name: {node!r}')
+        return i
+
+    def _pair_positions(self, pairs):
+        """Return two arrays with the positions of the nodes in pairs."""
+        pairs = list(pairs)
+        flat = self.positions([node for pair in pairs for node in pair])
+        return flat[0::2], flat[1::2]
+
+    def _lca(self, i, j):
+        """Return the position of the lowest common ancestor of nodes i, j."""
+        # If i < j, the lca is the parent of the node with the lowest
+        # level in positions (i, j] (also if i is an ancestor of j).
+        lo, hi = np.minimum(i, j) + 1, np.maximum(i, j)
+        same = lo > hi  # i == j
+
+        lo = np.where(same, hi, lo)  # so they are valid positions
+        k = np.frexp(hi - lo + 1)[1] - 1  # largest k with 2**k <= length
+        a = self._table[k, lo]
+        b = self._table[k, hi - (1 << k) + 1]
+        lowest = np.where(self.levels[a] <= self.levels[b], a, b)
+
+        return np.where(same, hi, self.parents[lowest])
+
+    def _lca1(self, i, j):
+        """Return the position of the lowest common ancestor of nodes i, j."""
+        # Same as _lca(), but faster for a single pair.
+        if i == j:
+            return i
+
+        lo, hi = (i + 1, j) if i < j else (j + 1, i)
+        k = (hi - lo + 1).bit_length() - 1
+        a = self._table.item(k, lo)
+        b = self._table.item(k, hi - (1 << k) + 1)
+        lowest = a if self.levels.item(a) <= self.levels.item(b) else b
+
+        return self.parents.item(lowest)
+
+    def _distances(self, i, j, topological):
+        """Return the distances between nodes at positions i and j."""
+        values = self.levels if topological else self.depths
+        return values[i] + values[j] - 2 * values[self._lca(i, j)]
+
+
+def tree_error(message):
+    """Return a TreeError exception with the given message."""
+    from .tree import TreeError  # imported here, since tree imports us
+    return TreeError(message)
@@ -0,0 +1,123 @@
+"""
+Index of the nodes of a tree by the values of some of their properties.
+
+A NodeIndex finds the nodes with a given name (or the value of any
+other property) without traversing the tree. The tree uses it, once
+built with t.build_index(), in t[name], t.search_nodes(), and
+everywhere nodes are given by their names (prune(), common_ancestor(),
+get_distance(), etc.).
+
+Example::
+
+  t.build_index()  # index by name
+  t['A']  # found without traversing the tree
+
+  t.build_index(['name', 'taxid'])
+  list(t.search_nodes(taxid=9606))
+
+The index is kept up to date when the tree changes with the functions
+of Tree (add_child(), detach(), delete(), prune(), set_outgroup(),
+setting node.name, add_prop(), etc.). Changes made directly to
+node.props or to the list of node.children are not seen by it.
+"""
+
+
+class NodeIndex:
+    """Index of the nodes of a tree by the values of some properties."""
+
+    def __init__(self, tree, props=('name',)):
+        """
+        :param tree: Tree whose nodes will be indexed.
+        :param props: Properties of the nodes to index.
+        """
+        self.tree = tree
+        self.props = list(props)
+        self.update()
+
+    def update(self):
+        """Compute again the index from the current tree."""
+        self.members = {}  # id(node) -> node, for all the indexed nodes
+        self.nodes = {prop: {} for prop in self.props}  # value -> [nodes]
+        self.values = {prop: {} for prop in self.props}  # id(node) -> value
+        self.add(self.tree)
+
+    def __reduce__(self):
+        # Do not copy or pickle the index with its tree (the copy
+        # would not receive the changes made to it).
+        return type(None), ()
+
+    def lookup(self, prop, value):
+        """Return list of the indexed nodes whose prop has the given value."""
+        return [node for node in self.nodes[prop].get(value, ())
+                if node.props.get(prop) == value]  # in case it changed
+
+    def tree_changed(self, event, node, arg):
+        """Update the index after a change in the tree."""
+        if event == 'add':
+            if id(node) in self.members:
+                self.add(arg)
+        elif event == 'remove':
+            up = arg.up
+            if id(arg) in self.members and (up is None or
+                                            id(up) not in self.members):
+                self.remove(arg)  # and not moved to another indexed node
+        elif event == 'prop':
+            if arg in self.nodes and id(node) in self.members:
+                self._remove_value(node, arg)
+                self._add_value(node, arg)
+
+    def add(self, node):
+        """Add to the index the given node and its descendants."""
+        pending = [node]
+        while pending:
+            node = pending.pop()
+
+            if id(node) in self.members:
+                continue  # already indexed (for example, moved inside the tree)
+
+            self.members[id(node)] = node
+            for prop in self.props:
+                self._add_value(node, prop)
+
+            pending.extend(child for child in node.children if child.up is node)
+
+    def remove(self, node):
+        """Remove from the index the given node and its descendants."""
+        pending = [node]
+        while pending:
+            node = pending.pop()
+
+            if node is self.tree or self.members.pop(id(node), None) is None:
+                continue  # never unindex the root (it can move temporarily)
+
+            for prop in self.props:
+                self._remove_value(node, prop)
+
+            # Skip the children that were moved to another node.
+            pending.extend(child for child in node.children if child.up is node)
+
+    def _add_value(self, node, prop):
+        value = node.props.get(prop)
+        if indexable(value):
+            self.nodes[prop].setdefault(value, []).append(node)
+            self.values[prop][id(node)] = value
+
+    def _remove_value(self, node, prop):
+        value = self.values[prop].pop(id(node), None)
+        if value is not None:
+            nodes = self.nodes[prop][value]
+            nodes.remove(node)
+            if not nodes:
+                del self.nodes[prop][value]
+
+
+def indexable(value):
+    """Return True if the given value can be used to find nodes in the index."""
+    if value is None:
+        return False
+
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
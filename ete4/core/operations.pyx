@@ -5,7 +5,8 @@ Sorting, changing the root to a node, moving branches, removing (prunning)...
 """
 
 import random
-from collections import namedtuple, deque
+from collections import deque
+from array import array
 
 
 def sort(tree, key=None, reverse=False):
@@ -34,6 +35,11 @@ def root_at(node, bprops=None):
 
     positions = node.id  # child positions from root to node (like [1, 0, ...])
 
+    sized = has_size(root)
+    if sized:  # only the nodes in the path to node will change their size
+        for n in [node] + list(node.ancestors()):
+            n.size = (0, 0)  # so they are not updated after each change
+
     interchange_references(root, node)  # root <--> node
     old_root = node  # now "node" points to where the old root was
 
@@ -44,6 +50,9 @@ def root_at(node, bprops=None):
     if len(old_root.children) == 1:
         join_branch(old_root, bprops)
 
+    if sized:
+        update_sizes_missing(root)
+
 
 def interchange_references(node1, node2):
     """Interchange the references of the given nodes.
@@ -55,6 +64,7 @@ def interchange_references(node1, node2):
 
     # Interchange properties.
     node1.props, node2.props = node2.props, node1.props
+    props_changed([node1, node2], set(node1.props) | set(node2.props))
 
     # Interchange children.
     children1 = node1.remove_children()
@@ -69,12 +79,12 @@ def interchange_references(node1, node2):
     pos2 = up2.children.index(node2) if up2 else None
 
     if up1 is not None:
-        up1.children.pop(pos1)
-        up1.children.insert(pos1, node2)
+        up1.pop_child(pos1)
+        insert_child(up1, pos1, node2)
 
     if up2 is not None:
-        up2.children.pop(pos2)
-        up2.children.insert(pos2, node1)
+        up2.pop_child(pos2)
+        insert_child(up2, pos2, node1)
 
     node1.up = up2
     node2.up = up1
@@ -120,6 +130,8 @@ def rehang(root, child_pos, bprops=None):
 
     swap_props(root, child, ['dist', 'support'] + (bprops or []))
 
+    update_sizes_changed(root)  # now under child, and with its old dist
+
     return child  # which is now the new root
 
 
@@ -133,6 +145,29 @@ def swap_props(n1, n2, props):
         if p2 is not None:
             n1.props[pname] = p2
 
+    props_changed([n1, n2], props)
+
+
+def props_changed(nodes, pnames):
+    """Tell the observers of changes in trees that the given props changed."""
+    for node in nodes:
+        for pname in pnames:
+            notify('prop', node, pname)
+
+
+def notify(event, node, arg):
+    """Tell the observers of changes in trees (if any) about a change."""
+    from .tree import _observers, notify_change  # here, since tree imports us
+
+    if _observers:
+        notify_change(event, node, arg)
+
+
+def insert_child(node, pos, child):
+    """Add child to node at the given position (as node.add_child())."""
+    node.add_child(child)
+    node.children.insert(pos, node.children.pop())
+
 
 def insert_intermediate(node, intermediate, bprops=None, dist=None):
     """Insert, between node and its parent, an intermediate node."""
@@ -140,7 +175,7 @@ def insert_intermediate(node, intermediate, bprops=None, dist=None):
     up = node.up
 
     pos_in_parent = up.children.index(node)  # save its position in parent
-    up.children.pop(pos_in_parent)  # detach from parent
+    up.pop_child(pos_in_parent)  # detach from parent
 
     intermediate.add_child(node)
 
@@ -154,8 +189,7 @@ def insert_intermediate(node, intermediate, bprops=None, dist=None):
         if prop in node.props:
             intermediate.props[prop] = node.props[prop]
 
-    up.children.insert(pos_in_parent, intermediate)  # put new where old was
-    intermediate.up = up
+    insert_child(up, pos_in_parent, intermediate)  # put new where old was
 
 
 def join_branch(node, bprops=None):
@@ -175,9 +209,8 @@ def join_branch(node, bprops=None):
 
     up = node.up
     pos_in_parent = up.children.index(node)  # save its position in parent
-    up.children.pop(pos_in_parent)  # detach from parent
-    up.children.insert(pos_in_parent, child)  # put child where the old node was
-    child.up = up
+    up.pop_child(pos_in_parent)  # detach from parent
+    insert_child(up, pos_in_parent, child)  # put child where the old node was
 
 
 def unroot(tree, bprops=None):
@@ -217,6 +250,168 @@ def remove(node):
     parent.remove_child(node)
 
 
+def prune(tree, nodes, preserve_branch_length=False):
+    """Prune tree so it only keeps the given nodes (and its root).
+
+    The internal nodes that connect the given ones are kept too (see
+    Tree.prune()). It works in time linear with the size of the tree.
+
+    :param nodes: Nodes in tree that should be kept.
+    :param preserve_branch_length: If True, add the dist of the removed
+        nodes to the ones kept, so the distances between them stay.
+    """
+    kept, postorder, children, dists = get_pruned(tree, nodes,
+                                                  preserve_branch_length)
+
+    sized = has_size(tree)
+    if sized:
+        clear_sizes(tree)  # so they are not updated after each change
+
+    for node, dist in dists.items():
+        if node in kept:
+            node.dist = dist
+
+    for node in postorder:  # bottom-up, so observers see only the changes
+        if node in kept and node in children:
+            set_pruned_children(node, children[node], kept)
+
+    if sized:
+        update_sizes_all(tree)
+        update_sizes_changed(tree.up)  # if it is a subtree
+
+
+def pruned(tree, nodes, preserve_branch_length=False):
+    """Return a new tree with only the given nodes of tree (and its root).
+
+    It is the tree that prune() would leave, but without changing or
+    copying the original. Its nodes are new, with a copy of the props.
+    """
+    kept, postorder, children, dists = get_pruned(tree, nodes,
+                                                  preserve_branch_length)
+
+    copies = {}  # node -> its copy
+    for node in postorder:
+        if node in kept:
+            copy = node.__class__(node.props)
+            if node in dists:
+                copy.props['dist'] = dists[node]
+            for child in children.get(node, node.children):
+                copy.add_child(copies.pop(child))
+            copies[node] = copy
+
+    return copies[tree]
+
+
+def get_pruned(tree, nodes, preserve_branch_length=False):
+    """Return what is needed to prune tree, keeping only the given nodes.
+
+    Return the set of nodes that will be kept, all the nodes of tree in
+    postorder, the new children of the nodes (only for the ones whose
+    children change), and the new dist of the nodes that change.
+    """
+    seeds = set(nodes)  # nodes asked to keep
+    if not seeds:
+        raise ValueError('no nodes to keep')
+
+    postorder = list(traverse(tree, order=+1))
+
+    # For each node, count the seeds below it, and its children with seeds.
+    below = {}  # node -> number of seeds in its descendants
+    branches = {}  # node -> number of children that have seeds
+    last_branch = {}  # node -> last child that has seeds
+    for node in postorder:
+        n = 0
+        for child in node.children:
+            k = below[child] + (child in seeds)
+            if k > 0:
+                n += k
+                branches[node] = branches.get(node, 0) + 1
+                last_branch[node] = child
+        below[node] = n
+
+    if not all(node in below for node in seeds):
+        raise ValueError('nodes not in the tree')
+
+    # Nodes with the same seeds below form a chain. Keep the deepest
+    # node of each chain with more than 1 seed below (where lineages
+    # join), unless the chain already has a node to keep.
+    kept = seeds | {tree}
+    for node in postorder:
+        if node in kept or below[node] < 2:
+            continue
+
+        if branches[node] == 1 and last_branch[node] not in seeds:
+            continue  # not the deepest of its chain
+
+        top = node  # go up the chain looking for a node already kept
+        while top not in kept and branches[top.up] == 1:
+            top = top.up
+
+        if top not in kept:
+            kept.add(node)
+
+    # Find the new children and dists, as if we removed one by one (in
+    # postorder) the nodes not kept, putting their children at the end
+    # of their parent's children.
+    children = {}  # node -> list of new children (if it changes)
+    dists = {}  # node -> new dist (if it changes)
+
+    def get_dist(node):
+        return dists[node] if node in dists else node.dist
+
+    for node in postorder:
+        if all(child in kept for child in node.children):
+            continue  # its children stay the same
+
+        new_children = [child for child in node.children if child in kept]
+        moved = [children.get(child, child.children) for child in node.children
+                 if child not in kept]
+        moved = [nodes for nodes in moved if nodes]
+
+        if not new_children and len(moved) == 1:
+            new_children = moved[0]  # reuse the list, there is no need to copy
+        else:
+            for nodes in moved:
+                new_children.extend(nodes)
+
+        children[node] = new_children
+
+    if preserve_branch_length:
+        for node in postorder:
+            dist = get_dist(node)
+            if node in kept or dist is None:
+                continue
+
+            new_children = children.get(node, node.children)
+            if len(new_children) == 1:
+                child = new_children[0]
+                if get_dist(child) is not None:
+                    dists[child] = get_dist(child) + dist
+            elif len(new_children) > 1 and node.up and get_dist(node.up) is not None:
+                dists[node.up] = get_dist(node.up) + dist
+
+    return kept, postorder, children, dists
+
+
+def set_pruned_children(node, new_children, kept):
+    """Set the new children of a node when pruning, telling the observers."""
+    old_children = list(node.children)
+
+    for child in new_children:
+        child.up = node
+    node.children[:] = new_children
+
+    for child in old_children:
+        if child not in kept:
+            child.up = None
+            notify('remove', node, child)
+
+    old_ids = set(map(id, old_children))
+    for child in new_children:
+        if id(child) not in old_ids:
+            notify('add', node, child)
+
+
 # Functions that used to be defined inside tree.pyx.
 
 def common_ancestor(nodes):
@@ -425,15 +620,22 @@ def to_ultrametric(tree, topological=False):
     if (topological or dist_full <= 0 or
         any(node.dist is None for node in tree.traverse())):
         # Ignore original distances and just use the tree topology.
+        clear_sizes(tree)  # so they are not updated after each change
         for node in tree.traverse():
             node.dist = 1 if node.up else 0
         update_sizes_all(tree)
         dist_full = dist_full if dist_full > 0 else tree.size[0]
 
-    for node in tree.traverse():
+    heights = [(node, node.size[0]) for node in tree.traverse()]
+    clear_sizes(tree)
+
+    for node, height in heights:
         if node.dist > 0:
-            d = sum(n.dist for n in node.ancestors())
-            node.dist *= (dist_full - d) / node.size[0]
+            d = sum(n.dist for n in node.ancestors(root=tree))  # in tree
+            node.dist *= (dist_full - d) / height
+
+    update_sizes_all(tree)
+    update_sizes_changed(tree.up)  # if it is a subtree
 
 
 def resolve_polytomy(tree, descendants=True):
@@ -542,21 +744,93 @@ def set_midpoint_outgroup(tree, topological=False):
 
 
 # Traversing the tree.
+#
+# The traversals keep their state in plain lists of nodes (and of child
+# positions), so they do not create tuples for each node visited. They
+# keep a copy of the children of the nodes on their way, so the tree
+# can be changed while traversing it (detaching or deleting nodes, etc).
 
 def traverse(tree, order=-1, is_leaf_fn=None):
-    """Traverse the tree and yield nodes in pre (< 0) or post (> 0) order."""
-    visiting = [(tree, False)]
-    while visiting:
-        node, seen = visiting.pop()
+    """Traverse the tree and yield nodes in pre (< 0) or post (> 0) order.
+
+    If order == 0, yield the internal nodes both before and after their
+    descendants (and the leaves only once).
+    """
+    if order < 0:
+        return traverse_preorder(tree, is_leaf_fn)
+    elif order > 0:
+        return traverse_postorder(tree, is_leaf_fn)
+    else:
+        return (node for _, node in traverse_prepostorder(tree, is_leaf_fn))
 
-        is_leaf = is_leaf_fn(node) if is_leaf_fn else node.is_leaf
 
-        if is_leaf or (order <= 0 and not seen) or (order >= 0 and seen):
-            yield node
+def traverse_preorder(tree, is_leaf_fn=None):
+    """Yield nodes in preorder (each node before its descendants)."""
+    cdef list pending = [tree]  # nodes to visit
+    cdef list children
+    cdef Py_ssize_t i
+
+    while pending:
+        node = pending.pop()
+        yield node
+
+        children = visible_children(node, is_leaf_fn)
+        for i in range(len(children) - 1, -1, -1):
+            pending.append(children[i])
+
+
+def traverse_postorder(tree, is_leaf_fn=None):
+    """Yield nodes in postorder (each node after its descendants)."""
+    cdef list path = [tree]  # nodes from the root to the current one
+    cdef list path_children = [visible_children(tree, is_leaf_fn)]
+    cdef list nvisited = [0]  # number of visited children of each node in path
+    cdef list children
+    cdef Py_ssize_t nch
+
+    while path:
+        children = path_children[-1]
+        nch = nvisited[-1]
+        if nch < len(children):
+            nvisited[-1] = nch + 1
+            child = children[nch]
+            path.append(child)
+            path_children.append(visible_children(child, is_leaf_fn))
+            nvisited.append(0)
+        else:
+            path_children.pop()
+            nvisited.pop()
+            yield path.pop()
 
-        if not seen and not is_leaf:
-            visiting.append((node, True))  # add node back, but mark as seen
-            visiting += [(n, False) for n in node.children[::-1]]
+
+def traverse_prepostorder(tree, is_leaf_fn=None):
+    """Yield (is_post, node) before and after visiting the descendants.
+
+    The leaves (or nodes where is_leaf_fn is True) are visited only
+    once, with is_post == False.
+    """
+    cdef list path = [tree]  # nodes from the root to the current one
+    cdef list path_children = [visible_children(tree, is_leaf_fn)]
+    cdef list nvisited = [0]  # number of visited children of each node in path
+    cdef list children
+    cdef Py_ssize_t nch
+
+    yield False, tree
+    while path:
+        children = path_children[-1]
+        nch = nvisited[-1]
+        if nch < len(children):
+            nvisited[-1] = nch + 1
+            child = children[nch]
+            yield False, child
+            path.append(child)
+            path_children.append(visible_children(child, is_leaf_fn))
+            nvisited.append(0)
+        else:
+            path_children.pop()
+            nvisited.pop()
+            node = path.pop()
+            if children:
+                yield True, node
 
 
 def traverse_bfs(tree, is_leaf_fn=None):
@@ -569,59 +843,182 @@ def traverse_bfs(tree, is_leaf_fn=None):
             visiting.extend(node.children)
 
 
-# Position on the tree: current node, number of visited children.
-TreePos = namedtuple('TreePos', 'node nch')
+cdef list NO_CHILDREN = []
+
+cdef list visible_children(node, is_leaf_fn):
+    """Return a copy of the children of node that a traversal has to visit."""
+    if is_leaf_fn is not None and is_leaf_fn(node):
+        return NO_CHILDREN
+    cdef list children = node.children
+    return children[:] if children else NO_CHILDREN
+
+
+def traverse_ids(tree, strategy='preorder', is_leaf_fn=None):
+    """Yield the ids of the nodes of tree, in the order given by strategy.
+
+    The id of a node is its position in preorder, the same as in the
+    nodes returned by flatten(). They can be used to index arrays with
+    values for each node, instead of dicts.
+    """
+    nodes, _, ends = flatten(tree)
+
+    if strategy == 'preorder':
+        return preorder_ids(nodes, ends, is_leaf_fn)
+    elif strategy == 'postorder':
+        return postorder_ids(nodes, ends, is_leaf_fn)
+    elif strategy == 'levelorder':
+        return levelorder_ids(nodes, ends, is_leaf_fn)
+    else:
+        raise ValueError(f'unknown strategy: {strategy!r}')
+
+
+def preorder_ids(list nodes, ends_array, is_leaf_fn=None):
+    """Yield the ids of the nodes in preorder."""
+    cdef long long[:] ends = ends_array
+    cdef Py_ssize_t i = 0, n = len(nodes)
+
+    while i < n:
+        yield i
+        if is_leaf_fn is not None and is_leaf_fn(nodes[i]):
+            i = ends[i]  # skip its descendants
+        else:
+            i += 1
+
+
+def postorder_ids(list nodes, ends_array, is_leaf_fn=None):
+    """Yield the ids of the nodes in postorder."""
+    cdef long long[:] ends = ends_array
+    cdef Py_ssize_t i = 0, n = len(nodes)
+    cdef list path = []  # ids from the root to the current node
+
+    while i < n:
+        while path and ends[path[-1]] <= i:  # left their clades?
+            yield path.pop()
+
+        path.append(i)
+        if is_leaf_fn is not None and is_leaf_fn(nodes[i]):
+            i = ends[i]  # skip its descendants
+        else:
+            i += 1
+
+    while path:
+        yield path.pop()
+
 
-class Walker:
+def levelorder_ids(list nodes, ends_array, is_leaf_fn=None):
+    """Yield the ids of the nodes in level order."""
+    cdef long long[:] ends = ends_array
+    cdef Py_ssize_t i, j
+
+    pending = deque([0])
+    while pending:
+        i = pending.popleft()
+        yield i
+        if is_leaf_fn is None or not is_leaf_fn(nodes[i]):
+            j = i + 1  # first child
+            while j < ends[i]:
+                pending.append(j)
+                j = ends[j]  # next sibling
+
+
+def flatten(tree):
+    """Return the nodes in preorder, the index of their parents, and clade ends.
+
+    The clade of the node with index i consists of the nodes from i to
+    ends[i] (not included). The parents and ends are arrays of int64.
+    """
+    cdef list nodes = []
+    cdef list pending = [tree]  # nodes to visit
+    cdef list pending_parents = [-1]  # and the index of their parents
+    cdef Py_ssize_t i, n
+
+    parents_array = array('q')
+    while pending:
+        node = pending.pop()
+        parents_array.append(pending_parents.pop())
+        nodes.append(node)
+        children = node.children
+        if children:
+            pending += children[::-1]
+            pending_parents += [len(nodes) - 1] * len(children)
+
+    n = len(nodes)
+    ends_array = array('q', [1]) * n  # clade sizes, to turn into ends
+
+    cdef long long[:] parents = parents_array, ends = ends_array
+    for i in range(n - 1, 0, -1):
+        ends[parents[i]] += ends[i]
+    for i in range(n):
+        ends[i] += i
+
+    return nodes, parents_array, ends_array
+
+
+cdef class Walker:
     """Represents the position when traversing a tree."""
 
+    cdef public list path  # nodes from the root to the current one
+    cdef public list nvisited  # number of visited children of each node in path
+    cdef public bint descend
+    # Will look like: path = [root, child2, child25, child253]
+    #             nvisited = [2,    5,      3,       0]
+
     def __init__(self, root):
-        self.visiting = [TreePos(node=root, nch=0)]
-        # will look like: [(root, 2), (child2, 5), (child25, 3), (child253, 0)]
+        self.path = [root]
+        self.nvisited = [0]
         self.descend = True
 
     def go_back(self):
-        self.visiting.pop()
-        if self.visiting:
-            node, nch = self.visiting[-1]
-            self.visiting[-1] = TreePos(node, nch + 1)
+        self.path.pop()
+        self.nvisited.pop()
+        if self.nvisited:
+            self.nvisited[-1] += 1
         self.descend = True
 
     @property
     def node(self):
-        return self.visiting[-1].node
+        return self.path[-1]
 
     @property
     def node_id(self):
-        return tuple(branch.nch for branch in self.visiting[:-1])
+        return tuple(self.nvisited[:-1])
 
     @property
     def first_visit(self):
-        return self.visiting[-1].nch == 0
+        return self.nvisited[-1] == 0
 
     @property
     def has_unvisited_branches(self):
-        node, nch = self.visiting[-1]
-        return nch < len(node.children)
+        return self.nvisited[-1] < len(self.path[-1].children)
 
     def add_next_branch(self):
-        node, nch = self.visiting[-1]
-        self.visiting.append(TreePos(node=node.children[nch], nch=0))
+        self.path.append(self.path[-1].children[self.nvisited[-1]])
+        self.nvisited.append(0)
+
+    def skip_siblings(self, n):
+        """Make the traversal jump over the next n siblings of the node."""
+        self.nvisited[-2] += n
 
 
 def walk(tree):
     """Yield an iterator as it traverses the tree."""
-    it = Walker(tree)  # node iterator
-    while it.visiting:
-        if it.first_visit:
+    cdef Walker it = Walker(tree)  # node iterator
+    cdef list path = it.path, nvisited = it.nvisited
+    cdef Py_ssize_t nch
+
+    while path:
+        node = path[-1]
+        nch = nvisited[-1]
+        if nch == 0:  # first visit
             yield it
 
-            if it.node.is_leaf or not it.descend:
+            if not node.children or not it.descend:
                 it.go_back()
                 continue
 
-        if it.has_unvisited_branches:
-            it.add_next_branch()
+        if nch < len(node.children):  # has unvisited branches
+            path.append(node.children[nch])
+            nvisited.append(0)
         else:
             yield it
             it.go_back()
@@ -645,10 +1042,67 @@ def update_sizes_from(node):
 def update_size(node):
     """Update the size of the given node."""
     sumdists, nleaves = get_size(node.children)
-    dx = float(node.props.get('dist', 0 if node.up is None else 1)) + sumdists
+    dist = node.dist
+    dx = (dist if dist is not None else 0 if node.up is None else 1) + sumdists
     node.size = (dx, max(1, nleaves))
 
 
+# Incremental update of sizes.
+#
+# Once the sizes of a tree are computed (with update_sizes_all()), the
+# functions of Tree that change the topology or the branch lengths
+# (add_child(), remove_child(), detach(), setting node.dist, etc.) call
+# the ones below, which update only the sizes of the nodes affected:
+# from the change towards the root, and only while they change.
+#
+# A node with size (0, 0) has no size computed (else nleaves >= 1), and
+# nothing is updated for changes under it.
+
+def has_size(node):
+    """Return True if the size of the given node has been computed."""
+    return node.size[1] > 0
+
+
+def clear_sizes(tree):
+    """Remove the sizes of all the nodes (so changes do not update them)."""
+    for node in traverse_preorder(tree):
+        node.size = (0, 0)
+
+
+def update_sizes_missing(tree):
+    """Update the size of tree and of its descendants that have none.
+
+    The descendants with size just under them are updated too (but not
+    their own descendants), since their dist may count differently now
+    (if they were roots when their size was computed).
+    """
+    for node in traverse_postorder(tree, lambda n: n is not tree and has_size(n)):
+        update_size(node)
+
+
+def update_sizes_changed(node):
+    """Update the sizes from the given node towards the root, while needed."""
+    while node is not None and has_size(node):
+        size = node.size
+        update_size(node)
+        if node.size == size:
+            break  # the sizes of its ancestors will not change either
+        node = node.up
+
+
+def update_sizes_added(child):
+    """Update the sizes after child was added to a node with size."""
+    update_sizes_missing(child)
+    update_sizes_changed(child.up)
+
+
+def update_sizes_removed(parent, child):
+    """Update the sizes after child was removed from parent."""
+    if has_size(child):
+        update_size(child)  # its dist may count differently now
+    update_sizes_changed(parent)
+
+
 cdef (double, double) get_size(nodes):
     """Return the size of all the nodes stacked."""
     # The size of a node is (sumdists, nleaves) with sumdists the dist to
@@ -1,13 +1,22 @@
+cimport cython
+
 import copy
 import itertools
+import gc
 from hashlib import md5
-from functools import cmp_to_key
 import pickle
 import logging
 import math
+import weakref
+
+import numpy as np
 
 from . import text_viz
 from . import operations as ops
+from .columns import Columns
+from .lca import DistanceIndex
+from .nodeindex import NodeIndex, indexable
+from . import bipartitions as bp
 from .. import utils
 from ete4.parser import newick
 from ..parser import ete_format
@@ -32,6 +41,31 @@ class TreeError(Exception):
     pass
 
 
+# Objects (like indexes) that depend on trees, and must know when they
+# change. They have a method tree_changed(event, node, arg), which is
+# called after every change, with event being one of:
+#   'add': node has a new child, arg (with all its descendants)
+#   'remove': node lost its child arg
+#   'prop': the property of node named arg changed
+_observers = []  # weak references to them
+
+def add_observer(obj):
+    """Make obj.tree_changed(event, node, arg) be called when a tree changes."""
+    _observers.append(weakref.ref(obj, _observers.remove))
+
+def notify_change(event, node, arg):
+    """Tell the observers that node changed."""
+    for ref in _observers[:]:
+        obj = ref()
+        if obj is not None:
+            obj.tree_changed(event, node, arg)
+
+
+# How to copy the props of the nodes for each method of Tree.copy().
+COPY_PROPS = {'fast': 'shallow', 'fast-deep': 'deep', 'cow': 'shared'}
+
+
+@cython.trashcan(True)  # so deleting very deep trees does not crash
 cdef class Tree(object):
     """
     The Tree class is used to store a tree structure.
@@ -44,10 +78,13 @@ cdef class Tree(object):
     # TODO: Clean up all the memebers of Tree and leave only:
     #   up, props, children, size
     cdef public Tree up
-    cdef public dict props
+    cdef dict _props  # accessed through the props property
+    cdef bint _shared_props  # are _props shared with a copy? (copy-on-write)
     cdef public list _children
 
-    cdef public (double, double) size
+    cdef public (double, double) size  # (dist to farthest leaf, nleaves)
+
+    cdef public object _index  # NodeIndex, to find nodes by name quickly
 
     # All these members below should go away.
     cdef public object _img_style
@@ -96,11 +133,11 @@ cdef class Tree(object):
             assert (type(parser) in [dict, int] or
                     parser in [None, 'newick', 'ete', 'auto']), 'bad parser'
 
-            data = data.strip()
-
             if parser is None or parser == 'auto':
-                guess_format = lambda x: 'newick'  # TODO
-                parser = guess_format(data)
+                parser = 'ete' if ete_format.is_ete(data) else 'newick'
+
+            if parser != 'ete':
+                data = data.strip()
 
             if parser == 'newick':
                 self.init_from_newick(data)
@@ -117,15 +154,25 @@ cdef class Tree(object):
         self.props = tree.props
 
     def init_from_ete(self, data):
-        t = ete_format.loads(data)
-        self.name = t.name
-        self.dist = t.dist
-        self.support = t.support
-        self.children = t.children
+        tree = ete_format.loads(data, self.__class__)
+        self.children = tree.children
+        self.props = tree.props
+
+    @property
+    def props(self):
+        if self._shared_props:  # make our own copy, it may be modified
+            self._props = self._props.copy()
+            self._shared_props = False
+        return self._props
+
+    @props.setter
+    def props(self, value):
+        self._props = value
+        self._shared_props = False
 
     @property
     def name(self):
-        return str(self.props.get('name')) if 'name' in self.props else None
+        return str(self._props.get('name')) if 'name' in self._props else None
 
     @name.setter
     def name(self, value):
@@ -134,9 +181,12 @@ cdef class Tree(object):
         else:
             self.props.pop('name', None)
 
+        if _observers:
+            notify_change('prop', self, 'name')
+
     @property
     def dist(self):
-        return float(self.props['dist']) if 'dist' in self.props else None
+        return float(self._props['dist']) if 'dist' in self._props else None
 
     @dist.setter
     def dist(self, value):
@@ -145,9 +195,15 @@ cdef class Tree(object):
         else:
             self.props.pop('dist', None)
 
+        if self.size[1] > 0:  # sizes computed (see ops.update_sizes_changed())
+            ops.update_sizes_changed(self)
+
+        if _observers:
+            notify_change('prop', self, 'dist')
+
     @property
     def support(self):
-        return float(self.props['support']) if 'support' in self.props else None
+        return float(self._props['support']) if 'support' in self._props else None
 
     @support.setter
     def support(self, value):
@@ -156,13 +212,27 @@ cdef class Tree(object):
         else:
             self.props.pop('support', None)
 
+        if _observers:
+            notify_change('prop', self, 'support')
+
     @property
     def children(self):
         return self._children
 
     @children.setter
     def children(self, value):
-        self._children = []
+        old_children, self._children = self._children, []
+
+        for child in old_children or []:
+            if child.up is self:
+                child.up = None
+
+            if _observers:
+                notify_change('remove', self, child)
+
+        if old_children and self.size[1] > 0:
+            ops.update_sizes_changed(self)
+
         self.add_children(value)
 
     @property
@@ -206,7 +276,7 @@ cdef class Tree(object):
     def get_prop(self, prop, default=None):
         """Return the node's property prop (an attribute or in self.props)."""
         attr = getattr(self, prop, None)
-        return attr if attr is not None else self.props.get(prop, default)
+        return attr if attr is not None else self._props.get(prop, default)
 
     # TODO: Move all the next functions out of the Tree class.
     def _get_style(self):
@@ -283,6 +353,11 @@ cdef class Tree(object):
         """Return the node that matches the given node_id."""
         try:
             if type(node_id) == str:    # node_id can be the name of a node
+                nodes = self._lookup('name', node_id)  # with the index
+                if nodes == []:
+                    raise TreeError(f'No node found with name: {node_id}')
+                elif nodes is not None and len(nodes) == 1:
+                    return nodes[0]
                 return next(n for n in self.traverse() if n.name == node_id)
             elif type(node_id) == int:  # or the index of a child
                 return self.children[node_id]
@@ -349,6 +424,12 @@ cdef class Tree(object):
         """Add or update node's property to the given value."""
         self.props[name] = value
 
+        if name == 'dist' and self.size[1] > 0:
+            ops.update_sizes_changed(self)
+
+        if _observers:
+            notify_change('prop', self, name)
+
     def add_props(self, **props):
         """Add or update several properties."""
         for name, value in props.items():
@@ -358,6 +439,12 @@ cdef class Tree(object):
         """Permanently delete a node's property."""
         self.props.pop(prop_name, None)
 
+        if prop_name == 'dist' and self.size[1] > 0:
+            ops.update_sizes_changed(self)
+
+        if _observers:
+            notify_change('prop', self, prop_name)
+
     # DEPRECATED #
     def add_feature(self, pr_name, pr_value):
         """Add or update a node's feature."""
@@ -402,6 +489,12 @@ cdef class Tree(object):
         child.up = self
         self.children.append(child)
 
+        if self.size[1] > 0:
+            ops.update_sizes_added(child)
+
+        if _observers:
+            notify_change('add', self, child)
+
         return child
 
     def add_children(self, nodes):
@@ -417,6 +510,12 @@ cdef class Tree(object):
             if child.up == self:  # (it may point to another already!)
                 child.up = None  # child removes parent
 
+            if self.size[1] > 0:
+                ops.update_sizes_removed(self, child)
+
+            if _observers:
+                notify_change('remove', self, child)
+
             return child
         except ValueError as e:
             raise TreeError(f'Cannot pop child: not found ({e})')
@@ -436,6 +535,12 @@ cdef class Tree(object):
             if child.up == self:  # (it may point to another already!)
                 child.up = None  # child removes parent
 
+            if self.size[1] > 0:
+                ops.update_sizes_removed(self, child)
+
+            if _observers:
+                notify_change('remove', self, child)
+
             return child
         except (StopIteration, ValueError) as e:
             raise TreeError(f'Cannot remove child: not found ({e})')
@@ -526,9 +631,16 @@ cdef class Tree(object):
         function. This mechanism can be seen as a "cut and paste".
         """
         if self.up:
-            self.up.children.remove(self)
+            parent = self.up
+            parent.children.remove(self)
             self.up = None
 
+            if parent.size[1] > 0:
+                ops.update_sizes_removed(parent, self)
+
+            if _observers:
+                notify_change('remove', parent, self)
+
         return self
 
     def prune(self, nodes, preserve_branch_length=False):
@@ -536,7 +648,7 @@ cdef class Tree(object):
 
         It will only retain the minimum number of nodes that conserve the
         topological relationships among the requested nodes. The root node is
-        always conserved.
+        always conserved. It takes a time linear with the size of the tree.
 
         :param nodes: List of node names or objects that should be kept.
         :param bool preserve_branch_length: If True, branch lengths
@@ -589,60 +701,32 @@ cdef class Tree(object):
           # ╴root╶╌╴H╶╌╴F╶┤
           #               ╰╴B
         """
-        def cmp_nodes(x, y):
-            # if several nodes are in the same path of two kept nodes,
-            # only one should be maintained. This prioritize internal
-            # nodes that are already in the to_keep list and then
-            # deeper nodes (closer to the leaves).
-            if n2depth[x] > n2depth[y]:
-                return -1
-            elif n2depth[x] < n2depth[y]:
-                return 1
-            else:
-                return 0
-
-        to_keep = set(self._translate_nodes(nodes))
-        start = self.common_ancestor(to_keep)
-        node2path = {n: n.lineage() for n in to_keep}
-        to_keep.add(self)
-
-        # Calculate which kept nodes are visiting the same nodes in
-        # their path to the common ancestor.
-        n2count = {}
-        n2depth = {}
-        for seed, path in node2path.items():
-            for visited_node in path:
-                if visited_node not in n2depth:
-                    depth = visited_node.get_distance(visited_node, start,
-                                                      topological=True)
-                    n2depth[visited_node] = depth
-                if visited_node is not seed:
-                    n2count.setdefault(visited_node, set()).add(seed)
-
-        # if several internal nodes are in the path of exactly the same kept
-        # nodes, only one (the deepest) should be maintain.
-        visitors2nodes = {}
-        for node, visitors in n2count.items():
-            # keep nodes connection at least two other nodes
-            if len(visitors)>1:
-                visitor_key = frozenset(visitors)
-                visitors2nodes.setdefault(visitor_key, set()).add(node)
-
-        for visitors, nodes in visitors2nodes.items():
-            if not (to_keep & nodes):
-                sorted_nodes = sorted(nodes, key=cmp_to_key(cmp_nodes))
-                to_keep.add(sorted_nodes[0])
-
-        for n in self.descendants('postorder'):
-            if n not in to_keep:
-                if preserve_branch_length and n.dist is not None:
-                    if len(n.children) == 1:
-                        if n.children[0].dist is not None:
-                            n.children[0].dist += n.dist
-                    elif len(n.children) > 1 and n.up and n.up.dist is not None:
-                        n.up.dist += n.dist
-
-                n.delete(prevent_nondicotomic=False)
+        nodes = self._translate_nodes(nodes)
+
+        try:
+            ops.prune(self, nodes, preserve_branch_length)
+        except ValueError as e:
+            raise TreeError(f'Cannot prune to nodes {nodes}: {e}')
+
+    def pruned(self, nodes, preserve_branch_length=False):
+        """Return a new tree with the topology that prune() would leave.
+
+        The original tree is not changed (nor copied): the returned
+        tree has new nodes, with a copy of the properties of the kept
+        nodes. See :func:`prune` for the arguments.
+
+        Example::
+
+          t = Tree('(((A,B)C,D)E,F)root;', parser=1)
+          print(t.pruned(['A', 'B', 'F']).write(parser=1, format_root_node=True))
+          # (F,(A,B)C)root;
+        """
+        nodes = self._translate_nodes(nodes)
+
+        try:
+            return ops.pruned(self, nodes, preserve_branch_length)
+        except ValueError as e:
+            raise TreeError(f'Cannot prune to nodes {nodes}: {e}')
 
     def reverse_children(self):
         """Reverse current children order."""
@@ -704,26 +788,47 @@ cdef class Tree(object):
         if strategy == 'levelorder':
             yield from ops.traverse_bfs(self, is_leaf_fn)
         elif strategy == 'preorder':
-            yield from ops.traverse(self, order=-1, is_leaf_fn=is_leaf_fn)
+            yield from ops.traverse_preorder(self, is_leaf_fn)
         elif strategy == 'postorder':
-            yield from ops.traverse(self, order=+1, is_leaf_fn=is_leaf_fn)
+            yield from ops.traverse_postorder(self, is_leaf_fn)
         else:
             raise TreeError(f'Unknown strategy: {strategy}')
 
+    def traverse_ids(self, strategy='preorder', is_leaf_fn=None):
+        """Traverse the tree under this node and yield the ids of the nodes.
+
+        The id of a node is its position in preorder (0 for this node),
+        which is also its index in ``list(self.traverse('preorder'))``.
+        They are useful for algorithms that keep the values for each
+        node in arrays instead of in dicts or node properties.
+
+        Example (number of leaves under each node)::
+
+          nodes, parents, _ = ete4.core.operations.flatten(t)
+          nleaves = [0] * len(nodes)
+          for i in t.traverse_ids('postorder'):  # children before parents
+              if nodes[i].is_leaf:
+                  nleaves[i] = 1
+              if i > 0:
+                  nleaves[parents[i]] += nleaves[i]
+
+        :param strategy: Order in which the ids are yielded:
+            "preorder", "postorder" or "levelorder".
+        :param is_leaf_fn: Function to check if a node is terminal (as
+            in traverse()). The ids are the same as without it.
+        """
+        if strategy not in ['preorder', 'postorder', 'levelorder']:
+            raise TreeError(f'Unknown strategy: {strategy}')
+
+        return ops.traverse_ids(self, strategy, is_leaf_fn)
+
     def iter_prepostorder(self, is_leaf_fn=None):
         """Yield all nodes in a tree in both pre and post order.
 
         Each iteration returns a postorder flag (True if node is being visited
         in postorder) and a node instance.
         """
-        path = []  # path of nodes from the root to the current one
-        for node in ops.traverse(self, order=0, is_leaf_fn=is_leaf_fn):
-            seen = path and node is path[-1]  # has the current node been seen?
-            yield seen, node
-            if seen:
-                path.pop()
-            elif not node.is_leaf:
-                path.append(node)
+        yield from ops.traverse_prepostorder(self, is_leaf_fn)
 
     def ancestors(self, root=None, include_root=True):
         """Yield all ancestor nodes of this node (up to the root if given)."""
@@ -760,6 +865,15 @@ cdef class Tree(object):
             return list(nodes)  # avoid traversing tree if no names to translate
 
         name2node = {}
+
+        if self._index is not None and 'name' in self._index.props:
+            for name in names:
+                found = self._index.lookup('name', name)
+                assert len(found) < 2, f'Ambiguous node name: {name}'
+                if found:
+                    name2node[name] = found[0]
+            return [name2node[n] if type(n) == str else n for n in nodes]
+
         for node in self.traverse():
             if node.name in names:
                 assert node.name not in name2node, f'Ambiguous node name: {node.name}'
@@ -777,7 +891,7 @@ cdef class Tree(object):
             rooting = 'No children'
 
         max_node, max_dist = self.get_farthest_leaf()
-        cached_content = self.get_cached_content()
+        cached_content = self.get_cached_content(container_type=range)
 
         return '\n'.join([
             'Number of leaf nodes: %d' % len(cached_content[self]),
@@ -787,21 +901,36 @@ cdef class Tree(object):
             'Max. distance: %g' % max_dist])
 
     def write(self, outfile=None, props=(), parser=None,
-              format_root_node=False, is_leaf_fn=None):
-        """Return or write to file the newick representation.
+              format_root_node=False, is_leaf_fn=None, format='newick'):
+        """Return or write to file the newick (or ete format) representation.
 
         :param str outfile: Name of the output file. If present, it will write
-            the newick to that file instad of returning it as a string.
+            the newick to that file instad of returning it as a string. The
+            newick is written in chunks, so it is never fully in memory.
         :param list props: Properties to write for all nodes using the Extended
             Newick Format. If None, write all available properties.
         :param parser: Parser used to encode the tree in newick format.
         :param bool format_root_node: If True, write content of the root node
             too. For compatibility reasons, this is False by default.
+        :param str format: Format of the output, "newick" or "ete". The ete
+            format is binary (bytes), keeps the types of all the properties
+            (or only of the ones in props, if given) and is faster to read.
 
         Example::
 
           t.write(props=['species', 'sci_name'])
+          t.write('tree.ete', format='ete')
         """
+        if format == 'ete':
+            if not outfile:
+                return ete_format.dumps(self, props or None)
+            else:
+                with open(outfile, 'wb') as fp:
+                    ete_format.dump(self, fp, props or None)
+                return
+
+        assert format == 'newick', f'unknown format: {format}'
+
         parser = newick.INT_PARSERS[parser] if type(parser) == int else parser
 
         if not outfile:
@@ -824,6 +953,21 @@ cdef class Tree(object):
 
         return root
 
+    def to_columns(self, props=()):
+        """Return a Columns object with the given props of all nodes as arrays.
+
+        It allows vectorised queries on the properties (and statistics
+        per clade). It is a snapshot: after changing the tree, call its
+        ``update()``, and to copy its values back to the nodes, ``store()``.
+
+        Example::
+
+          cols = t.to_columns(['support'])
+          for node in cols.filter(cols.mask('support', '<', 0.5)):
+              node.delete()
+        """
+        return Columns(self, props)
+
     def search_nodes(self, **conditions):
         """Yield nodes matching the given conditions.
 
@@ -832,10 +976,31 @@ cdef class Tree(object):
           for node in tree.search_nodes(dist=0.0, name='human'):
               print(node.prop['support'])
         """
-        for n in self.traverse():
-            if all(n.props.get(key) == value or getattr(n, key, None) == value
-                   for key, value in conditions.items()):
-                yield n
+        def matches(n):
+            return all(n.props.get(key) == value or getattr(n, key, None) == value
+                       for key, value in conditions.items())
+
+        for key, value in conditions.items():
+            nodes = self._lookup(key, value)  # with the index, if possible
+            if nodes is not None:
+                yield from sorted(filter(matches, nodes),
+                                  key=lambda n: (n.level, n.id))  # as traverse()
+                return
+
+        yield from filter(matches, self.traverse())
+
+    def _lookup(self, prop, value):
+        """Return list of nodes with the given prop value, using the index.
+
+        If there is no index for prop (or value cannot be indexed),
+        return None.
+        """
+        if (self._index is None or prop not in self._index.props or
+            (prop != 'name' and hasattr(type(self), prop)) or  # computed
+            not indexable(value)):
+            return None
+
+        return self._index.lookup(prop, value)
 
     def search_descendants(self, **conditions):
         """Yield descendant nodes matching the given conditions."""
@@ -861,6 +1026,9 @@ cdef class Tree(object):
     def get_distance(self, node1, node2, topological=False):
         """Return the distance between the given nodes.
 
+        To compute many distances in the same tree, it is much faster
+        to use an index (see :func:`build_distance_index`).
+
         :param node1: A node within the same tree structure.
         :param node2: Another node within the same tree structure.
         :param topological: If True, distance will refer to the number of
@@ -875,6 +1043,47 @@ cdef class Tree(object):
         return (sum(d(n) for n in node1.lineage(root, include_root=False)) +
                 sum(d(n) for n in node2.lineage(root, include_root=False)))
 
+    def build_index(self, props=('name',)):
+        """Build and return an index to find nodes by their properties.
+
+        With the index, finding nodes by name (like in ``t['A']``,
+        :func:`search_nodes`, :func:`prune`, etc.) does not need to
+        traverse the tree. It updates itself after the tree changes.
+
+        :param props: Properties of the nodes to index.
+
+        Example::
+
+          t.build_index()
+          t['A']  # found directly
+          t.prune(['A', 'B', 'C'])  # nodes found directly
+        """
+        self._index = NodeIndex(self, props)
+        add_observer(self._index)
+        return self._index
+
+    def drop_index(self):
+        """Remove the index of nodes (see :func:`build_index`)."""
+        self._index = None
+
+    def build_distance_index(self):
+        """Return an index to find common ancestors and distances quickly.
+
+        The index answers in constant time (and for many pairs of nodes
+        at once) the same as :func:`common_ancestor` and
+        :func:`get_distance`. It updates itself after the tree changes.
+
+        Example::
+
+          index = t.build_distance_index()
+          index.lca('A', 'B')  # lowest common ancestor of nodes A and B
+          index.distance('A', 'B')  # distance between them
+          index.distances([('A', 'B'), ('A', 'C')])  # array with distances
+        """
+        index = DistanceIndex(self)
+        add_observer(index)
+        return index
+
     def get_farthest_node(self, topological=False):
         """Returns the farthest descendant or ancestor node, and its distance.
 
@@ -1141,6 +1350,15 @@ cdef class Tree(object):
            copied based on the standard "copy" Python functionality
            (this is the slowest method but it allows to copy complex
            objects even if attributes point to lambda functions, etc.)
+        - "fast": New nodes with the same structure, each with a
+           shallow copy of the properties (the values, like lists,
+           are shared with the original). Much faster than "cpickle".
+        - "fast-deep": Like "fast", but with a deep copy of the values
+           of the properties too (similar to "cpickle").
+        - "cow": Like "fast", but the properties are shared with the
+           original nodes until they are accessed with ``node.props``
+           or modified (copy-on-write). The fastest, to make many
+           copies that are read more than written.
         """
         method = method.lower()
         if method=="newick":
@@ -1158,6 +1376,8 @@ cdef class Tree(object):
             self.up = None
             new_node = pickle.loads(pickle.dumps(self, 2))
             self.up = parent
+        elif method in COPY_PROPS:
+            new_node = copy_nodes(self, COPY_PROPS[method])
         else:
             raise TreeError("Invalid copy method")
 
@@ -1169,8 +1389,14 @@ cdef class Tree(object):
 
     def sort_descendants(self, prop='name'):
         """Sort branches by leaf node values (names or any other given prop)."""
-        leaf_values = self.get_cached_content(prop, container_type=list)
-        ops.sort(self, key=lambda node: tuple(sorted(leaf_values[node])))
+        values = [leaf.get_prop(prop) for leaf in self.leaves()]
+        leaf_ranges = self.get_cached_content(container_type=range)
+
+        def key(node):
+            r = leaf_ranges[node]
+            return tuple(sorted(values[r.start:r.stop]))
+
+        ops.sort(self, key=key)
 
     def get_cached_content(self, prop=None, container_type=set,
                            leaves_only=True):
@@ -1183,33 +1409,46 @@ cdef class Tree(object):
         ``container_type``). And instead of the leaves themselves, it
         can be any of their properties (like their names, with ``prop``).
 
+        For big trees, a more compact representation can be requested
+        with ``container_type`` being ``range`` or ``int``. Then each
+        node gets the positions of its leaves in ``list(self.leaves())``
+        (which are consecutive), as a range or as a bitset (an int with
+        those bits set). With ``leaves_only=False``, the positions are
+        in the list of all nodes in preorder.
+
         :param prop: Node property that should be cached (i.e.
             name, distance, etc.). If None, it caches the node itself.
-        :param container_type: Type of container for the leaves (set, list).
+        :param container_type: Type of container for the leaves (set,
+            list, range, int).
         :param leaves_only: If False, for each node it stores all its
             descendant nodes, not only its leaves.
         """
-        def get_content():  # return the node itself, or its requested prop
-            return self if prop is None else self.get_prop(prop)
+        nodes, _, ends = ops.flatten(self)  # the nodes of a clade go together
+        n = len(nodes)
 
-        # Leaves, or nodes, or just their requested property, for each node.
-        leaves = {self: container_type(
-            [get_content()] if self.is_leaf or not leaves_only else [])}
+        if leaves_only:  # starts[i] = number of leaves before node i
+            starts = []
+            items = []  # the leaves, in preorder
+            for node in nodes:
+                starts.append(len(items))
+                if node.is_leaf:
+                    items.append(node)
+            starts.append(len(items))
+            stops = [starts[end] for end in ends]
+        else:
+            starts, stops, items = range(n), ends, nodes
 
-        for node in self.children:
-            node_leaves = node.get_cached_content(prop=prop,
-                                                  container_type=container_type,
-                                                  leaves_only=leaves_only)
-            # Update the leaves dictionary.
-            leaves.update(node_leaves)
+        if container_type is range:
+            return {node: range(starts[i], stops[i])
+                    for i, node in enumerate(nodes)}
+        elif container_type is int:
+            return {node: (1 << stops[i]) - (1 << starts[i])
+                    for i, node in enumerate(nodes)}
 
-            # Update the leaves (or nodes, or their prop) assigned to self.
-            if container_type == set:
-                leaves[self].update(node_leaves[node])
-            elif container_type == list:
-                leaves[self].extend(node_leaves[node])
+        values = items if prop is None else [x.get_prop(prop) for x in items]
 
-        return leaves
+        return {node: container_type(values[starts[i]:stops[i]])
+                for i, node in enumerate(nodes)}
 
     def robinson_foulds(self, t2, prop_t1='name', prop_t2='name',
                         unrooted_trees=False, expand_polytomies=False,
@@ -1292,85 +1531,35 @@ cdef class Tree(object):
 
             polytomy_correction = max(corr1, corr2)
 
-        def from_common(nodes, prop):  # helper function
-            """Yield values (if existing in both trees) for property prop."""
-            for node in nodes:
-                if has_prop(node, prop):
-                    value = node.get_prop(prop)
-                    if value in common:
-                        yield value
+        # The splits are bitsets of the common values (in sorted order).
+        values = sorted(common)
+        keys = bp.get_keys(values)
+        total = bp.total_key(keys)
 
         min_comparison = None
         for t1 in origin_trees:
-            t1_leaves = t1.get_cached_content()
-            t1_leaves_all = t1_leaves[t1]
-
-            if unrooted_trees:
-                edges1 = {  # set that looks like {((a, b, ...), (x, y, ...)), ...}
-                    tuple(sorted([
-                        tuple(sorted(from_common(leaves, prop_t1))),
-                        tuple(sorted(from_common(t1_leaves_all - leaves, prop_t1)))]))
-                    for leaves in t1_leaves.values()}
-                edges1.discard(((), ()))  # probably unnecessary
-            else:
-                edges1 = {tuple(sorted(from_common(leaves, prop_t1)))
-                          for leaves in t1_leaves.values()}
-                edges1.discard(())
-
-            if min_support_t1:
-                support_t1 = {tuple(sorted(from_common(leaves, prop_t1) for n in leaves)): branch.support or 0
-                              for branch, leaves in t1_leaves.items()}
+            splits1, support_t1 = bp.get_splits(t1, prop_t1, keys, unrooted_trees)
+            discard_t1 = bp.discarded(splits1, support_t1, min_support_t1,
+                                      total, unrooted_trees)
 
             for t2 in target_trees:
-                t2_leaves = t2.get_cached_content()
-                t2_leaves_all = t2_leaves[t2]
-
-                if unrooted_trees:
-                    edges2 = {
-                        tuple(sorted([
-                            tuple(sorted(from_common(leaves, prop_t2))),
-                            tuple(sorted(from_common(t2_leaves_all - leaves, prop_t2)))]))
-                        for leaves in t2_leaves.values()}
-                    edges2.discard(((), ()))
-                else:
-                    edges2 = {tuple(sorted(from_common(leaves, prop_t2)))
-                              for leaves in t2_leaves.values()}
-                    edges2.discard(())
-
-                if min_support_t2:
-                    support_t2 = {tuple(sorted(from_common(leaves, prop_t2) for n in leaves)): branch.support or 0
-                                  for branch, leaves in t2_leaves.items()}
-
-                # if a support value is passed as a constraint, discard lowly supported branches from the analysis
-                discard_t1, discard_t2 = set(), set()
-                if min_support_t1 and unrooted_trees:
-                    discard_t1 = {p for p in edges1 if support_t1.get(p[0], support_t1.get(p[1], math.inf)) < min_support_t1}
-                elif min_support_t1:
-                    discard_t1 = {p for p in edges1 if support_t1[p] is not None and support_t1[p] < min_support_t1}
-
-                if min_support_t2 and unrooted_trees:
-                    discard_t2 = {p for p in edges2 if support_t2.get(p[0], support_t2.get(p[1], math.inf)) < min_support_t2}
-                elif min_support_t2:
-                    discard_t2 = {p for p in edges2 if support_t2[p] is not None and support_t2[p] < min_support_t2}
+                splits2, support_t2 = bp.get_splits(t2, prop_t2, keys, unrooted_trees)
+                discard_t2 = bp.discarded(splits2, support_t2, min_support_t2,
+                                          total, unrooted_trees)
 
                 # the two root edges are never counted here, as they are always
                 # present in both trees because of the common property filters
-                rf = len(((edges1 ^ edges2) - discard_t2) - discard_t1) - polytomy_correction
-
-                if unrooted_trees:
-                    max_parts = (
-                        sum(1 for p in edges1 - discard_t1 if len(p[0]) > 1 and len(p[1]) > 1) +
-                        sum(1 for p in edges2 - discard_t2 if len(p[0]) > 1 and len(p[1]) > 1))
-                else:
-                    # Otherwise we need to count the actual number of valid
-                    # partitions in each tree -2 is to avoid counting the root
-                    # partition of the two trees (only needed in rooted trees)
-                    max_parts = (
-                        sum(1 for p in edges1 - discard_t1 if len(p) > 1) +
-                        sum(1 for p in edges2 - discard_t2 if len(p) > 1)) - 2
+                rf, max_parts = bp.rf(splits1, splits2, discard_t1, discard_t2,
+                                      unrooted_trees)
+                rf -= polytomy_correction
 
                 if not min_comparison or (min_comparison[0] is not None and min_comparison[0] > rf):
-                    min_comparison = [rf, max_parts, common, edges1, edges2, discard_t1, discard_t2]
+                    min_comparison = [rf, max_parts, common,
+                                      splits1, splits2, discard_t1, discard_t2]
+
+        # Return the edges as tuples of values (instead of bitsets).
+        min_comparison[3:] = [bp.to_edges(splits, values, unrooted_trees)
+                              for splits in min_comparison[3:]]
 
         return min_comparison
 
@@ -1754,7 +1943,7 @@ cdef class Tree(object):
         """
         ops.resolve_polytomy(self, descendants)
 
-    def cophenetic_matrix(self):
+    def cophenetic_matrix(self, dtype=np.float64, condensed=False, out=None):
         """Return a cophenetic distance matrix of the tree.
 
         The `cophenetic matrix
@@ -1782,26 +1971,14 @@ cdef class Tree(object):
           d(A,E) = d(z,A) + d(z,E)
                  = (d(z,y) + d(y,A)) + (d(z,x) + d(x,w) + d(w,E))
 
-        To compute it, we use an idea from
-        https://gist.github.com/jhcepas/279f9009f46bf675e3a890c19191158b
-
-        First, for each node we find its path to the root. For example::
-
-          A -> A, y, z
-          E -> E, w, x, z
+        So the distance between two leaves is the sum of their
+        distances to the root, minus twice the distance from the root
+        to their common ancestor.
 
-        and make these orderless sets. Then we XOR the two sets to
-        only find the elements that are in one or other sets but not
-        both. In this case A, E, y, x, w.
-
-        The distance between the two nodes is the sum of the distances
-        from each of those nodes to the parent
-
-        One more optimization: since the distances are symmetric, and
-        distance to itself is zero we user itertools.combinations
-        rather than itertools.permutations. This cuts our computes
-        from theta(n^2) 1/2n^2 - n (= O(n^2), which is still not
-        great, but in reality speeds things up for large trees).
+        To compute it, we use that for each node, the leaves in one of
+        its children and the leaves in the children after it have that
+        node as their common ancestor. So we can fill the matrix in
+        blocks, writing each pair of leaves only once, in O(n^2).
 
         For this tree, we will return the two dimensional array::
 
@@ -1812,46 +1989,72 @@ cdef class Tree(object):
           D  d(D,z) + d(A,z)  d(D,z) + d(B,z)  d(D,x) + d(C,x)         0         d(D,w) + d(E,w)
           E  d(E,z) + d(A,z)  d(E,z) + d(B,z)  d(E,x) + d(C,x)  d(E,w) + d(D,w)         0
 
-        We will also return the one dimensional array with the leaves
-        in the order in which they appear in the matrix (i.e. the
-        column and/or row headers).
-        """
-        leaves = list(self.leaves())
-        paths = {x: set() for x in leaves}
-
-        # get the paths going up the tree
-        # we get all the nodes up to the last one and store them in a set
+        We will also return the list with the names of the leaves in
+        the order in which they appear in the matrix (i.e. the column
+        and/or row headers). The leaves are sorted by name.
 
-        for n in leaves:
-            if n.is_root:
-                continue
-            movingnode = n
-            while not movingnode.is_root:
-                paths[n].add(movingnode)
-                movingnode = movingnode.up
-
-        # now we want to get all pairs of nodes using itertools combinations. We need AB AC etc but don't need BA CA
+        Branches without a distance count as 1.
 
-        leaf_distances = {x.name: {} for x in leaves}
-
-        for (leaf1, leaf2) in itertools.combinations(leaves, 2):
-            # figure out the unique nodes in the path
-            uniquenodes = paths[leaf1] ^ paths[leaf2]
-            distance = sum(x.dist for x in uniquenodes)
-            leaf_distances[leaf1.name][leaf2.name] = leaf_distances[leaf2.name][leaf1.name] = distance
+        :param dtype: Type of the values of the matrix (like "float32",
+            which takes half the memory).
+        :param condensed: If True, return instead a vector with the
+            upper triangle of the matrix (as scipy's squareform()).
+        :param out: If given, name of the file (.npy) where the matrix
+            is stored, and which is returned memory-mapped. Useful
+            for trees with many leaves.
+        """
+        nodes, parents, ends = ops.flatten(self)
+
+        # Distance from the root to each node (the nodes are in preorder).
+        depths = [0.0] * len(nodes)
+        for i in range(1, len(nodes)):
+            node = nodes[i]
+            depths[i] = depths[parents[i]] + (node.dist if 'dist' in node.props else 1)
+
+        is_leaf = [end == i + 1 for i, end in enumerate(ends)]
+        first_leaf = [0] + list(itertools.accumulate(is_leaf))  # leaves before i
+        leaf_depths = np.array([d for d, x in zip(depths, is_leaf) if x])
+
+        # Leaves sorted by name, and their positions in the matrix.
+        names = [nodes[i].name for i, x in enumerate(is_leaf) if x]
+        order = sorted(range(len(names)),
+                       key=lambda k: (names[k] is None, names[k] or ''))
+        names = [names[k] for k in order]
+        position = np.empty(len(names), dtype=np.int64)
+        position[order] = np.arange(len(names))
+
+        n = len(names)
+        shape = (n * (n - 1) // 2,) if condensed else (n, n)
+        if out is None:
+            matrix = np.zeros(shape, dtype=dtype)
+        else:  # the new file is filled with zeros
+            matrix = np.lib.format.open_memmap(out, mode='w+',
+                                               dtype=dtype, shape=shape)
+
+        for i in range(len(nodes)):
+            child = i + 1
+            while child < ends[i]:  # for each child of node i
+                # Leaves in the child, and leaves in the children after it.
+                leaves1 = slice(first_leaf[child], first_leaf[ends[child]])
+                leaves2 = slice(first_leaf[ends[child]], first_leaf[ends[i]])
+
+                block = (leaf_depths[leaves1, None] + leaf_depths[None, leaves2]
+                         - 2 * depths[i])
+
+                rows, cols = position[leaves1, None], position[None, leaves2]
+                if condensed:
+                    r, c = np.minimum(rows, cols), np.maximum(rows, cols)
+                    matrix[n * r - r * (r + 1) // 2 + c - r - 1] = block
+                else:
+                    matrix[rows, cols] = block
+                    matrix[cols.T, rows.T] = block.T
 
-        allleaves = sorted(leaf_distances.keys()) # the leaves in order that we will return
+                child = ends[child]
 
-        output = [] # the two dimensional array that we will return
+        if out is not None:
+            matrix.flush()
 
-        for i, n in enumerate(allleaves):
-            output.append([])
-            for m in allleaves:
-                if m == n:
-                    output[i].append(0) # distance to ourself = 0
-                else:
-                    output[i].append(leaf_distances[n][m])
-        return output, allleaves
+        return matrix, names
 
     # TODO: All the following "face and style functions" should go away.
 
@@ -2009,3 +2212,68 @@ cdef class Tree(object):
                     ete_node.add_child(ete_ch)
                     all_nodes[ch] = ete_ch
             return ete_ch.root
+
+
+cdef Tree copy_nodes(Tree tree, str props_mode):
+    """Return a copy of tree, made node by node (without serializing).
+
+    :param props_mode: How to copy the props of each node: "shallow"
+        (copy the dict), "deep" (copy the values too) or "shared"
+        (share the dict until it is accessed, copy-on-write).
+    """
+    cdef Tree node, node_copy, child, child_copy
+
+    memo = {}  # for copy.deepcopy(), so shared values are copied only once
+
+    gc_enabled = gc.isenabled()
+    gc.disable()  # as in newick.loads(), do not collect while creating nodes
+    try:
+        root = copy_node(tree, props_mode, memo)
+        pending = [(tree, root)]
+        while pending:
+            node, node_copy = pending.pop()
+
+            children = []
+            for child in node._children:
+                child_copy = copy_node(child, props_mode, memo)
+                child_copy.up = node_copy
+                children.append(child_copy)
+                pending.append((child, child_copy))
+
+            node_copy._children = children
+
+        return root
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+cdef Tree copy_node(Tree node, str props_mode, dict memo):
+    """Return a copy of the given node, without children or parent."""
+    cdef Tree new
+    if type(node) is Tree:
+        new = Tree.__new__(Tree)  # fast (no need to look up __new__)
+    else:
+        new = node.__class__.__new__(node.__class__)
+        new.__dict__.update(node.__dict__)  # attributes of subclasses
+
+    if props_mode == 'shallow':
+        new._props = node._props.copy()
+    elif props_mode == 'deep':
+        new._props = copy.deepcopy(node._props, memo)
+    elif props_mode == 'shared':
+        new._props = node._props
+        new._shared_props = node._shared_props = True
+    else:
+        raise ValueError(f'unknown props_mode: {props_mode}')
+
+    new._children = []
+    new.size = node.size
+    if node._img_style is not None:
+        new._img_style = copy.copy(node._img_style)
+    if node._sm_style is not None:
+        new._sm_style = copy.copy(node._sm_style)
+    new._initialized = node._initialized
+    new._collapsed = node._collapsed
+
+    return new
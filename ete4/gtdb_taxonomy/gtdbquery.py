@@ -4,7 +4,7 @@ import sys
 import os
 
 import pickle
-from collections import defaultdict, Counter
+from collections import defaultdict
 
 from hashlib import md5
 
@@ -13,8 +13,12 @@ import math
 import tarfile
 import warnings
 import requests
+from array import array
 
 from ete4 import ETE_DATA_HOME, update_ete_data
+from ..ncbi_taxonomy.bulkquery import select_in
+from ..ncbi_taxonomy.lrucache import LRUCache, taxid_set
+from ..ncbi_taxonomy.taxindex import load_index, index_from_tree, index_path
 
 
 __all__ = ["GTDBTaxa", "is_taxadb_up_to_date"]
@@ -22,6 +26,7 @@ __all__ = ["GTDBTaxa", "is_taxadb_up_to_date"]
 DB_VERSION = 2
 DEFAULT_GTDBTAXADB = ETE_DATA_HOME + '/gtdbtaxa.sqlite'
 DEFAULT_GTDBTAXADUMP = ETE_DATA_HOME + '/gtdbdump.tar.gz'
+DEFAULT_CACHE_SIZE = 100000  # number of ranks, names and lineages to cache
 
 def is_taxadb_up_to_date(dbfile=DEFAULT_GTDBTAXADB):
     """Check if a valid and up-to-date gtdbtaxa.sqlite database exists
@@ -46,7 +51,17 @@ class GTDBTaxa:
     Local transparent connector to the GTDB taxonomy database.
     """
 
-    def __init__(self, dbfile=None, taxdump_file=None, memory=False):
+    def __init__(self, dbfile=None, taxdump_file=None, memory=False,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        """Open and keep a connection to the GTDB taxonomy database.
+
+        :param cache_size: Number of ranks, names and lineages (each)
+            of the most recently used taxids to keep in memory.
+        """
+        self._caches = {'rank': LRUCache(cache_size),
+                        'name': LRUCache(cache_size),
+                        'lineage': LRUCache(cache_size)}
+        self._taxindex = None  # TaxonomyIndex, loaded when first needed
 
         if not dbfile:
             self.dbfile = DEFAULT_GTDBTAXADB
@@ -89,17 +104,34 @@ class GTDBTaxa:
         :param taxdump_file: Alternative location of gtdbtaxdump.tar.gz.
         """
         update_db(self.dbfile, targz_file=taxdump_file)
+        self.clear_cache()
+        self._taxindex = None
 
     def _connect(self):
         self.db = sqlite3.connect(self.dbfile)
 
+    def cache_info(self):
+        """Return dict with the hits, misses and sizes of the caches."""
+        return {kind: cache.info() for kind, cache in self._caches.items()}
+
+    def clear_cache(self):
+        """Remove all the values kept in the caches."""
+        for cache in self._caches.values():
+            cache.clear()
+
+    def _get_taxindex(self):
+        """Return the index of the taxonomy tree (loading it the first time)."""
+        if self._taxindex is None:
+            self._taxindex = load_index(self.dbfile)
+        return self._taxindex
+
     def _translate_merged(self, all_taxids):
         conv_all_taxids = set((list(map(int, all_taxids))))
-        cmd = 'select taxid_old, taxid_new FROM merged WHERE taxid_old IN (%s)' %','.join(map(str, all_taxids))
+        rows = select_in(self.db, 'taxid_old, taxid_new',
+                         'merged', 'taxid_old', conv_all_taxids)
 
-        result = self.db.execute(cmd)
         conversion = {}
-        for old, new in result.fetchall():
+        for old, new in rows:
             conv_all_taxids.discard(int(old))
             conv_all_taxids.add(int(new))
             conversion[int(old)] = int(new)
@@ -151,36 +183,32 @@ class GTDBTaxa:
 
     def _get_rank(self, taxids):
         """Return dictionary converting taxids to their GTDB taxonomy rank."""
-        ids = ','.join('"%s"' % v for v in set(taxids) - {None, ''})
-        result = self.db.execute('SELECT taxid, rank FROM species WHERE taxid IN (%s)' % ids)
-        return {tax: spname for tax, spname in result.fetchall()}
+        return self._caches['rank'].get_many(taxid_set(taxids),
+                                             self._fetch_ranks)
+
+    def _fetch_ranks(self, taxids):
+        return dict(select_in(self.db, 'taxid, rank', 'species', 'taxid', taxids))
     
     def get_rank(self, taxids):
-        taxid2rank = {}
+        """Return dictionary converting taxnames to their GTDB taxonomy rank."""
         name2ids = self._get_name_translator(taxids)
-        overlap_ids = name2ids.values()
-        taxids = [item for sublist in overlap_ids for item in sublist]
-        """Return dictionary converting taxids to their GTDB taxonomy rank."""
-        ids = ','.join('"%s"' % v for v in set(taxids) - {None, ''})
-        result = self.db.execute('SELECT taxid, rank FROM species WHERE taxid IN (%s)' % ids)
-        for tax, rank in result.fetchall():
-            taxid2rank[list(self._get_taxid_translator([tax]).values())[0]] = rank
-        
-        return taxid2rank
+        id2rank = self._get_rank(tax for ids in name2ids.values() for tax in ids)
+        id2name = self._get_taxid_translator(id2rank)
+        return {id2name[tax]: rank for tax, rank in id2rank.items()}
 
     def _get_lineage_translator(self, taxids):
         """Given a valid taxid number, return its corresponding lineage track as a
         hierarchically sorted list of parent taxids.
         """
-        all_ids = set(taxids)
-        all_ids.discard(None)
-        all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        result = self.db.execute('SELECT taxid, track FROM species WHERE taxid IN (%s);' %query)
-        id2lineages = {}
-        for tax, track in result.fetchall():
-            id2lineages[tax] = list(map(int, reversed(track.split(","))))
-        return id2lineages
+        id2lineages = self._caches['lineage'].get_many(taxid_set(taxids),
+                                                       self._fetch_lineages)
+        return {tax: list(lineage) for tax, lineage in id2lineages.items()}
+
+    def _fetch_lineages(self, taxids):
+        """Return dict with lineages (as compact int arrays) of the taxids."""
+        rows = select_in(self.db, 'taxid, track', 'species', 'taxid', taxids)
+        return {tax: array('q', map(int, reversed(track.split(','))))
+                for tax, track in rows}
 
     def get_name_lineage(self, taxnames):
         """Given a valid taxname, return its corresponding lineage track as a
@@ -202,30 +230,27 @@ class GTDBTaxa:
         if not taxid:
             return None
         taxid = int(taxid)
-        result = self.db.execute('SELECT track FROM species WHERE taxid=%s' %taxid)
-        raw_track = result.fetchone()
-        if not raw_track:
+        lineage = self._caches['lineage'].get_many(
+            [taxid], self._fetch_lineages).get(taxid)
+        if lineage is None:
             #perhaps is an obsolete taxid
             _, merged_conversion = self._translate_merged([taxid])
             if taxid in merged_conversion:
-                result = self.db.execute('SELECT track FROM species WHERE taxid=%s' %merged_conversion[taxid])
-                raw_track = result.fetchone()
+                new_taxid = merged_conversion[taxid]
+                lineage = self._caches['lineage'].get_many(
+                    [new_taxid], self._fetch_lineages).get(new_taxid)
             # if not raise error
-            if not raw_track:
-                #raw_track = ["1"]
+            if lineage is None:
                 raise ValueError("%s taxid not found" %taxid)
             else:
                 warnings.warn("taxid %s was translated into %s" %(taxid, merged_conversion[taxid]))
 
-        track = list(map(int, raw_track[0].split(",")))
-        return list(reversed(track))
+        return list(lineage)
 
     def get_common_names(self, taxids):
-        query = ','.join(['"%s"' %v for v in taxids])
-        cmd = "select taxid, common FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
+        rows = select_in(self.db, 'taxid, common', 'species', 'taxid', taxids)
         id2name = {}
-        for tax, common_name in result.fetchall():
+        for tax, common_name in rows:
             if common_name:
                 id2name[tax] = common_name
         return id2name
@@ -236,14 +261,7 @@ class GTDBTaxa:
         """
 
         all_ids = set(map(int, taxids))
-        all_ids.discard(None)
-        all_ids.discard("")
-        query = ','.join(['"%s"' %v for v in all_ids])
-        cmd = "select taxid, spname FROM species WHERE taxid IN (%s);" %query
-        result = self.db.execute(cmd)
-        id2name = {}
-        for tax, spname in result.fetchall():
-            id2name[tax] = spname
+        id2name = self._caches['name'].get_many(all_ids, self._fetch_names)
 
         # any taxid without translation? lets tray in the merged table
         # if len(all_ids) != len(id2name) and try_synonyms:
@@ -260,6 +278,9 @@ class GTDBTaxa:
 
         return id2name
 
+    def _fetch_names(self, taxids):
+        return dict(select_in(self.db, 'taxid, spname', 'species', 'taxid', taxids))
+
     def _get_name_translator(self, names):
         """
         Given a list of taxid scientific names, returns a dictionary translating them into their corresponding taxids.
@@ -274,18 +295,16 @@ class GTDBTaxa:
 
         names = set(name2origname.keys())
 
-        query = ','.join(['"%s"' %n for n in name2origname.keys()])
-        cmd = 'select spname, taxid from species where spname IN (%s)' %query
-        result = self.db.execute('select spname, taxid from species where spname IN (%s)' %query)
-        for sp, taxid in result.fetchall():
+        rows = select_in(self.db, 'spname, taxid', 'species', 'spname', names)
+        for sp, taxid in rows:
             oname = name2origname[sp.lower()]
             name2id.setdefault(oname, []).append(taxid)
             #name2realname[oname] = sp
         missing =  names - set([n.lower() for n in name2id.keys()])
         if missing:
-            query = ','.join(['"%s"' %n for n in missing])
-            result = self.db.execute('select spname, taxid from synonym where spname IN (%s)' %query)
-            for sp, taxid in result.fetchall():
+            rows = select_in(self.db, 'spname, taxid',
+                             'synonym', 'spname', missing)
+            for sp, taxid in rows:
                 oname = name2origname[sp.lower()]
                 name2id.setdefault(oname, []).append(taxid)
                 #name2realname[oname] = sp
@@ -320,25 +339,16 @@ class GTDBTaxa:
         if conversion:
             taxid = conversion[taxid]
 
-        with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-            prepostorder = pickle.load(CACHED_TRAVERSE)
-        descendants = {}
-        found = 0
-        for tid in prepostorder:
-            if tid == taxid:
-                found += 1
-            elif found == 1:
-                descendants[tid] = descendants.get(tid, 0) + 1
-            elif found == 2:
-                break
-
-        if not found:
+        index = self._get_taxindex()
+        if index.position(taxid) is None:
             raise ValueError("taxid not found:%s" %taxid)
-        elif found == 1:
+        elif index.is_leaf(taxid):
             return [taxid]
+
+        descendants = index.descendants(taxid)  # in preorder
         if rank_limit or collapse_subspecies or return_tree:
-            descendants_spnames = self._get_taxid_translator(list(descendants.keys()))
-            #tree = self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
+            descendants_spnames = self._get_taxid_translator(descendants)
+            #tree = self.get_topology(descendants, intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
             tree = self.get_topology(list(descendants_spnames.values()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
             if return_tree:
                 return tree
@@ -348,10 +358,9 @@ class GTDBTaxa:
                 return [n.name for n in tree]
 
         elif intermediate_nodes:
-            return self._translate_to_names([tid for tid, count in descendants.items()])
+            return self._translate_to_names(descendants)
         else:
-            self._translate_to_names([tid for tid, count in descendants.items() if count == 1])
-            return self._translate_to_names([tid for tid, count in descendants.items() if count == 1])
+            return self._translate_to_names(index.descendants(taxid, intermediate_nodes=False))
 
     def get_topology(self, taxnames, intermediate_nodes=False, rank_limit=None,
                      collapse_subspecies=False, annotate=True):
@@ -376,40 +385,19 @@ class GTDBTaxa:
 
         if len(taxids) == 1:
             root_taxid = int(list(taxids)[0])
-            with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-                prepostorder = pickle.load(CACHED_TRAVERSE)
-            descendants = {}
-            found = 0
-            nodes = {}
-            hit = 0
-            visited = set()
-            start = prepostorder.index(root_taxid)
-            try:
-            	end = prepostorder.index(root_taxid, start+1)
-            	subtree = prepostorder[start:end+1]
-            except ValueError:
-                # If root taxid is not found in postorder, must be a tip node
-            	subtree = [root_taxid]
-            leaves = set([v for v, count in Counter(subtree).items() if count == 1])
-            tax2name = self._get_taxid_translator(list(subtree))
+            index = self._get_taxindex()
+            tax2name = self._get_taxid_translator(
+                [root_taxid] + index.descendants(root_taxid))
             name2tax ={spname:taxid for taxid,spname in tax2name.items()}
-            nodes[root_taxid] = PhyloTree({'name': str(root_taxid)})
-            current_parent = nodes[root_taxid]
-            for tid in subtree:
-                if tid in visited:
-                    current_parent = nodes[tid].up
-                else:
-                    visited.add(tid)
-                    nodes[tid] = PhyloTree({'name': tax2name.get(tid, '')})
-                    current_parent.add_child(nodes[tid])
-                    if tid not in leaves:
-                        current_parent = nodes[tid]
-            root = nodes[root_taxid]
+            subtree = index.subtree(
+                root_taxid, lambda tid: PhyloTree({'name': tax2name.get(tid, '')}))
+            root = PhyloTree({'name': str(root_taxid)})
+            root.add_child(subtree)  # so it stays even if it has only one child
         else:
             taxids = set(map(int, taxids))
             sp2track = {}
             elem2node = {}
-            id2lineage = self._get_lineage_translator(taxids)
+            id2lineage = self._get_taxindex().lineages(taxids)
             all_taxids = set()
             for lineage in id2lineage.values():
                 all_taxids.update(lineage)
@@ -785,6 +773,8 @@ def update_db(dbfile, targz_file=None):
     with open(dbfile+'.traverse.pkl', 'wb') as fout:
         pickle.dump(prepostorder, fout, 2)
 
+    index_from_tree(t).save(index_path(dbfile))
+
     print("Updating database: %s ..." %dbfile)
     generate_table(t)
 
@@ -0,0 +1,72 @@
+"""
+Queries to the taxonomy databases for many values at once.
+
+Instead of writing all the values in a single "... WHERE x IN (v1, v2, ...)"
+statement (which fails when there are too many, and has to be compiled
+again for each query), the values are passed as parameters in chunks of
+the same size, so the same statement is reused. For very large inputs,
+they are first inserted in a temporary table and used from there.
+
+Example::
+
+  rows = select_in(db, 'taxid, rank', 'species', 'taxid', taxids)
+  id2rank = dict(rows)
+
+It is used by NCBITaxa and GTDBTaxa.
+"""
+
+CHUNK_SIZE = 500  # values per statement (sqlite < 3.32 allows at most 999)
+TEMP_TABLE_MIN = 10000  # use a temporary table for more values than this
+TEMP_TABLE = 'temp.ete_query_values'
+
+
+def select_in(db, columns, table, column, values,
+              chunk_size=None, temp_table_min=None):
+    """Return list of rows of "SELECT columns FROM table WHERE column IN values".
+
+    :param db: Connection to the sqlite database.
+    :param columns: Columns to select, like 'taxid, rank'.
+    :param table: Table to select from, like 'species'.
+    :param column: Column whose value must be in values, like 'taxid'.
+    :param values: Values to look for (repeated ones are ignored).
+    :param chunk_size: Number of values passed at once to sqlite
+        (CHUNK_SIZE if None).
+    :param temp_table_min: Use a temporary table for more values than
+        this (TEMP_TABLE_MIN if None).
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    temp_table_min = temp_table_min or TEMP_TABLE_MIN
+
+    values = list({sql_value(v) for v in values})
+
+    if len(values) > temp_table_min:
+        return select_in_temp_table(db, columns, table, column, values)
+
+    rows = []
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i+chunk_size]
+        placeholders = ','.join(['?'] * len(chunk))
+        rows += db.execute(f'SELECT {columns} FROM {table} '
+                           f'WHERE {column} IN ({placeholders})', chunk)
+    return rows
+
+
+def select_in_temp_table(db, columns, table, column, values):
+    """Return the rows as select_in(), using a temporary table for values."""
+    in_transaction = db.in_transaction  # to leave it as it was
+
+    db.execute(f'CREATE TABLE IF NOT EXISTS {TEMP_TABLE} (value)')
+    try:
+        db.executemany(f'INSERT INTO {TEMP_TABLE} VALUES (?)',
+                       ((v,) for v in values))
+        return db.execute(f'SELECT {columns} FROM {TEMP_TABLE} '
+                          f'JOIN {table} ON {table}.{column} = value').fetchall()
+    finally:
+        db.execute(f'DELETE FROM {TEMP_TABLE}')
+        if not in_transaction:
+            db.commit()
+
+
+def sql_value(value):
+    """Return the given value as something that sqlite accepts as parameter."""
+    return value if type(value) in [int, float, str] else str(value)
@@ -0,0 +1,104 @@
+"""
+Cache of the most recently used values from the taxonomy databases.
+
+NCBITaxa and GTDBTaxa keep one LRUCache for each kind of lookup (ranks,
+scientific names and lineages), so repeated queries for the same taxids
+do not go to the database again. Example::
+
+  ncbi = NCBITaxa(cache_size=100000)
+  ncbi.get_lineage(9606)  # from the database
+  ncbi.get_lineage(9606)  # from the cache
+  ncbi.cache_info()  # {'lineage': {'hits': 1, 'misses': 1, ...}, ...}
+
+The caches are cleared when the database is updated.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """Thread-safe mapping of limited size that drops the least recently used."""
+
+    def __init__(self, maxsize=100000):
+        """
+        :param maxsize: Maximum number of values kept (0 to keep none).
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._generation = 0  # changes when cleared
+        self._lock = Lock()
+
+    def get_many(self, keys, fetch):
+        """Return dict {key: value} with the values of keys that exist.
+
+        :param keys: Keys to look up (without repetitions).
+        :param fetch: Function that receives a list of the keys that
+            are not in the cache and returns a dict with their values
+            (the keys without a value are not cached).
+        """
+        found, missing = {}, []
+
+        with self._lock:
+            for key in keys:
+                if key in self._data:
+                    self._data.move_to_end(key)
+                    found[key] = self._data[key]
+                else:
+                    missing.append(key)
+
+            self.hits += len(found)
+            self.misses += len(missing)
+            generation = self._generation
+
+        if missing:
+            fetched = fetch(missing)  # not under the lock, it may be slow
+            found.update(fetched)
+            self._put_many(fetched, generation)
+
+        return found
+
+    def _put_many(self, items, generation):
+        """Add the given items, unless the cache was cleared since generation."""
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return  # the values may come from the database before an update
+
+            for key, value in items.items():
+                self._data[key] = value
+                self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Remove all the values and reset the counters."""
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self.hits = self.misses = 0
+
+    def info(self):
+        """Return dict with the hits, misses, current size and maximum size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize}
+
+    def __len__(self):
+        return len(self._data)
+
+
+def taxid_set(values):
+    """Return set with the given values that are valid taxids, as ints."""
+    taxids = set()
+    for value in values:
+        try:
+            taxids.add(int(value))
+        except (ValueError, TypeError):
+            pass  # not a taxid (it cannot be in the database either)
+    return taxids
@@ -2,8 +2,10 @@
 
 import sys
 import os
+import io
 import pickle
-from collections import defaultdict, Counter
+import tempfile
+from collections import defaultdict
 import requests
 from hashlib import md5
 
@@ -11,8 +13,12 @@ import sqlite3
 import math
 import tarfile
 import warnings
+from array import array
 
 from ete4 import ETE_DATA_HOME, update_ete_data
+from .bulkquery import select_in
+from .lrucache import LRUCache, taxid_set
+from .taxindex import load_index, index_from_parents, index_path
 
 
 __all__ = ["NCBITaxa", "is_taxadb_up_to_date"]
@@ -20,6 +26,11 @@ __all__ = ["NCBITaxa", "is_taxadb_up_to_date"]
 DB_VERSION = 2
 DEFAULT_TAXADB = ETE_DATA_HOME + '/taxa.sqlite'
 DEFAULT_TAXDUMP = ETE_DATA_HOME + '/taxdump.tar.gz'
+DEFAULT_CACHE_SIZE = 100000  # number of ranks, names and lineages to cache
+
+SYNONYM_TYPES = {'synonym', 'equivalent name', 'genbank equivalent name',
+                 'anamorph', 'genbank synonym', 'genbank anamorph',
+                 'teleomorph'}  # name types (in names.dmp) saved as synonyms
 
 
 def is_taxadb_up_to_date(dbfile=DEFAULT_TAXADB):
@@ -45,15 +56,24 @@ class NCBITaxa:
     """
 
     def __init__(self, dbfile=None, taxdump_file=None,
-                 memory=False, update=True):
+                 memory=False, update=True, cache_size=DEFAULT_CACHE_SIZE):
         """Open and keep a connection to the NCBI taxonomy database.
 
         If it is not present in the system, it will download the
         database from the NCBI site first, and convert it to ete's
         format.
+
+        :param cache_size: Number of ranks, names and lineages (each)
+            of the most recently used taxids to keep in memory.
         """
         self.dbfile = dbfile or DEFAULT_TAXADB
 
+        self._caches = {'rank': LRUCache(cache_size),
+                        'name': LRUCache(cache_size),
+                        'lineage': LRUCache(cache_size)}
+        self._taxindex = None  # TaxonomyIndex, loaded when first needed
+        self.db = None
+
         if taxdump_file:
             self.update_taxonomy_database(taxdump_file)
 
@@ -65,7 +85,6 @@ class NCBITaxa:
         if not os.path.exists(self.dbfile):
             raise ValueError("Cannot open taxonomy database: %s" % self.dbfile)
 
-        self.db = None
         self._connect()
 
         if not is_taxadb_up_to_date(self.dbfile) and update:
@@ -88,21 +107,39 @@ class NCBITaxa:
             taxdump.tax.gz file.
         """
         update_db(self.dbfile, taxdump_file)
+        self.clear_cache()
+        self._taxindex = None
+
+        if self.db is not None:  # connected to the file that was replaced
+            self.db.close()
+            self._connect()
 
     def _connect(self):
         self.db = sqlite3.connect(self.dbfile)
 
+    def cache_info(self):
+        """Return dict with the hits, misses and sizes of the caches."""
+        return {kind: cache.info() for kind, cache in self._caches.items()}
+
+    def clear_cache(self):
+        """Remove all the values kept in the caches."""
+        for cache in self._caches.values():
+            cache.clear()
+
+    def _get_taxindex(self):
+        """Return the index of the taxonomy tree (loading it the first time)."""
+        if self._taxindex is None:
+            self._taxindex = load_index(self.dbfile)
+        return self._taxindex
+
     def _translate_merged(self, all_taxids):
         conv_all_taxids = set((list(map(int, all_taxids))))
 
-        cmd = ('SELECT taxid_old, taxid_new '
-               'FROM merged WHERE taxid_old IN (%s)' %
-               ','.join(map(str, all_taxids)))
-
-        result = self.db.execute(cmd)
+        rows = select_in(self.db, 'taxid_old, taxid_new',
+                         'merged', 'taxid_old', conv_all_taxids)
 
         conversion = {}
-        for old, new in result.fetchall():
+        for old, new in rows:
             conv_all_taxids.discard(int(old))
             conv_all_taxids.add(int(new))
             conversion[int(old)] = int(new)
@@ -157,38 +194,26 @@ class NCBITaxa:
 
     def get_rank(self, taxids):
         """Return dict with NCBI taxonomy ranks for each list of taxids."""
-        all_ids = set(taxids)
-        all_ids.discard(None)
-        all_ids.discard("")
-
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, rank FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        return self._caches['rank'].get_many(taxid_set(taxids),
+                                             self._fetch_ranks)
 
-        id2rank = {}
-        for tax, spname in result.fetchall():
-            id2rank[tax] = spname
-
-        return id2rank
+    def _fetch_ranks(self, taxids):
+        return dict(select_in(self.db, 'taxid, rank', 'species', 'taxid', taxids))
 
     def get_lineage_translator(self, taxids):
         """Return dict with lineage tracks corresponding to the given taxids.
 
         The lineage tracks are a hierarchically sorted list of parent taxids.
         """
-        all_ids = set(taxids)
-        all_ids.discard(None)
-        all_ids.discard("")
-
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, track FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
-
-        id2lineages = {}
-        for tax, track in result.fetchall():
-            id2lineages[tax] = list(map(int, reversed(track.split(','))))
+        id2lineages = self._caches['lineage'].get_many(taxid_set(taxids),
+                                                       self._fetch_lineages)
+        return {tax: list(lineage) for tax, lineage in id2lineages.items()}
 
-        return id2lineages
+    def _fetch_lineages(self, taxids):
+        """Return dict with lineages (as compact int arrays) of the taxids."""
+        rows = select_in(self.db, 'taxid, track', 'species', 'taxid', taxids)
+        return {tax: array('q', map(int, reversed(track.split(','))))
+                for tax, track in rows}
 
     def get_lineage(self, taxid):
         """Return lineage track corresponding to the given taxid.
@@ -199,33 +224,29 @@ class NCBITaxa:
             return None
 
         taxid = int(taxid)
-        result = self.db.execute(f'SELECT track FROM species WHERE taxid={taxid}')
-        raw_track = result.fetchone()
-        if not raw_track:
+        lineage = self._caches['lineage'].get_many(
+            [taxid], self._fetch_lineages).get(taxid)
+        if lineage is None:
             #perhaps is an obsolete taxid
             _, merged_conversion = self._translate_merged([taxid])
             if taxid in merged_conversion:
-                result = self.db.execute(
-                    'SELECT track FROM species WHERE taxid=%s' %
-                    merged_conversion[taxid])
-                raw_track = result.fetchone()
+                new_taxid = merged_conversion[taxid]
+                lineage = self._caches['lineage'].get_many(
+                    [new_taxid], self._fetch_lineages).get(new_taxid)
 
-            if not raw_track:
+            if lineage is None:
                 raise ValueError(f'Could not find taxid: {taxid}')
             else:
                 warnings.warn('taxid %s was translated into %s' %
                               (taxid, merged_conversion[taxid]))
 
-        track = list(map(int, raw_track[0].split(',')))
-        return list(reversed(track))
+        return list(lineage)
 
     def get_common_names(self, taxids):
-        query = ','.join('"%s"' % v for v in taxids)
-        cmd = 'SELECT taxid, common FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
+        rows = select_in(self.db, 'taxid, common', 'species', 'taxid', taxids)
 
         id2name = {}
-        for tax, common_name in result.fetchall():
+        for tax, common_name in rows:
             if common_name:
                 id2name[tax] = common_name
 
@@ -234,16 +255,8 @@ class NCBITaxa:
     def get_taxid_translator(self, taxids, try_synonyms=True):
         """Return dict with the scientific names corresponding to the taxids."""
         all_ids = set(map(int, taxids))
-        all_ids.discard(None)
-        all_ids.discard("")
 
-        query = ','.join('"%s"' % v for v in all_ids)
-        cmd = 'SELECT taxid, spname FROM species WHERE taxid IN (%s);' % query
-        result = self.db.execute(cmd)
-
-        id2name = {}
-        for tax, spname in result.fetchall():
-            id2name[tax] = spname
+        id2name = self._caches['name'].get_many(all_ids, self._fetch_names)
 
         # Any taxid without translation? Let's try in the merged table.
         if len(all_ids) != len(id2name) and try_synonyms:
@@ -252,14 +265,16 @@ class NCBITaxa:
             new2old = {v: k for k,v in old2new.items()}
 
             if old2new:
-                query = ','.join('"%s"' % v for v in new2old)
-                cmd = 'SELECT taxid, spname FROM species WHERE taxid IN (%s);' % query
-                result = self.db.execute(cmd)
-                for tax, spname in result.fetchall():
+                new2name = self._caches['name'].get_many(new2old,
+                                                         self._fetch_names)
+                for tax, spname in new2name.items():
                     id2name[new2old[tax]] = spname
 
         return id2name
 
+    def _fetch_names(self, taxids):
+        return dict(select_in(self.db, 'taxid, spname', 'species', 'taxid', taxids))
+
     def get_name_translator(self, names):
         """Return dict with taxids corresponding to the given scientific names.
 
@@ -273,19 +288,16 @@ class NCBITaxa:
 
         names = set(name2origname.keys())
 
-        query = ','.join('"%s"' % n for n in name2origname.keys())
-        cmd = 'SELECT spname, taxid FROM species WHERE spname IN (%s)' % query
-        result = self.db.execute('SELECT spname, taxid FROM species WHERE spname IN (%s)' % query)
-        for sp, taxid in result.fetchall():
+        rows = select_in(self.db, 'spname, taxid', 'species', 'spname', names)
+        for sp, taxid in rows:
             oname = name2origname[sp.lower()]
             name2id.setdefault(oname, []).append(taxid)
             #name2realname[oname] = sp
         missing =  names - set([n.lower() for n in name2id.keys()])
         if missing:
-            query = ','.join('"%s"' % n for n in missing)
-            result = self.db.execute('SELECT spname, taxid FROM synonym '
-                                     'WHERE spname IN (%s)' % query)
-            for sp, taxid in result.fetchall():
+            rows = select_in(self.db, 'spname, taxid',
+                             'synonym', 'spname', missing)
+            for sp, taxid in rows:
                 oname = name2origname[sp.lower()]
                 name2id.setdefault(oname, []).append(taxid)
                 #name2realname[oname] = sp
@@ -321,25 +333,16 @@ class NCBITaxa:
         if conversion:
             taxid = conversion[taxid]
 
-        with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-            prepostorder = pickle.load(CACHED_TRAVERSE)
-        descendants = {}
-        found = 0
-        for tid in prepostorder:
-            if tid == taxid:
-                found += 1
-            elif found == 1:
-                descendants[tid] = descendants.get(tid, 0) + 1
-            elif found == 2:
-                break
-
-        if not found:
+        index = self._get_taxindex()
+        if index.position(taxid) is None:
             raise ValueError("taxid not found:%s" %taxid)
-        elif found == 1:
+        elif index.is_leaf(taxid):
             return [taxid]
 
+        descendants = index.descendants(taxid)  # in preorder
+
         if rank_limit or collapse_subspecies or return_tree:
-            tree = self.get_topology(list(descendants.keys()), intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
+            tree = self.get_topology(descendants, intermediate_nodes=intermediate_nodes, collapse_subspecies=collapse_subspecies, rank_limit=rank_limit)
             if return_tree:
                 return tree
             elif intermediate_nodes:
@@ -348,9 +351,9 @@ class NCBITaxa:
                 return list(map(int, [n.name for n in tree]))
 
         elif intermediate_nodes:
-            return [tid for tid, count in descendants.items()]
+            return descendants
         else:
-            return [tid for tid, count in descendants.items() if count == 1]
+            return index.descendants(taxid, intermediate_nodes=False)
 
     def get_topology(self, taxids, intermediate_nodes=False, rank_limit=None,
                      collapse_subspecies=False, annotate=True):
@@ -372,38 +375,15 @@ class NCBITaxa:
         taxids, merged_conversion = self._translate_merged(taxids)
         if len(taxids) == 1:
             root_taxid = int(list(taxids)[0])
-            with open(self.dbfile+".traverse.pkl", "rb") as CACHED_TRAVERSE:
-                prepostorder = pickle.load(CACHED_TRAVERSE)
-            descendants = {}
-            found = 0
-            nodes = {}
-            hit = 0
-            visited = set()
-            start = prepostorder.index(root_taxid)
-            try:
-                end = prepostorder.index(root_taxid, start+1)
-                subtree = prepostorder[start:end+1]
-            except ValueError:
-                # If root taxid is not found in postorder, must be a tip node
-                subtree = [root_taxid]
-            leaves = set(v for v, count in Counter(subtree).items() if count == 1)
-            nodes[root_taxid] = PhyloTree({'name': str(root_taxid)})
-            current_parent = nodes[root_taxid]
-            for tid in subtree:
-                if tid in visited:
-                    current_parent = nodes[tid].up
-                else:
-                    visited.add(tid)
-                    nodes[tid] = PhyloTree({'name': str(tid)})
-                    current_parent.add_child(nodes[tid])
-                    if tid not in leaves:
-                        current_parent = nodes[tid]
-            root = nodes[root_taxid]
+            subtree = self._get_taxindex().subtree(
+                root_taxid, lambda tid: PhyloTree({'name': str(tid)}))
+            root = PhyloTree({'name': str(root_taxid)})
+            root.add_child(subtree)  # so it stays even if it has only one child
         else:
             taxids = set(map(int, taxids))
             sp2track = {}
             elem2node = {}
-            id2lineage = self.get_lineage_translator(taxids)
+            id2lineage = self._get_taxindex().lineages(taxids)
             all_taxids = set()
             for lineage in id2lineage.values():
                 all_taxids.update(lineage)
@@ -587,118 +567,160 @@ class NCBITaxa:
         return broken_branches, broken_clades, broken_clade_sizes
 
 
-def load_ncbi_tree_from_dump(tar):
-    from .. import Tree
-    parent2child = {}
-    name2node = {}
-    node2taxname = {}
-    synonyms = set()
-    name2rank = {}
-    node2common = {}
+def update_db(dbfile, targz_file=None):
+    """Create the taxonomy database dbfile from the NCBI taxdump file.
+
+    The database, its traversal and its index are written in a
+    temporary directory and moved to their place only when complete.
+    """
+    basepath = os.path.split(dbfile)[0]
+    if basepath and not os.path.exists(basepath):
+        os.makedirs(basepath)
+
+    if not targz_file:
+        update_local_taxdump(DEFAULT_TAXDUMP)
+        targz_file = DEFAULT_TAXDUMP
+
+    with tarfile.open(targz_file, 'r') as tar:
+        names, commons, synonyms = load_names(tar)
+        taxids, parents, ranks = load_nodes(tar)
+        merged = load_merged(tar)
+
+    print("Linking nodes...")
+    index = index_from_parents(taxids, parents)
+
+    with tempfile.TemporaryDirectory(dir=basepath or '.') as tmpdir:
+        tmpfile = os.path.join(tmpdir, os.path.basename(dbfile))
+
+        print("Updating database: %s ..." %dbfile)
+        create_db(tmpfile, species_rows(index, names, commons, ranks),
+                  synonyms, merged)
+
+        with open(tmpfile + '.traverse.pkl', 'wb') as fout:
+            pickle.dump(index.prepostorder(), fout, 2)
+
+        index.save(index_path(tmpfile))
+
+        # The index goes last, so it is not older than the traversal.
+        for tmppath, path in [(tmpfile, dbfile),
+                              (tmpfile + '.traverse.pkl', dbfile + '.traverse.pkl'),
+                              (index_path(tmpfile), index_path(dbfile))]:
+            os.replace(tmppath, path)
+
+
+def read_dmp(tar, fname):
+    """Yield the (stripped) fields of each line of file fname in the tar."""
+    with io.TextIOWrapper(tar.extractfile(fname), encoding='utf-8') as f:
+        for line in f:
+            yield [field.strip() for field in line.split('|')]
+
+
+def load_names(tar):
+    """Return dicts {taxid: name}, {taxid: common name}, and synonyms."""
     print("Loading node names...")
+    names, commons, synonyms = {}, {}, []
     unique_nocase_synonyms = set()
-    for line in tar.extractfile("names.dmp"):
-        line = str(line.decode())
-        fields =  [_f.strip() for _f in line.split("|")]
-        nodename = fields[0]
+    for fields in read_dmp(tar, 'names.dmp'):
+        taxid = int(fields[0])
         name_type = fields[3].lower()
-        taxname = fields[1]
 
         # Clean up tax names so we make sure the don't include quotes. See https://github.com/etetoolkit/ete/issues/469
-        taxname = taxname.rstrip('"').lstrip('"')
-
-        if name_type == "scientific name":
-            node2taxname[nodename] = taxname
-        if name_type == "genbank common name":
-            node2common[nodename] = taxname
-        elif name_type in set(["synonym", "equivalent name", "genbank equivalent name",
-                               "anamorph", "genbank synonym", "genbank anamorph", "teleomorph"]):
+        taxname = fields[1].strip('"')
 
+        if name_type == 'scientific name':
+            names[taxid] = taxname
+        elif name_type == 'genbank common name':
+            commons[taxid] = taxname
+        elif name_type in SYNONYM_TYPES:
             # Keep track synonyms, but ignore duplicate case-insensitive names. See https://github.com/etetoolkit/ete/issues/469
-            synonym_key = (nodename, taxname.lower())
+            synonym_key = (taxid, taxname.lower())
             if synonym_key not in unique_nocase_synonyms:
                 unique_nocase_synonyms.add(synonym_key)
-                synonyms.add((nodename, taxname))
+                synonyms.append((taxid, taxname))
 
-    print(len(node2taxname), "names loaded.")
+    print(len(names), "names loaded.")
     print(len(synonyms), "synonyms loaded.")
+    return names, commons, synonyms
+
 
+def load_nodes(tar):
+    """Return the taxids of all the nodes, their parents, and dict of ranks."""
     print("Loading nodes...")
-    for line in tar.extractfile("nodes.dmp"):
-        line = str(line.decode())
-        fields =  line.split("|")
-        nodename = fields[0].strip()
-        parentname = fields[1].strip()
-        n = Tree()
-        n.name = nodename
-        #n.taxname = node2taxname[nodename]
-        n.add_prop('taxname', node2taxname[nodename])
-        if nodename in node2common:
-            n.add_prop('common_name', node2taxname[nodename])
-        n.add_prop('rank', fields[2].strip())
-        parent2child[nodename] = parentname
-        name2node[nodename] = n
-    print(len(name2node), "nodes loaded.")
+    taxids, parents, ranks = array('q'), array('q'), {}
+    for fields in read_dmp(tar, 'nodes.dmp'):
+        taxid = int(fields[0])
+        taxids.append(taxid)
+        parents.append(int(fields[1]))
+        ranks[taxid] = fields[2]
 
-    print("Linking nodes...")
-    for node in name2node:
-       if node == "1":
-           t = name2node[node]
-       else:
-           parent = parent2child[node]
-           parent_node = name2node[parent]
-           parent_node.add_child(name2node[node])
-    print("Tree is loaded.")
-    return t, synonyms
-
-def generate_table(t):
-    with open("taxa.tab", "w") as out:
-        for j, n in enumerate(t.traverse()):
-            if j % 1000 == 0:
-                print("\r",j,"generating entries...", end=' ')
-            temp_node = n
-            track = []
-            while temp_node:
-                track.append(temp_node.name)
-                temp_node = temp_node.up
-
-            n_up_name = n.up.name if n.up else ""
-
-            row = '\t'.join([n.name, n_up_name, n.props.get('taxname'),
-                             n.props.get("common_name", ''), n.props.get("rank"),
-                             ','.join(track)])
-
-            print(row, file=out)
+    print(len(taxids), "nodes loaded.")
+    return taxids, parents, ranks
 
-def update_db(dbfile, targz_file=None):
-    basepath = os.path.split(dbfile)[0]
-    if basepath and not os.path.exists(basepath):
-        os.makedirs(basepath)
 
-    if not targz_file:
-        update_local_taxdump(DEFAULT_TAXDUMP)
-        targz_file = DEFAULT_TAXDUMP
+def load_merged(tar):
+    """Return list of (old taxid, new taxid) of the merged taxa."""
+    return [(int(fields[0]), int(fields[1]))
+            for fields in read_dmp(tar, 'merged.dmp')]
+
+
+def species_rows(index, names, commons, ranks):
+    """Yield the rows of the species table, in preorder.
+
+    The track of each node (its taxid followed by the track of its
+    parent) is computed from the one of its parent, which is always
+    on the path of nodes from the root to the current one.
+    """
+    taxids, parents = index.taxids.tolist(), index.parents.tolist()
+
+    path, tracks = [], []  # positions and tracks from the root
+    for pos, taxid in enumerate(taxids):
+        parent_pos = parents[pos]
+        while path and path[-1] != parent_pos:
+            path.pop()
+            tracks.pop()
+
+        track = str(taxid) + (',' + tracks[-1] if tracks else '')
+        parent = taxids[parent_pos] if parent_pos != -1 else ''  # root: ''
 
-    tar = tarfile.open(targz_file, 'r')
-    t, synonyms = load_ncbi_tree_from_dump(tar)
-    prepostorder = [int(node.name) for post, node in t.iter_prepostorder()]
-    pickle.dump(prepostorder, open(dbfile+'.traverse.pkl', "wb"), 2)
+        yield (taxid, parent, names[taxid], commons.get(taxid, ''),
+               ranks[taxid], track)
 
-    print("Updating database: %s ..." %dbfile)
-    generate_table(t)
+        path.append(pos)
+        tracks.append(track)
 
-    with open("syn.tab", "w") as SYN:
-        SYN.write('\n'.join(["%s\t%s" %(v[0],v[1]) for v in synonyms]))
 
-    with open("merged.tab", "w") as merged:
-        for line in tar.extractfile("merged.dmp"):
-            line = str(line.decode())
-            out_line = '\t'.join([_f.strip() for _f in line.split('|')[:2]])
-            merged.write(out_line+'\n')
+def create_db(dbfile, species, synonyms, merged):
+    """Create the taxonomy database in dbfile with the given rows.
 
-    upload_data(dbfile)
+    All the rows are inserted in a single transaction, and the indexes
+    are created afterwards (faster than updating them with each insert).
+    """
+    print('Uploading to', dbfile)
+    db = sqlite3.connect(dbfile)
+
+    db.executescript("""
+    DROP TABLE IF EXISTS stats;
+    DROP TABLE IF EXISTS species;
+    DROP TABLE IF EXISTS synonym;
+    DROP TABLE IF EXISTS merged;
+    CREATE TABLE stats (version INT PRIMARY KEY);
+    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
+    CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
+    CREATE TABLE merged (taxid_old INT, taxid_new INT);
+    """)
+
+    with db:  # commits at the end
+        db.execute('INSERT INTO stats (version) VALUES (?)', [DB_VERSION])
+        db.executemany('INSERT INTO synonym (taxid, spname) VALUES (?, ?)',
+                       synonyms)
+        db.executemany('INSERT INTO merged (taxid_old, taxid_new) '
+                       'VALUES (?, ?)', merged)
+        db.executemany('INSERT INTO species (taxid, parent, spname, common, rank, track) '
+                       'VALUES (?, ?, ?, ?, ?, ?)', species)
+        db.execute('CREATE INDEX spname1 ON species (spname COLLATE NOCASE)')
+        db.execute('CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE)')
 
-    os.system("rm syn.tab merged.tab taxa.tab")
+    db.close()
 
 
 def update_local_taxdump(fname=DEFAULT_TAXDUMP):
@@ -721,64 +743,6 @@ def update_local_taxdump(fname=DEFAULT_TAXDUMP):
             print(f'File {fname} is already up-to-date with {url} .')
 
 
-def upload_data(dbfile):
-    print()
-    print('Uploading to', dbfile)
-    basepath = os.path.split(dbfile)[0]
-    if basepath and not os.path.exists(basepath):
-        os.mkdir(basepath)
-
-    db = sqlite3.connect(dbfile)
-
-    create_cmd = """
-    DROP TABLE IF EXISTS stats;
-    DROP TABLE IF EXISTS species;
-    DROP TABLE IF EXISTS synonym;
-    DROP TABLE IF EXISTS merged;
-    CREATE TABLE stats (version INT PRIMARY KEY);
-    CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
-    CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
-    CREATE TABLE merged (taxid_old INT, taxid_new INT);
-    CREATE INDEX spname1 ON species (spname COLLATE NOCASE);
-    CREATE INDEX spname2 ON synonym (spname COLLATE NOCASE);
-    """
-    for cmd in create_cmd.split(';'):
-        db.execute(cmd)
-    print()
-
-    db.execute("INSERT INTO stats (version) VALUES (%d);" %DB_VERSION)
-    db.commit()
-
-    for i, line in enumerate(open("syn.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting synonyms:     %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, spname = line.strip('\n').split('\t')
-        db.execute("INSERT INTO synonym (taxid, spname) VALUES (?, ?);",
-                   (taxid, spname))
-    print()
-    db.commit()
-    for i, line in enumerate(open("merged.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting taxid merges: %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid_old, taxid_new = line.strip('\n').split('\t')
-        db.execute("INSERT INTO merged (taxid_old, taxid_new) VALUES (?, ?);",
-                   (taxid_old, taxid_new))
-    print()
-    db.commit()
-    for i, line in enumerate(open("taxa.tab")):
-        if i % 5000 == 0 :
-            print('\rInserting taxids:      %6d' % i, end=' ', file=sys.stderr)
-            sys.stderr.flush()
-        taxid, parentid, spname, common, rank, lineage = line.strip('\n').split('\t')
-        db.execute('INSERT INTO species (taxid, parent, spname, common, rank, track) '
-                   'VALUES (?, ?, ?, ?, ?, ?);',
-                   (taxid, parentid, spname, common, rank, lineage))
-    print()
-    db.commit()
-
-
 if __name__ == "__main__":
     ncbi = NCBITaxa()
 
@@ -0,0 +1,247 @@
+"""
+Index of the taxonomy tree, as arrays stored next to the database.
+
+The taxonomy tree is stored as the taxids of its nodes in preorder,
+the position of the parent of each node, and where the clade of each
+node ends: the descendants of the node at position i are the ones at
+positions i+1 to ends[i] (not included). Finding the descendants of a
+taxon is then a slice, and its lineage follows the parents.
+
+The arrays are saved in a numpy file (dbfile + '.taxindex.npy') when
+the database is created, and are memory-mapped when used. For
+databases created before, it is built (once) from dbfile + '.traverse.pkl'.
+
+Example::
+
+  index = load_index(dbfile)
+  index.descendants(9604)  # taxids under Hominidae, in preorder
+  index.lineages([9606])  # {9606: [1, 131567, ..., 9605, 9606]}
+"""
+
+import os
+import pickle
+from collections import Counter
+
+import numpy as np
+
+from ..core import operations as ops
+
+
+class TaxonomyIndex:
+    """Taxonomy tree as arrays of taxids in preorder, parents and clade ends."""
+
+    def __init__(self, data):
+        """
+        :param data: Array with rows: taxids (in preorder), positions
+            of their parents (-1 for the root), ends of their clades,
+            the taxids sorted, and the positions that sort them.
+        """
+        self.data = data
+        self.taxids, self.parents, self.ends, self._sorted, self._order = data
+
+    def __len__(self):
+        return len(self.taxids)
+
+    def save(self, path):
+        """Save the index in the given path (atomically)."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as fout:
+            np.save(fout, np.asarray(self.data))
+        os.replace(tmp_path, path)
+
+    def position(self, taxid):
+        """Return the position in preorder of the given taxid (or None)."""
+        i = int(np.searchsorted(self._sorted, taxid))
+        if i < len(self._sorted) and self._sorted[i] == taxid:
+            return int(self._order[i])
+        return None
+
+    def is_leaf(self, taxid):
+        """Return True if the given taxid has no descendants."""
+        pos = self._position_of(taxid)
+        return int(self.ends[pos]) == pos + 1
+
+    def descendants(self, taxid, intermediate_nodes=True):
+        """Return list with the taxids under taxid (not included), in preorder.
+
+        :param intermediate_nodes: If False, return only the leaves.
+        """
+        pos = self._position_of(taxid)
+        start, end = pos + 1, int(self.ends[pos])
+
+        taxids = self.taxids[start:end]
+        if not intermediate_nodes:
+            is_leaf = self.ends[start:end] == np.arange(start + 1, end + 1)
+            taxids = taxids[is_leaf]
+
+        return taxids.tolist()
+
+    def lineages(self, taxids):
+        """Return dict {taxid: lineage} with lists of taxids from the root.
+
+        The taxids that are not in the index are not in the dict.
+        """
+        parents, all_taxids = self.parents, self.taxids
+
+        id2lineage = {}
+        for taxid in taxids:
+            pos = self.position(taxid)
+            if pos is None:
+                continue
+
+            lineage = []
+            while pos != -1:
+                lineage.append(int(all_taxids[pos]))
+                pos = int(parents[pos])
+
+            id2lineage[taxid] = lineage[::-1]
+
+        return id2lineage
+
+    def subtree(self, taxid, make_node):
+        """Return the taxonomy tree under taxid, with nodes from make_node(tid)."""
+        start = self._position_of(taxid)
+        end = int(self.ends[start])
+
+        taxids = self.taxids[start:end].tolist()
+        parents = (self.parents[start:end] - start).tolist()  # relative
+
+        nodes = [make_node(taxids[0])]
+        for i in range(1, len(taxids)):
+            node = make_node(taxids[i])
+            nodes[parents[i]].add_child(node)
+            nodes.append(node)
+
+        return nodes[0]
+
+    def prepostorder(self):
+        """Return list of taxids in pre and postorder (see index_from_prepostorder)."""
+        taxids, ends = self.taxids.tolist(), self.ends.tolist()
+
+        prepostorder = []
+        path = []  # positions of the internal nodes with their clade still open
+        for pos, taxid in enumerate(taxids):
+            while path and ends[path[-1]] <= pos:
+                prepostorder.append(taxids[path.pop()])  # clade closed
+
+            prepostorder.append(taxid)
+            if ends[pos] > pos + 1:
+                path.append(pos)
+
+        prepostorder.extend(taxids[pos] for pos in reversed(path))
+
+        return prepostorder
+
+    def _position_of(self, taxid):
+        pos = self.position(taxid)
+        if pos is None:
+            raise ValueError(f'taxid not found: {taxid}')
+        return pos
+
+
+def index_from_arrays(taxids, parents, ends):
+    """Return a TaxonomyIndex from the arrays of taxids, parents and ends."""
+    taxids = np.asarray(taxids, dtype=np.int64)
+    order = np.argsort(taxids, kind='stable')
+    return TaxonomyIndex(np.array([taxids, parents, ends, taxids[order], order],
+                                  dtype=np.int64))
+
+
+def index_from_tree(tree):
+    """Return a TaxonomyIndex from a tree whose node names are taxids."""
+    nodes, parents, ends = ops.flatten(tree)
+    return index_from_arrays([int(node.name) for node in nodes], parents, ends)
+
+
+def index_from_parents(taxids, parents, root=1):
+    """Return a TaxonomyIndex from the taxids of all nodes and their parents.
+
+    The children of each node keep the order in which they appear.
+    Nodes that are not connected to the root are not in the index.
+    """
+    taxids = np.asarray(taxids, dtype=np.int64)
+    parents = np.asarray(parents, dtype=np.int64)
+
+    # Rows (in the given arrays) of the parent of each node.
+    order = np.argsort(taxids, kind='stable')
+    parent_rows = order[np.searchsorted(taxids[order], parents)]
+
+    # Rows of the children of each node, contiguous (and their bounds).
+    rows = np.arange(len(taxids))
+    parent_rows[taxids == root] = -1  # so the root is not its own child
+    children = np.argsort(parent_rows, kind='stable')
+    children_parents = parent_rows[children]
+    firsts = np.searchsorted(children_parents, rows).tolist()
+    lasts = np.searchsorted(children_parents, rows, side='right').tolist()
+    children = children.tolist()
+
+    # Traverse in preorder, saving the row and the parent's position.
+    preorder_rows, preorder_parents = [], []
+    stack = [(int(np.flatnonzero(taxids == root)[0]), -1)]  # (row, parent pos)
+    while stack:
+        row, parent_pos = stack.pop()
+        pos = len(preorder_rows)
+        preorder_rows.append(row)
+        preorder_parents.append(parent_pos)
+        stack.extend((child, pos) for child in
+                     reversed(children[firsts[row]:lasts[row]]))
+
+    # Clade sizes, accumulated from the last nodes to the first ones.
+    sizes = [1] * len(preorder_rows)
+    for pos in range(len(sizes) - 1, 0, -1):
+        sizes[preorder_parents[pos]] += sizes[pos]
+
+    ends = [pos + size for pos, size in enumerate(sizes)]
+
+    return index_from_arrays(taxids[preorder_rows], preorder_parents, ends)
+
+
+def index_from_prepostorder(prepostorder):
+    """Return a TaxonomyIndex from the list of taxids in pre and postorder.
+
+    In that list (the one in dbfile + '.traverse.pkl'), internal nodes
+    appear twice (before and after their descendants) and leaves once.
+    """
+    counts = Counter(prepostorder)
+
+    taxids, parents, ends = [], [], []
+    path = []  # positions of the nodes from the root to the current one
+    for taxid in prepostorder:
+        if path and taxids[path[-1]] == taxid:  # visiting it in postorder
+            ends[path.pop()] = len(taxids)
+        else:
+            pos = len(taxids)
+            taxids.append(taxid)
+            parents.append(path[-1] if path else -1)
+            ends.append(pos + 1)
+            if counts[taxid] > 1:
+                path.append(pos)  # internal node, it will appear again
+
+    return index_from_arrays(taxids, parents, ends)
+
+
+def index_path(dbfile):
+    return dbfile + '.taxindex.npy'
+
+
+def load_index(dbfile):
+    """Return the TaxonomyIndex saved next to the database (memory-mapped).
+
+    If it does not exist or is older than the pickled traversal of the
+    taxonomy, create it from that traversal and save it if possible.
+    """
+    path, pkl_path = index_path(dbfile), dbfile + '.traverse.pkl'
+
+    if os.path.exists(path) and (not os.path.exists(pkl_path) or
+                                 os.path.getmtime(path) >= os.path.getmtime(pkl_path)):
+        return TaxonomyIndex(np.load(path, mmap_mode='r'))
+
+    with open(pkl_path, 'rb') as f:
+        index = index_from_prepostorder(pickle.load(f))
+
+    try:
+        index.save(path)
+    except OSError:
+        pass  # we could not save it, but we can still use it
+
+    return index
@@ -1,82 +1,333 @@
 """
-Prototype of the "future ete format", an alternative to the newick format,
-that encodes types too (and is probably faster).
+Read and write trees in the ete format, a binary alternative to newick
+that keeps the types of the properties (and is faster and smaller).
+
+A file in ete format looks like::
+
+  MAGIC | manifest size (uint64) | manifest (json) | blocks
+
+The manifest describes the tree (number of nodes, properties) and
+where each block of data is. The blocks are typed arrays:
+
+- parents: index of the parent of each node, with the nodes in
+  preorder (the root has parent -1)
+- strings_offsets, strings_data: the table of all the strings used
+- one or two blocks per property, with its values for all the nodes,
+  and optionally which nodes have a value (mask)
+
+Properties with values of type float, int, bool or str are stored as
+arrays (the strings as indices to the string table). Any other
+property is stored pickled. Each block can be compressed with gzip
+or zstd (if the zstandard module is installed). All the numbers are
+little-endian, and all the blocks start at multiples of 8 bytes.
 """
 
-import io
+import gc
+import sys
 import json
-import pickle
-import base64
 import gzip
-import ete4
+import pickle
+from array import array
+from itertools import accumulate
 
+from ete4.core.tree import Tree
+from ete4.parser import newick
 
-def pickle_pack(data):
-    return base64.b64encode(pickle.dumps(data)).decode()
 
-def pickle_unpack(data):
-    return pickle.loads(base64.b64decode(data))
+MAGIC = b'\x89ETE\r\n\x1a\n'
+VERSION = 1
+ALIGN = 8  # all blocks start at multiples of this (so they can be mapped)
 
-def b64gzip_pack(data):
-    return base64.b64encode(gzip.compress(bytes(data, 'utf-8'))).decode()
+# Kinds of property columns, and the typecode of the array that stores them.
+TYPECODES = {'float': 'd', 'int': 'q', 'bool': 'B', 'str': 'i'}
+KINDS = {float: 'float', int: 'int', bool: 'bool', str: 'str'}
 
-def b64gzip_unpack(data):
-    return gzip.decompress(base64.b64decode(data))
+INT64_MIN, INT64_MAX = -2**63, 2**63 - 1
 
 
-def dumps(t, encoder='pickle', pack=False):
-    OUT = io.StringIO()
+class EteFormatError(Exception):
+    pass
 
-    assert encoder in ['pickle', 'json'], f'Invalid encoder: {encoder}'
 
-    for i, n in enumerate(t.traverse()):
-        n.props['__id'] = i
-    next_nodes = [t]
+def dumps(tree, props=None, compression=None):
+    """Return the tree encoded in ete format (as bytes).
 
-    while next_nodes:
-        n = next_nodes.pop()
-        next_nodes.extend(n.children)
+    :param props: List of properties to save. If None, save all.
+    :param compression: Compression for the blocks of data. It can
+        be None, "gzip" or "zstd".
+    """
+    return b''.join(iter_parts(tree, props, compression))
 
-        if encoder == 'json':
-            packed_content = json.dumps(n.props)
-        elif encoder == 'pickle':
-            packed_content = pickle_pack(n.props)
 
-        print('p', n.props['__id'], packed_content, sep='\t', file=OUT)
+def dump(tree, fp, props=None, compression=None):
+    """Write the tree in ete format to binary file object fp."""
+    for part in iter_parts(tree, props, compression):
+        fp.write(part)
 
-        if n.up:
-            print('t', n.props['__id'], n.up.props['__id'], sep='\t', file=OUT)
-        else:
-            print('t', n.props['__id'], '', sep='\t', file=OUT)
 
-    if pack:
-        return b64gzip_pack(OUT.getvalue())
-    else:
-        return OUT.getvalue()
-
-
-def loads(INPUT, encoder='pickle', unpack=False):
-    if unpack:
-        INPUT = b64gzip_unpack(INPUT).decode()
-
-    assert encoder in ['pickle', 'json'], f'Invalid encoder: {encoder}'
-
-    id2node = {}
-    root = None
-    for line in io.StringIO(INPUT).readlines():
-        etype, nid, b = map(str.strip, line.split('\t'))
-        if nid not in id2node:
-            node = id2node[nid] = ete4.Tree()
-
-        if etype == 'p':
-            if encoder == 'pickle':
-                node.props = pickle_unpack(b)
-            if encoder == 'json':
-                node.props = json.loads(b)
-        elif etype == 't':
-            if b:
-                id2node[b].add_child(node)
-                node.up = id2node[b]
+def loads(data, tree_class=Tree):
+    """Return the tree from data (bytes) in ete format."""
+    manifest, start = read_manifest(data)
+
+    view = memoryview(data)
+    get = lambda name: read_block(view, start, manifest['blocks'][name])
+
+    parents = get('parents').tolist()
+    n = len(parents)
+
+    strings = read_strings(get('strings_offsets'), get('strings_data'))
+
+    gc_enabled = gc.isenabled()
+    gc.disable()  # as in newick.loads(), do not collect while creating nodes
+    try:
+        props = [{} for _ in range(n)]
+
+        for prop in manifest['props']:
+            name, kind = prop['name'], prop['kind']
+            values = get(prop['values'])
+            if kind == 'str':
+                values = [strings[i] if i >= 0 else None for i in values]
+            elif kind == 'bool':
+                values = [bool(x) for x in values]
+            elif kind == 'pickle':
+                values = pickle.loads(values)
+            else:
+                values = values.tolist()
+
+            if prop['mask'] is None:
+                if kind == 'str':  # missing strings have index -1
+                    for node_props, value in zip(props, values):
+                        if value is not None:
+                            node_props[name] = value
+                else:
+                    for node_props, value in zip(props, values):
+                        node_props[name] = value
             else:
-                root = node
-    return root
+                nodes_with_prop = [props[i] for i, has_value
+                                   in enumerate(get(prop['mask'])) if has_value]
+                for node_props, value in zip(nodes_with_prop, values):
+                    node_props[name] = value
+
+        return newick.unflatten(props, parents, tree_class)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def load(fp, tree_class=Tree):
+    """Return the tree read from binary file object fp in ete format."""
+    return loads(fp.read(), tree_class)
+
+
+def is_ete(data):
+    """Return True if data (bytes) looks like a tree in ete format."""
+    return type(data) in [bytes, bytearray, memoryview] and \
+        bytes(data[:len(MAGIC)]) == MAGIC
+
+
+def iter_parts(tree, props=None, compression=None):
+    """Yield the pieces of bytes that make the tree in ete format."""
+    all_props, parents = newick.flatten(tree)
+
+    columns = get_columns(all_props, props)
+
+    strings = {}  # string -> index in the string table
+    blocks = {}  # name -> (typecode, data)
+
+    blocks['parents'] = ('i', to_bytes(array('i', parents)))
+
+    manifest_props = []
+    for i, (name, values) in enumerate(columns):
+        kind, data, mask = encode_column(values, strings)
+
+        prop = {'name': name, 'kind': kind,
+                'values': f'p{i}_values', 'mask': None}
+        blocks[prop['values']] = (TYPECODES.get(kind, 'B'), data)
+        if mask is not None:
+            prop['mask'] = f'p{i}_mask'
+            blocks[prop['mask']] = ('B', mask)
+        manifest_props.append(prop)
+
+    offsets, data = encode_strings(strings)
+    blocks['strings_offsets'] = ('q', to_bytes(offsets))
+    blocks['strings_data'] = ('B', data)
+
+    # Place the (possibly compressed) blocks one after the other.
+    manifest_blocks = {}
+    block_datas = []
+    offset = 0
+    for name, (typecode, data) in blocks.items():
+        size_raw = len(data)
+        data = compress(data, compression)
+        manifest_blocks[name] = {'offset': offset, 'size': len(data),
+                                 'size_raw': size_raw, 'type': typecode,
+                                 'codec': compression}
+        block_datas.append(data)
+        offset += padded(len(data))
+
+    manifest = json.dumps({'version': VERSION, 'nodes': len(parents),
+                           'props': manifest_props,
+                           'blocks': manifest_blocks},
+                          separators=(',', ':')).encode()
+
+    yield MAGIC
+    yield len(manifest).to_bytes(8, 'little')
+    yield manifest + padding(len(MAGIC) + 8 + len(manifest))
+    for data in block_datas:
+        yield data + padding(len(data))
+
+
+def get_columns(all_props, props=None):
+    """Return list of (name, values) for each property of the nodes.
+
+    The values contain all the values of the property in all the nodes
+    (with the not-a-value ``MISSING`` for the nodes that do not have it).
+    """
+    if props is None:  # find all props, in order of first appearance
+        names = {}
+        for node_props in all_props:
+            names.update(node_props)
+        props = list(names)
+
+    return [(name, [node_props.get(name, MISSING) for node_props in all_props])
+            for name in props]
+
+
+class Missing:
+    """Not a value (for a node without a given property)."""
+    def __repr__(self):
+        return 'MISSING'
+
+MISSING = Missing()
+
+
+def encode_column(values, strings):
+    """Return kind, data and mask (or None) for a column of values.
+
+    New strings in the values are added to the string table strings.
+    """
+    present = [x for x in values if x is not MISSING]
+    mask = (None if len(present) == len(values) else
+            bytes([x is not MISSING for x in values]))
+
+    types = set(map(type, present))
+    kind = KINDS.get(types.pop(), 'pickle') if len(types) == 1 else 'pickle'
+
+    if kind == 'int' and not INT64_MIN <= min(present) <= max(present) <= INT64_MAX:
+        kind = 'pickle'  # too big for our arrays
+
+    if kind == 'str':  # the mask is implicit in the index -1
+        indices = [strings.setdefault(x, len(strings)) if x is not MISSING
+                   else -1 for x in values]
+        return kind, to_bytes(array('i', indices)), None
+    elif kind == 'pickle':
+        return kind, pickle.dumps(present), mask
+    elif kind == 'bool':
+        return kind, bytes(present), mask
+    else:
+        return kind, to_bytes(array(TYPECODES[kind], present)), mask
+
+
+def encode_strings(strings):
+    """Return the offsets and data that encode the given string table."""
+    # The strings are in the order they were added (their index).
+    parts = [text.encode('utf8', 'surrogatepass') for text in strings]
+    offsets = array('q', [0])
+    offsets.extend(accumulate(map(len, parts)))
+    return offsets, b''.join(parts)
+
+
+def read_strings(offsets, data):
+    """Return the list of strings from the string table."""
+    data = bytes(data)
+    return [data[offsets[i]:offsets[i+1]].decode('utf8', 'surrogatepass')
+            for i in range(len(offsets) - 1)]
+
+
+def read_manifest(data):
+    """Return the manifest and the position where the blocks start."""
+    if not is_ete(data):
+        raise EteFormatError('data is not in ete format')
+
+    pos = len(MAGIC)
+    size = int.from_bytes(data[pos:pos+8], 'little')
+    pos += 8
+    try:
+        manifest = json.loads(bytes(data[pos:pos+size]))
+    except ValueError as e:
+        raise EteFormatError(f'bad manifest: {e}')
+
+    if manifest.get('version') != VERSION:
+        raise EteFormatError(f'unknown version: {manifest.get("version")}')
+
+    return manifest, padded(pos + size)
+
+
+def read_block(view, start, block):
+    """Return the contents of block, as an array (or bytes if untyped)."""
+    pos = start + block['offset']
+    data = view[pos:pos + block['size']]
+
+    if len(data) != block['size']:
+        raise EteFormatError('data is truncated')
+
+    data = decompress(data, block['codec'])
+
+    if block['type'] == 'B':
+        return bytes(data)
+
+    values = array(block['type'])
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def to_bytes(values):
+    """Return the bytes of array values, in little-endian order."""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def compress(data, codec):
+    if codec is None:
+        return data
+    elif codec == 'gzip':
+        return gzip.compress(data)
+    elif codec == 'zstd':
+        return zstd().ZstdCompressor().compress(data)
+    else:
+        raise ValueError(f'unknown compression: {codec}')
+
+
+def decompress(data, codec):
+    if codec is None:
+        return data
+    elif codec == 'gzip':
+        return gzip.decompress(data)
+    elif codec == 'zstd':
+        return zstd().ZstdDecompressor().decompress(data)
+    else:
+        raise EteFormatError(f'unknown compression: {codec}')
+
+
+def zstd():
+    """Return the zstandard module, or raise an informative error."""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise EteFormatError('zstd compression requires the zstandard module '
+                             '(pip install zstandard)')
+
+
+def padded(size):
+    """Return the size increased to the next multiple of ALIGN."""
+    return size + (-size % ALIGN)
+
+
+def padding(size):
+    """Return the bytes needed to pad something of the given size."""
+    return bytes(-size % ALIGN)
@@ -4,7 +4,16 @@ Parser for trees represented in newick format.
 
 # See https://en.wikipedia.org/wiki/Newick_format
 
+import os
+import io
+import gc
+import gzip
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 from ete4.core.tree import Tree
+from ete4.core import operations as ops
 
 
 class NewickError(Exception):
@@ -130,25 +139,44 @@ def prop_repr(prop):
 
 def content_repr(node, props=None, parser=None):
     """Return content of a node as represented in newick format."""
+    return content_writer(props, parser)(node)
+
+
+def content_writer(props=None, parser=None):
+    """Return a function that gives the content of a node in newick format.
+
+    It is the same as content_repr(node, props, parser), but the
+    parser is interpreted only once, for all the nodes to write.
+    """
     parser = parser or PARSER_DEFAULT
-    prop0, prop1 = parser['leaf' if node.is_leaf else 'internal']
 
-    # Shortcuts.
-    p0_name, p0_write, p0_req = prop0['pname'], prop0['write'], prop0.get('req')
-    p1_name, p1_write, p1_req = prop1['pname'], prop1['write'], prop1.get('req')
+    def shortcuts(prop0, prop1):
+        return (prop0['pname'], prop0['write'], prop0.get('req'),
+                prop1['pname'], prop1['write'], prop1.get('req'))
+
+    leaf = shortcuts(*parser['leaf'])
+    internal = shortcuts(*parser['internal'])
 
-    p0_str = p0_write(node.props[p0_name]) if p0_name in node.props else ''
-    p1_str = p1_write(node.props[p1_name]) if p1_name in node.props else ''
+    def write(node):
+        p0_name, p0_write, p0_req, p1_name, p1_write, p1_req = \
+            leaf if node.is_leaf else internal
 
-    assert p0_str or not p0_req, f'missing {p0_name} in node with: {node.props}'
-    assert p1_str or not p1_req, f'missing {p1_name} in node with: {node.props}'
+        node_props = node.props
 
-    props = props if props is not None else sorted(node.props)  # overwrite
-    pairs_str = ':'.join('%s=%s' % (k, prop_repr(node.props[k])) for k in props
-                         if k in node.props and k not in [p0_name, p1_name])
+        p0_str = p0_write(node_props[p0_name]) if p0_name in node_props else ''
+        p1_str = p1_write(node_props[p1_name]) if p1_name in node_props else ''
 
-    return (p0_str + (f':{p1_str}' if p1_str else '') +     # p0:p1
-            (f'[&&NHX:{pairs_str}]' if pairs_str else ''))  # [&&NHX:p2=x:p3=y]
+        assert p0_str or not p0_req, f'missing {p0_name} in node with: {node_props}'
+        assert p1_str or not p1_req, f'missing {p1_name} in node with: {node_props}'
+
+        keys = props if props is not None else sorted(node_props)  # overwrite
+        pairs_str = ':'.join('%s=%s' % (k, prop_repr(node_props[k])) for k in keys
+                             if k in node_props and k not in [p0_name, p1_name])
+
+        return (p0_str + (f':{p1_str}' if p1_str else '') +     # p0:p1
+                (f'[&&NHX:{pairs_str}]' if pairs_str else ''))  # [&&NHX:p2=x:p3=y]
+
+    return write
 
 
 def get_props(content, is_leaf, parser=None):
@@ -166,7 +194,11 @@ def get_props(content, is_leaf, parser=None):
 
     props = {}  # will contain the properties extracted from the content string
 
-    p0_str, pos = read_content(content, 0, endings=':[')
+    cdef Py_ssize_t pos = simple_colon(content)  # fast path for 'p0:p1'
+    if pos >= 0:
+        p0_str = content[:pos]
+    else:
+        p0_str, pos = read_content(content, 0, endings=':[')
 
     try:
         assert p0_str or not p0_req, 'missing required value'
@@ -196,6 +228,26 @@ def get_props(content, is_leaf, parser=None):
     return props
 
 
+cdef Py_ssize_t simple_colon(str content):
+    """Return position of the first ":" in content, or -1 if not simple.
+
+    A simple content has no quotes, comments, annotations or whitespace,
+    and thus can be split at its first ":" without further scanning. If
+    there is no ":", return the length of the content.
+    """
+    cdef Py_ssize_t i, n = len(content), colon = -1
+    cdef Py_UCS4 c
+    for i in range(n):
+        c = content[i]
+        if c == u':':
+            if colon < 0:
+                colon = i
+        elif (c == u"'" or c == u'"' or c == u'[' or c == u' ' or
+              c == u'\t' or c == u'\r' or c == u'\n'):
+            return -1
+    return colon if colon >= 0 else n
+
+
 def get_extended_props(text):
     """Return a dict with the properties extracted from the text in NHX format.
 
@@ -232,18 +284,292 @@ def loads(tree_text, parser=None, tree_class=Tree):
     if type(parser) == int:  # parser is an integer? (old-style/shortcut)
         parser = INT_PARSERS[parser]  # substitute it for the actual parser
 
-    if tree_text[0] == '(':
-        nodes, pos = read_nodes(tree_text, parser, 0, tree_class)
+    # Creating millions of nodes (which refer to each other) makes the
+    # cyclic garbage collector run again and again over all of them,
+    # for nothing. So we pause it while reading.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if tree_text[0] == '(':
+            nodes, pos = read_nodes_iter(tree_text, parser, 0, tree_class)
+        else:
+            nodes, pos = [], 0
+
+        content, pos = read_content(tree_text, pos)
+        if pos != len(tree_text) - 1:
+            raise NewickError(f'root node ends at position {pos}, before tree ends')
+
+        props = get_props(content, not nodes, parser) if content else {}
+
+        return make_node(tree_class, props, nodes)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+cdef make_node(tree_class, dict props, list children):
+    """Return a new node of class tree_class with the given props and children."""
+    if tree_class is not Tree:  # subclasses may do more things on __init__
+        return tree_class(props, children)
+
+    # Same as Tree(props, children), but without copying the (new) props
+    # and checking the type of each child.
+    node = Tree.__new__(Tree)
+    node.props = props
+    node._children = children
+    for child in children:
+        child.up = node
+
+    return node
+
+
+def iter_trees(source, parser=None, workers=1, chunksize=100, tree_class=Tree):
+    """Yield the trees from a file with one or more newicks.
+
+    The newicks are split at their top-level ";" (so they can span
+    several lines, or be several in one line), and read in order.
+
+    :param source: Name of the file, or file object, with the newicks.
+        It can be gzipped.
+    :param parser: Parser used to read the newicks (see loads()).
+    :param workers: Number of processes reading the newicks. If None,
+        use as many as cpus.
+    :param chunksize: Number of newicks that each process reads at a time.
+
+    Example::
+
+      for t in newick.iter_trees('bootstraps.nw.gz', workers=8):
+          print(t.robinson_foulds(ref_tree)[0])
+    """
+    assert type(parser) != int or parser in INT_PARSERS, \
+        f'unknown parser: {parser}'
+
+    if hasattr(source, 'read'):
+        fp = text_stream(source)
+        try:
+            yield from read_trees(fp, parser, workers, chunksize, tree_class)
+        finally:
+            if fp is not source:
+                fp.detach()  # so the given file object is not closed with it
     else:
-        nodes, pos = [], 0
+        with open_text(source) as fp:
+            yield from read_trees(fp, parser, workers, chunksize, tree_class)
+
+
+def open_text(fname):
+    """Return a text file object for file fname, which can be gzipped."""
+    with open(fname, 'rb') as fp:
+        magic = fp.read(2)
+
+    return gzip.open(fname, 'rt') if magic == GZIP_MAGIC else open(fname)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def text_stream(fp):
+    """Return the given file object as a text (and not gzipped) one."""
+    if type(fp.read(0)) == str:
+        return fp  # already a text file object
+
+    if hasattr(fp, 'peek') and fp.peek(2)[:2] == GZIP_MAGIC:
+        fp = gzip.GzipFile(fileobj=fp)
+
+    return io.TextIOWrapper(fp)
+
+
+def read_trees(fp, parser, workers, chunksize, tree_class):
+    """Yield the trees from the newicks in file object fp."""
+    newicks = iter_newicks(fp)
+
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        for text in newicks:
+            yield loads(text, parser, tree_class)
+        return
+
+    # Read chunks of newicks in other processes, keeping only a few
+    # chunks in flight so we don't read the whole file in advance.
+    # The parser is sent as given: the int parsers contain lambdas and
+    # cannot be pickled (needed with the "spawn" start method).
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(parser,)) as executor:
+        max_pending = 2 * workers
+        pending = deque()
+        for chunk in chunked(newicks, chunksize):
+            pending.append(executor.submit(loads_chunk, chunk))
+            if len(pending) >= max_pending:
+                yield from unflatten_chunk(pending.popleft().result(),
+                                           tree_class)
+
+        while pending:
+            yield from unflatten_chunk(pending.popleft().result(), tree_class)
+
+
+def chunked(iterable, size):
+    """Yield lists with the next size elements of the iterable."""
+    chunk = []
+    for x in iterable:
+        chunk.append(x)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
 
-    content, pos = read_content(tree_text, pos)
-    if pos != len(tree_text) - 1:
-        raise NewickError(f'root node ends at position {pos}, before tree ends')
+# The trees read in other processes are sent back flattened (as a list
+# of props and a list of parent positions) and pickled, which is much
+# faster to transfer than the nodes themselves. They are unpickled and
+# rebuilt in the main process with the garbage collector paused.
 
-    props = get_props(content, not nodes, parser) if content else {}
+_worker_parser = None  # parser used by loads_chunk()
 
-    return tree_class(props, nodes)
+def init_worker(parser):
+    global _worker_parser
+    _worker_parser = INT_PARSERS[parser] if type(parser) == int else parser
+
+
+def loads_chunk(texts):
+    """Return the pickled list of flattened trees from the given newicks."""
+    gc_enabled = gc.isenabled()
+    gc.disable()  # the trees will be garbage, collect them all at once later
+    try:
+        return pickle.dumps([flatten(loads(text, _worker_parser))
+                             for text in texts])
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def flatten(tree):
+    """Return the props (in preorder) of all nodes, and their parents' index."""
+    nodes, parents, _ = ops.flatten(tree)  # same order as the node ids
+    return [node.props for node in nodes], parents.tolist()
+
+
+def unflatten_chunk(data, tree_class=Tree):
+    """Return the list of trees from the pickled flattened trees in data."""
+    gc_enabled = gc.isenabled()
+    gc.disable()  # as in loads(), do not collect while creating nodes
+    try:
+        return [unflatten(props, parents, tree_class)
+                for props, parents in pickle.loads(data)]
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def unflatten(list props, list parents, tree_class=Tree):
+    """Return the tree corresponding to the flattened one."""
+    cdef Py_ssize_t i, n = len(props)
+    cdef list children = [[] for _ in range(n)]  # in reverse order
+
+    for i in range(n - 1, -1, -1):  # reverse preorder: children come first
+        children[i].reverse()
+        node = make_node(tree_class, props[i], children[i])
+        if parents[i] >= 0:
+            children[parents[i]].append(node)
+
+    return node  # the root
+
+
+def iter_newicks(fp, long bufsize=2**20):
+    """Yield the newicks in file object fp, each one ending in ";".
+
+    The newicks are split at the ";" characters that are not within a
+    quoted name or a comment.
+    """
+    cdef Py_UCS4 c, quote = 0  # quoting character if inside a quoted name
+    cdef bint in_comment = False
+    cdef bint starting = True  # are we at the start of a node's content?
+    cdef Py_ssize_t i, start
+    cdef str block
+
+    parts = []  # pieces (from previous blocks) of the newick being read
+    while True:
+        block = fp.read(bufsize)
+        if not block:
+            break
+
+        start = 0
+        for i in range(len(block)):
+            c = block[i]
+            if quote:
+                if c == quote:
+                    quote = 0  # an escaped quote ('') will reopen it next
+            elif in_comment:
+                in_comment = (c != u']')
+            elif c == u'[':
+                in_comment = True
+            elif (c == u"'" or c == u'"') and starting:
+                quote = c  # like read_content(), only quoted at the start
+            elif c == u';':
+                parts.append(block[start:i+1])
+                text = ''.join(parts).strip()
+                parts = []
+                start = i + 1
+                starting = True
+                if text != ';':  # skip empty newicks
+                    yield text
+            elif not (c == u' ' or c == u'\t' or c == u'\r' or c == u'\n'):
+                starting = (c == u'(' or c == u',' or c == u')')
+
+        parts.append(block[start:])
+
+    text = ''.join(parts).strip()
+    if text:
+        raise NewickError('text ends with no ";": %s' % repr_short(text))
+
+
+def read_nodes_iter(str nodes_text, parser, long pos=0, tree_class=Tree):
+    """Return a list of nodes and the position in the text where they end.
+
+    Same as read_nodes(), but it uses an explicit stack instead of
+    recursion, so it can read arbitrarily deep trees.
+    """
+    # nodes_text looks like '(a,b,c)', where any element can be a list of nodes
+    if nodes_text[pos] != '(':
+        raise NewickError('nodes text starts with no "("')
+
+    cdef Py_ssize_t end, n = len(nodes_text)
+    cdef list stack = []  # lists of sibling nodes of the open ancestors
+    cdef list nodes = []  # siblings being read at the current level
+    cdef list children
+
+    while True:
+        # Here nodes_text[pos] is "(" (new level) or "," (next sibling).
+        pos += 1
+        if pos >= n:
+            raise NewickError('nodes text ends missing a matching ")"')
+
+        pos = skip_blank(nodes_text, pos)
+
+        if nodes_text[pos] == '(':  # this element is a list of nodes
+            stack.append(nodes)
+            nodes = []
+            continue
+
+        children = []  # this element is a leaf
+
+        while True:  # read the node, and the ones that its ")" closes
+            end = content_end(nodes_text, pos)
+            content = nodes_text[pos:end]
+            pos = end
+
+            nodes.append(make_node(tree_class,
+                                   get_props(content, not children, parser),
+                                   children))
+
+            if nodes_text[pos] != ')':
+                break  # more siblings will come
+
+            if not stack:
+                return nodes, pos+1
+
+            children, nodes = nodes, stack.pop()  # go up one level
+            pos += 1
 
 
 def read_nodes(nodes_text, parser, long pos=0, tree_class=Tree):
@@ -277,8 +603,17 @@ def skip_spaces_and_comments(text, long pos):
     """Return position in text after pos and all whitespaces and comments."""
     # text = '...  [this is a comment] node1...'
     #            ^-- pos               ^-- pos (returned)
-    while pos < len(text) and text[pos] in ' \t\r\n[':
-        if text[pos] == '[':
+    return skip_blank(text, pos)
+
+
+cdef Py_ssize_t skip_blank(str text, Py_ssize_t pos) except -1:
+    """Return position in text after pos and all whitespaces and comments."""
+    cdef Py_ssize_t start, n = len(text)
+    cdef Py_UCS4 c
+
+    while pos < n:
+        c = text[pos]
+        if c == u'[':
             start = pos
             if text[pos+1] == '&':  # special annotation
                 return pos
@@ -286,6 +621,8 @@ def skip_spaces_and_comments(text, long pos):
                 pos = text.find(']', pos+1)  # skip comment
                 if pos < 0:
                     raise NewickError(f'unfinished comment at position {start}')
+        elif not (c == u' ' or c == u'\t' or c == u'\r' or c == u'\n'):
+            break
         pos += 1  # skip whitespace and comment endings
 
     return pos
@@ -297,7 +634,11 @@ def read_content(str text, long pos, endings=',);'):
     #             ^-- pos              ^-- pos (returned)
     start = pos
 
-    pos = skip_spaces_and_comments(text, pos)
+    if endings == ',);':  # the usual case, scan it fast
+        pos = content_end(text, pos)
+        return text[start:pos], pos
+
+    pos = skip_blank(text, pos)
 
     if pos < len(text) and text[pos] in ["'", '"']:
         pos = skip_quoted_name(text, pos)
@@ -308,6 +649,26 @@ def read_content(str text, long pos, endings=',);'):
     return text[start:pos], pos
 
 
+cdef Py_ssize_t content_end(str text, Py_ssize_t pos) except -1:
+    """Return the position where the content of a node starting at pos ends."""
+    # Like read_content() with endings ',);', but without creating strings.
+    cdef Py_ssize_t n = len(text)
+    cdef Py_UCS4 c
+
+    pos = skip_blank(text, pos)
+
+    if pos < n and (text[pos] == u"'" or text[pos] == u'"'):
+        pos = skip_quoted_name(text, pos)
+
+    while pos < n:
+        c = text[pos]
+        if c == u',' or c == u')' or c == u';':
+            break
+        pos += 1
+
+    return pos
+
+
 def skip_quoted_name(str text, long pos):
     """Return the position where a quoted name ends."""
     # text = "... 'node ''2'' in tree' ..."
@@ -333,18 +694,62 @@ def skip_quoted_name(str text, long pos):
 
 def dumps(tree, props=None, parser=None, format_root_node=True, is_leaf_fn=None):
     """Return newick representation of the given tree."""
-    node_str = ('' if tree.is_root and not format_root_node else
-                content_repr(tree, props, parser))
-
-    if tree.children and (not is_leaf_fn or not is_leaf_fn(tree)):
-        children_str = ','.join(dumps(node, props, parser,
-                                      format_root_node, is_leaf_fn).rstrip(';')
-                                for node in tree.children)
-        return f'({children_str}){node_str};'
-    else:
-        return f'{node_str};'
+    return ''.join(iter_newick(tree, props, parser, format_root_node, is_leaf_fn))
+
 
+def dump(tree, fp, props=None, parser=None, format_root_node=True, is_leaf_fn=None,
+         long chunksize=2**16):
+    """Write the newick representation of the given tree to file object fp.
 
-def dump(tree, fp, props=None, parser=None, format_root_node=True, is_leaf_fn=None):
-    fp.write(dumps(tree, props, parser, format_root_node, is_leaf_fn))
-    fp.write('\n')
+    The newick is written in pieces of about chunksize characters, so
+    it never is all in memory.
+    """
+    cdef list parts = []
+    cdef long size = 0
+
+    for text in iter_newick(tree, props, parser, format_root_node, is_leaf_fn):
+        parts.append(text)
+        size += len(text)
+        if size >= chunksize:
+            fp.write(''.join(parts))
+            parts = []
+            size = 0
+
+    parts.append('\n')
+    fp.write(''.join(parts))
+
+
+def iter_newick(tree, props=None, parser=None, format_root_node=True,
+                is_leaf_fn=None):
+    """Yield the pieces of text that form the newick of the given tree."""
+    # Instead of recursing, we keep in a stack the nodes to write and the
+    # texts that go between them. For a node, we will write:
+    #   '(' child_1 ',' child_2 ',' ... child_n ')' content
+    content = content_writer(props, parser)
+
+    root_str = ('' if tree.is_root and not format_root_node else
+                content(tree))
+
+    cdef list pending = [tree]  # nodes and texts still to be written
+
+    while pending:
+        node = pending.pop()
+
+        if type(node) is str:
+            yield node  # one of ',' or ')content'
+            continue
+
+        node_str = root_str if node is tree else content(node)
+        children = node.children
+
+        if children and (not is_leaf_fn or not is_leaf_fn(node)):
+            yield '('
+            pending.append(')' + node_str)
+            for child in reversed(children):
+                pending.append(child)
+                pending.append(',')
+            pending.pop()  # no ',' before the first child
+        else:
+            yield node_str
+
+    yield ';'
@@ -543,13 +543,26 @@ class PhyloTree(Tree):
         """
         t = self
         if autodetect_duplications:
-            n2content = t.get_cached_content()
-            n2species = t.get_cached_content(prop)
-            for node in n2content:
-                sp_subtotal = sum([len(n2species[_ch]) for _ch in node.children])
-                if len(n2species[node]) > 1 and len(n2species[node]) != sp_subtotal:
+            # Find the species under each node in a single postorder pass,
+            # reusing the biggest set of its children (we only need sizes).
+            n2species = {}
+            for node in t.traverse('postorder'):
+                if node.is_leaf:
+                    n2species[node] = {node.get_prop(prop)}
+                    continue
+
+                ch_species = sorted((n2species.pop(ch) for ch in node.children),
+                                    key=len, reverse=True)
+                sp_subtotal = sum(len(sp) for sp in ch_species)
+                species = ch_species[0]
+                for sp in ch_species[1:]:
+                    species |= sp
+
+                if len(species) > 1 and len(species) != sp_subtotal:
                     node.props['evoltype'] = 'D'
 
+                n2species[node] = species
+
         sp_trees = get_subtrees(t, properties=map_properties, newick_only=newick_only)
 
         return sp_trees
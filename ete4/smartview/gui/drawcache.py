@@ -0,0 +1,124 @@
+"""
+Cache of the graphics drawn for the trees in the server.
+
+Drawing a viewport means walking the tree, creating all the graphic
+elements, encoding them as json and compressing them. When the same
+view (or one close to it) is asked again, we can send the same bytes.
+
+The drawings are saved for a whole tile: a region aligned to a grid
+that contains the viewport. Tiles are bigger than the viewport, so
+small pans are answered with an already drawn tile.
+
+The drawings of a tree are forgotten when it changes: the server calls
+invalidate() after any request that may change it. The same happens with
+the index of the positions of the nodes used by the drawers.
+"""
+
+from collections import OrderedDict
+from math import floor, ceil, log2
+from threading import Lock
+
+from ete4.smartview.renderer.drawindex import DrawIndex
+
+
+class DrawCache:
+    """Drawn graphics (bytes) of the most recently used views of the trees."""
+
+    def __init__(self, max_bytes=200*1024*1024):
+        """
+        :param max_bytes: Maximum size of all the drawings kept.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0  # current size of all the drawings
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (graphics, extra)
+        self._versions = {}  # tid -> number of times its drawings were invalidated
+        self._generation = 0  # number of times all drawings were invalidated
+        self._indices = {}  # tid -> DrawIndex
+        self._lock = Lock()
+
+    def version(self, tid):
+        """Return the current version of the drawings of tree tid."""
+        return self._generation, self._versions.get(tid, 0)
+
+    def index(self, tid):
+        """Return the index of node positions to draw tree tid."""
+        with self._lock:
+            return self._indices.setdefault(tid, DrawIndex())
+
+    def get(self, key):
+        """Return (graphics, extra) for key, or None if it is not there."""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, version, graphics, extra=None):
+        """Save the graphics (and extra info) drawn for the given version.
+
+        The first element of key must be the id of the tree drawn.
+        """
+        size = len(graphics)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if version != self.version(key[0]):
+                return  # the tree changed while drawing
+
+            if key in self._data:
+                self.nbytes -= len(self._data[key][0])
+
+            self._data[key] = (graphics, extra)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, (old_graphics, _) = self._data.popitem(last=False)
+                self.nbytes -= len(old_graphics)
+
+    def invalidate(self, tid=None):
+        """Forget the drawings of tree tid (or of all trees if None)."""
+        with self._lock:
+            if tid is None:
+                self._generation += 1
+                self._data.clear()
+                self._indices.clear()
+                self.nbytes = 0
+            else:
+                self._versions[tid] = self._versions.get(tid, 0) + 1
+                self._indices.pop(tid, None)
+                for key in [k for k in self._data if k[0] == tid]:
+                    self.nbytes -= len(self._data.pop(key)[0])
+
+    def info(self):
+        """Return dict with the hits, misses, number of drawings and bytes."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'nbytes': self.nbytes,
+                    'max_bytes': self.max_bytes}
+
+
+def get_tile(viewport):
+    """Return the tile (x, y, w, h) that contains the given viewport.
+
+    The tile is made of cells of a grid, with a cell size (a power of 2)
+    between half the viewport size and its size, and goes from the cell
+    where the viewport starts to as many cells as needed to contain any
+    viewport of that size starting in the same cell.
+    """
+    x, y, w, h = viewport
+    tx, tw = get_tile_segment(x, w)
+    ty, th = get_tile_segment(y, h)
+    return tx, ty, tw, th
+
+
+def get_tile_segment(x, w):
+    """Return start and length of the tile segment that contains x, x+w."""
+    cell = 2**floor(log2(w))  # w/2 < cell <= w
+    ncells = ceil(w / cell) + 1
+    return floor(x / cell) * cell, ncells * cell
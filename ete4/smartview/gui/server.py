@@ -23,10 +23,12 @@ from math import pi, inf
 from time import time, sleep
 from datetime import datetime
 from collections import defaultdict, namedtuple
+from itertools import chain
 from copy import copy, deepcopy
 from dataclasses import dataclass
 import gzip, bz2, zipfile, tarfile
 import json
+import base64
 import _pickle as pickle
 import shutil
 import logging
@@ -34,7 +36,7 @@ import logging
 import brotli
 
 from bottle import (
-    get, post, put, redirect, static_file,
+    get, post, put, hook, redirect, static_file,
     BaseRequest, request, response, error, abort, HTTPError, run)
 
 BaseRequest.MEMFILE_MAX = 50 * 1024 * 1024  # maximum upload size (in bytes)
@@ -45,6 +47,8 @@ from ete4.smartview import TreeStyle, layout_modules
 from ete4.parser import ete_format, nexus
 from ete4.core import operations as ops
 from ete4.smartview.renderer import drawer as drawer_module
+from ete4.smartview.gui.drawcache import DrawCache, get_tile
+from ete4.smartview.gui import wireformat
 from ete4 import treematcher as tm
 
 
@@ -100,6 +104,43 @@ class TreeData:
     searches: dict = None
 
 
+# Routes that do not change the trees (after any other, the drawings of
+# the tree are removed from the cache).
+READONLY_ROUTES = {
+    '/drawers/<name>/<tree_id>',
+    '/layouts/<tree_id>',
+    '/trees/<tree_id>',
+    '/trees/<tree_id>/nodeinfo',
+    '/trees/<tree_id>/nodestyle',
+    '/trees/<tree_id>/editable_props',
+    '/trees/<tree_id>/name',
+    '/trees/<tree_id>/newick',
+    '/trees/<tree_id>/seq',
+    '/trees/<tree_id>/nseq',
+    '/trees/<tree_id>/all_selections',
+    '/trees/<tree_id>/selections',
+    '/trees/<tree_id>/selection/info',
+    '/trees/<tree_id>/active',
+    '/trees/<tree_id>/all_active',
+    '/trees/<tree_id>/all_active_leaves',
+    '/trees/<tree_id>/searches',
+    '/trees/<tree_id>/find',
+    '/trees/<tree_id>/draw',
+    '/trees/<tree_id>/size',
+    '/trees/<tree_id>/collapse_size',
+    '/trees/<tree_id>/properties',
+    '/trees/<tree_id>/properties/<pname>',
+    '/trees/<tree_id>/nodecount',
+    '/trees/<tree_id>/ultrametric'}
+
+@hook('after_request')
+def invalidate_drawings():
+    route = request.environ.get('bottle.route')
+    if route and 'tree_id' in request.url_args and route.rule not in READONLY_ROUTES:
+        tid, _ = get_tid(request.url_args['tree_id'])
+        app.draw_cache.invalidate(tid)
+
+
 # Routes.
 
 @get('/')
@@ -435,16 +476,23 @@ def callback(tree_id):
 @get('/trees/<tree_id>/draw')
 def callback(tree_id):
     try:
+        fmt = request.query.get('format', 'json')
+        assert fmt in ['json', 'binary'], f'invalid format: {fmt}'
+
+        stream = request.query.get('stream') == '1'  # send while drawing?
+
         drawer = get_drawer(tree_id, request.query)
 
-        graphics = json.dumps(list(drawer.draw())).encode('utf8')
+        graphics = get_graphics(tree_id, drawer, fmt, stream)
 
-        response.content_type = 'application/json'
+        response.content_type = {
+            ('json', False): 'application/json',
+            ('json', True): 'application/x-ndjson',  # a json list per line
+            ('binary', False): wireformat.CONTENT_TYPE,
+            ('binary', True): wireformat.STREAM_CONTENT_TYPE}[fmt, stream]
         if app.compress:
             response.add_header('Content-Encoding', 'br')
-            return brotli.compress(graphics)
-        else:
-            return graphics
+        return graphics
     except (AssertionError, SyntaxError) as e:
         abort(400, f'when drawing: {e}')
 
@@ -513,8 +561,7 @@ def callback(tree_id):
         abort(400, 'operation not allowed with subtree')
 
     node_id = req_json()
-    tree_data.tree.set_outgroup(tree_data.tree[node_id])
-    ops.update_sizes_all(tree_data.tree)
+    tree_data.tree.set_outgroup(tree_data.tree[node_id])  # updates sizes
     return {'message': 'ok'}
 
 @put('/trees/<tree_id>/move')
@@ -534,8 +581,7 @@ def callback(tree_id):
 
     try:
         node_id = req_json()
-        ops.remove(tree_data.tree[subtree][node_id])
-        ops.update_sizes_all(tree_data.tree)
+        ops.remove(tree_data.tree[subtree][node_id])  # updates sizes
         return {'message': 'ok'}
     except AssertionError as e:
         abort(400, f'cannot remove {node_id}: {e}')
@@ -557,7 +603,7 @@ def callback(tree_id):
         node_id, content = req_json()
         node = tree_data.tree[subtree][node_id]
         node.props = newick.get_props(content, is_leaf=True)
-        ops.update_sizes_all(tree_data.tree)
+        ops.update_sizes_from(node)  # only its dist could have changed
         return {'message': 'ok'}
     except (AssertionError, newick.NewickError) as e:
         abort(400, f'cannot edit {node_id}: {e}')
@@ -577,7 +623,6 @@ def callback(tree_id):
     try:
         node_id = req_json()
         ops.to_ultrametric(tree_data.tree[subtree][node_id])
-        ops.update_sizes_all(tree_data.tree)
         return {'message': 'ok'}
     except AssertionError as e:
         abort(400, f'cannot convert to ultrametric {tree_id}: {e}')
@@ -752,7 +797,7 @@ def retrieve_tree_data(tid):
 def get_drawer(tree_id, args):
     "Return the drawer initialized as specified in the args"
     valid_keys = ['x', 'y', 'w', 'h', 'panel', 'zx', 'zy', 'za',
-                  'drawer', 'min_size',
+                  'drawer', 'min_size', 'format', 'stream',
                   'layouts', 'ultrametric', 'collapsed_ids',
                   'rmin', 'amin', 'amax']
 
@@ -805,9 +850,11 @@ def get_drawer(tree_id, args):
             ops.update_sizes_all(tree_data.tree)
             initialize_tree_style(tree_data)
             tree_data.ultrametric = ultrametric
+            app.draw_cache.invalidate(tid)
         elif not ultrametric and tree_data.ultrametric:  # change to off
             app.trees.pop(tid, None)  # delete from memory
             # Forces it to be reloaded from disk next time it is accessed.
+            app.draw_cache.invalidate(tid)
 
         active = tree_data.active
         selected = tree_data.selected
@@ -816,7 +863,8 @@ def get_drawer(tree_id, args):
         return drawer_class(
             load_tree(tree_id), viewport, panel, zoom,
             limits, collapsed_ids, active, selected, searches,
-            layouts, tree_data.style, tree_data.include_props, tree_data.exclude_props)
+            layouts, tree_data.style, tree_data.include_props, tree_data.exclude_props,
+            app.draw_cache.index(tid))
     # bypass errors for now...
     except StopIteration as error:
         abort(400, f'not a valid drawer: {drawer_name}')
@@ -824,6 +872,124 @@ def get_drawer(tree_id, args):
         abort(400, str(e))
 
 
+def get_graphics(tree_id, drawer, fmt='json', stream=False):
+    """Return the graphics drawn by drawer as (maybe compressed) bytes.
+
+    The graphics are encoded in the given format: 'json' or 'binary'
+    (see wireformat.py). If stream is True, they are encoded in groups
+    (as json lines or binary frames) and, if they are not in the cache,
+    we return an iterator that yields them as they are drawn.
+
+    The graphics come from the cache if they were drawn before. Otherwise
+    we draw the whole tile that contains the viewport, and cache them.
+    """
+    tid, subtree = get_tid(tree_id)
+    style = drawer.tree_style
+
+    if drawer.viewport and drawer.panel in [0, 1]:
+        drawer.viewport = drawer_module.Box(*get_tile(drawer.viewport))
+
+    key = (tid, tuple(subtree), type(drawer).__name__, drawer.COLLAPSE_SIZE,
+           drawer.panel, drawer.viewport if drawer.panel != -1 else None,
+           drawer.zoom, (drawer.xmin, drawer.xmax, drawer.ymin, drawer.ymax),
+           frozenset(drawer.collapsed_ids),
+           tuple(sorted(str(ly.name) for ly in drawer.layouts)),
+           app.trees[tid].ultrametric, app.compress, fmt, stream,
+           frozenset(style.aligned_grid_dxs.items()) if drawer.panel != 0 else None)
+    # NOTE: Panel 0 computes the aligned grid, which the others use.
+
+    version = app.draw_cache.version(tid)
+
+    cached = app.draw_cache.get(key)
+    if cached:
+        graphics, aligned_grid_dxs = cached
+        if drawer.panel == 0:  # leave the grid as if we had drawn it
+            style.aligned_grid_dxs = defaultdict(lambda: 0, aligned_grid_dxs)
+        return graphics
+
+    if stream:
+        return stream_graphics(drawer, fmt, key, version)
+
+    if fmt == 'binary':
+        graphics = wireformat.encode(list(drawer.draw()))
+    else:
+        graphics = json.dumps(list(drawer.draw())).encode('utf8')
+    if app.compress:
+        graphics = brotli.compress(graphics)
+
+    app.draw_cache.put(key, version, graphics, dict(style.aligned_grid_dxs))
+
+    return graphics
+
+
+def stream_graphics(drawer, fmt, key, version):
+    """Return an iterator over the graphics drawn by drawer, in encoded chunks.
+
+    The first group of elements is drawn before returning, so an error
+    there is raised (and answered with an error status). If drawing fails
+    later, the last group sent is a dict with the error message instead.
+
+    The chunks are saved in the cache too, unless they get too big.
+    """
+    batches = get_batches(drawer.draw())
+    first = next(batches)  # may raise an error while drawing
+
+    return stream_chunks(chain([first], batches), drawer, fmt, key, version)
+
+
+def stream_chunks(batches, drawer, fmt, key, version):
+    """Yield the encoded batches of graphics elements, and cache them."""
+    encode = (wireformat.encode_frame if fmt == 'binary' else
+              lambda elements: json.dumps(elements).encode('utf8') + b'\n')
+
+    compressor = brotli.Compressor() if app.compress else None
+
+    def encoded(elements):
+        chunk = encode(elements)
+        return compressor.process(chunk) + compressor.flush() if compressor \
+            else chunk
+
+    chunks, size = [], 0  # to put in the cache
+    def add(chunk):
+        nonlocal chunks, size
+        if chunks is not None:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > app.draw_cache.max_bytes:
+                chunks = None  # too big, keep memory bounded and do not cache
+        return chunk
+
+    try:
+        for elements in batches:
+            yield add(encoded(elements))
+    except Exception as e:  # we already sent the status, so we tell it here
+        chunks = None  # do not cache
+        yield encoded({'message': f'when drawing: {e}'})
+
+    if compressor:
+        yield add(compressor.finish())
+
+    if chunks is not None:
+        app.draw_cache.put(key, version, b''.join(chunks),
+                           dict(drawer.tree_style.aligned_grid_dxs))
+
+
+def get_batches(elements, max_size=5000, max_time=0.2):
+    """Yield lists of elements, as soon as they are big or old enough.
+
+    At least one list (maybe empty) is yielded.
+    """
+    batch, t0, nbatches = [], time(), 0
+    for element in elements:
+        batch.append(element)
+        if len(batch) >= max_size or time() - t0 > max_time:
+            yield batch
+            batch, t0, nbatches = [], time(), nbatches + 1
+
+    if batch or nbatches == 0:
+        yield batch
+
+
 def get_newick(tree_id, max_mb):
     "Return the newick representation of the given tree"
 
@@ -1040,9 +1206,7 @@ def prune_by_selection(tid, args):
     if len(selected) == 0:
         abort(400, 'selection does not exist')
 
-    tree_data.tree.prune(selected)
-
-    ops.update_sizes_all(tree_data.tree)
+    tree_data.tree.prune(selected)  # updates sizes
 
     tree_data.initialized = False
 
@@ -1276,20 +1440,10 @@ def get_topological_search(pattern):
 
 def get_stats(tree_id, pname):
     "Return some statistics about the given property pname"
-    pmin, pmax = inf, -inf
-    n, pmean, pmean2 = 0, 0, 0
     try:
-        for node in load_tree(tree_id):
-            if pname in node.props:
-                value = float(node.props[pname])
-                pmin, pmax = min(pmin, value), max(pmax, value)
-                pmean = (n * pmean + value) / (n + 1)
-                pmean2 = (n * pmean2 + value*value) / (n + 1)
-                n += 1
-        assert n > 0, 'no node has the given property'
-        return {'n': n, 'min': pmin, 'max': pmax, 'mean': pmean,
-                'var': pmean2 - pmean*pmean}
-    except (ValueError, AssertionError) as e:
+        columns = load_tree(tree_id).to_columns([pname])
+        return columns.stats(pname, leaves_only=True)
+    except ValueError as e:
         abort(400, f'when reading property {pname}: {e}')
 
 
@@ -1423,8 +1577,11 @@ def add_tree(data):
 
     if nw is not None:
         tree = load_tree_from_newick(tid, nw)
-    elif bpickle is not None:
-        tree = ete_format.loads(bpickle, unpack=True)
+    elif bpickle is not None:  # base64-encoded tree in ete format
+        try:
+            tree = ete_format.loads(base64.b64decode(bpickle))
+        except (ValueError, ete_format.EteFormatError) as e:
+            abort(400, f'bad tree in ete format: {e}')
         ops.update_sizes_all(tree)
     else:
         tree = data.get('tree')
@@ -1553,6 +1710,7 @@ def del_tree(tid):
     "Delete a tree and everywhere where it appears referenced"
     shutil.rmtree(f'/tmp/{tid}.pickle', ignore_errors=True)
     app.trees.pop(tid, None)
+    app.draw_cache.invalidate(tid)
 
 
 def copy_style(tree_style):
@@ -1590,6 +1748,9 @@ def initialize(tree=None, layouts=None,
     # Dict containing TreeData dataclasses with tree info
     app.trees = {}
 
+    # Graphics already drawn (cleared for each tree when it changes)
+    app.draw_cache = DrawCache()
+
     thread_maintenance = Thread(daemon=True, target=maintenance, args=(app,))
     thread_maintenance.start()
     g_threads['maintenance'] = thread_maintenance
@@ -1610,6 +1771,7 @@ def run_smartview(tree=None, name=None, layouts=[],
                 app.default_layouts, app.avail_layouts = get_layouts(layouts)
                 tree_data.layouts = retrieve_layouts([])
                 tree_data.initialized = False
+                app.draw_cache.invalidate(tid)  # it may have changed
 
                 if open_browser:
                     _, listening_port = g_threads['webserver']
@@ -1682,6 +1844,7 @@ def maintenance(app, check_interval=60, max_time=30*60):
             if inactivity_time > max_time:
                 app.trees.pop(tid)  # delete from memory
                 # Will be reloaded from disk next time it is accessed.
+                app.draw_cache.invalidate(tid)
 
         sleep(check_interval)
 
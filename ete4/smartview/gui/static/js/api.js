@@ -1,7 +1,10 @@
 // Functions related to the interaction with the server, including html cleanup
 // and error handling.
 
-export { escape_html, hash, api, api_post, api_put };
+import { decode_graphics, read_graphics_stream } from "./wireformat.js";
+
+export { escape_html, hash, api, api_graphics, api_graphics_stream,
+         api_post, api_put };
 
 
 // API calls.
@@ -15,6 +18,64 @@ async function api(endpoint, path="") {
     return await response.json();
 }
 
+// Make a GET api call for graphics in the given format ("json" or "binary",
+// see wireformat.py) and return them.
+async function api_graphics(endpoint, format="json", path="") {
+    const sep = endpoint.includes("?") ? "&" : "?";
+    const response = await fetch(path + endpoint + sep + `format=${format}`);
+
+    await assert(response.status === 200, "Request failed :(", response);
+
+    return format === "binary" ? decode_graphics(await response.arrayBuffer()) :
+                                 await response.json();
+}
+
+// Make a GET api call for graphics (asking them as a stream in the given
+// format), call on_items() with each group of them as they arrive, and
+// return them all.
+async function api_graphics_stream(endpoint, on_items, format="json", path="") {
+    const sep = endpoint.includes("?") ? "&" : "?";
+    const response = await fetch(path + endpoint + sep +
+                                 `format=${format}&stream=1`);
+
+    await assert(response.status === 200, "Request failed :(", response);
+
+    const read = format === "binary" ? read_graphics_stream : read_json_lines;
+
+    const items = [];
+    await read(response.body, group => {
+        if (!Array.isArray(group))  // error while drawing, after the status
+            throw new Error("Drawing failed :(<br><br>" +
+                            `<b>Message:</b> ${escape_html(group.message)}`);
+        group.forEach(item => items.push(item));
+        on_items(group);
+    });
+    return items;
+}
+
+// Call on_items() with the value of each json line, as they are read from
+// the given stream (a ReadableStream of text with a json value per line).
+async function read_json_lines(stream, on_items) {
+    const reader = stream.pipeThrough(new TextDecoderStream()).getReader();
+    let text = "";  // text read and not parsed yet
+
+    while (true) {
+        const { done, value } = await reader.read();
+
+        if (value) {
+            const lines = (text + value).split("\n");
+            text = lines.pop();  // the last line is not complete yet
+            lines.forEach(line => on_items(JSON.parse(line)));
+        }
+
+        if (done)
+            break;
+    }
+
+    if (text.length > 0)
+        throw new Error("Incomplete graphics in the stream");
+}
+
 // Make a POST api call using the stored authentication.
 async function api_post(endpoint, data, path="") {
     const response = await fetch(path + endpoint, {
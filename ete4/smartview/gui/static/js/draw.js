@@ -8,7 +8,7 @@ import { colorize_active, get_active_class } from "./active.js";
 import { colorize_searches, get_search_class } from "./search.js";
 import { colorize_selections, get_selection_class } from "./select.js";
 import { on_box_contextmenu } from "./contextmenu.js";
-import { api } from "./api.js";
+import { api, api_graphics, api_graphics_stream } from "./api.js";
 import { draw_pixi, clear_pixi } from "./pixi.js";
 
 export { update, draw_tree, draw_tree_scale, draw_aligned, draw, get_class_name,
@@ -82,9 +82,15 @@ async function draw_tree() {
     try {
         clearTimeout(align_timeout);
 
-        const items = await api(`/trees/${get_tid()}/draw?${qs}`);
+        // Draw the items as they arrive, and again at the end if some of
+        // them (like pixi ones) cannot be drawn in separate groups.
+        let ngroups = 0;
+        const items = await api_graphics_stream(`/trees/${get_tid()}/draw?${qs}`,
+            group => draw(div_tree, group, view.tl, view.zoom, ngroups++ === 0),
+            view.graphics_format);
 
-        draw(div_tree, items, view.tl, view.zoom);
+        if (ngroups > 1 && !items.every(is_svg))
+            draw(div_tree, items, view.tl, view.zoom);
 
         clearTimeout(align_timeout);
 
@@ -206,11 +212,6 @@ function draw_negative_xaxis() {
 // Append a svg to the given element, with all the items in the list drawn.
 // The first child of element will be used or replaced as a svg.
 function draw(element, items, tl, zoom, replace=true) {
-    const is_svg = item => {
-        const name = item[0];
-        return !(name.includes("pixi-") || name === "html" || name === "img")
-    }
-
     const g = create_svg_element("g");
 
     const svg_items = items.filter(is_svg);
@@ -252,6 +253,13 @@ function draw(element, items, tl, zoom, replace=true) {
 }
 
 
+// Return true if the item is drawn as an svg element (not with pixi, etc.).
+function is_svg(item) {
+    const name = item[0];
+    return !(name.includes("pixi-") || name === "html" || name === "img");
+}
+
+
 // Make a copy of the nodeboxes and put them before all the other elements,
 // so if they stop being transparent (because they are tagged, or the result
 // of a search, or the user changes the node opacity), they do not cover the
@@ -312,7 +320,8 @@ async function draw_legend(params) {
         ...params, "panel": -1,
     }).toString();
 
-    const items = await api(`/trees/${get_tid()}/draw?${qs}`);
+    const items = await api_graphics(`/trees/${get_tid()}/draw?${qs}`,
+                                     view.graphics_format);
 
     if (items.length) {
         const div = document.createElement("div");
@@ -364,7 +373,8 @@ async function draw_aligned(params, npanels) {
 
             const div = panel.div;
 
-            const items = await api(`/trees/${get_tid()}/draw?${qs}`);
+            const items = await api_graphics(`/trees/${get_tid()}/draw?${qs}`,
+                                             view.graphics_format);
 
             // Resize headers accordingly or remove them in no items
             if (panel_n === 2 || panel_n === 3) {
@@ -391,7 +401,8 @@ async function draw_aligned(params, npanels) {
                 "rmin": view.rmin + panel * view.tree_size.width
             }).toString();
 
-            const items = await api(`/trees/${get_tid()}/draw?${qs}`);
+            const items = await api_graphics(`/trees/${get_tid()}/draw?${qs}`,
+                                             view.graphics_format);
 
             const replace = false;
             draw(div_tree, items, view.tl, view.zoom, replace);
@@ -174,6 +174,8 @@ const view = {
 
     zoom_sensitivity: 1,
 
+    graphics_format: "json",  // or "binary" (smaller, but slower to decode)
+
     share_view: () => share_view(),
 
     show_help: () => show_help(),
@@ -406,6 +408,8 @@ async function set_query_string_values() {
             view.control_panel.show = value === "1";
         else if (param === "minimap")
             view.minimap.show = value === "1";
+        else if (param === "graphics")
+            view.graphics_format = value;  // "json" or "binary"
         else if (param === "layouts") {
             const active = value.split(",");
             active.forEach(a => {
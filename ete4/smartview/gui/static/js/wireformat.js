@@ -0,0 +1,108 @@
+// Decoding of the graphics sent by the server in binary format.
+//
+// See wireformat.py for a description of the format.
+
+export { decode_graphics, read_graphics_stream };
+
+
+const MAGIC = 0x47455445, VERSION = 1;
+
+const [NULL, FALSE, TRUE, NUMBER, STRING, LIST, DICT] = [0, 1, 2, 3, 4, 5, 6];
+
+
+// Return the graphics (a list of elements) encoded in the given ArrayBuffer.
+function decode_graphics(buffer) {
+    const header = new Uint32Array(buffer, 0, 8);
+    const [magic, version, nnumbers, nints, ntags, ntable, int_size] = header;
+
+    if (magic !== MAGIC || version !== VERSION)
+        throw new Error("Unknown format for the graphics");
+
+    let pos = header.byteLength;
+
+    const numbers = new Float64Array(buffer, pos, nnumbers);
+    pos += numbers.byteLength;
+
+    const ints = int_size === 2 ? new Uint16Array(buffer, pos, nints) :
+                                  new Uint32Array(buffer, pos, nints);
+    pos += ints.byteLength;
+
+    const tags = new Uint8Array(buffer, pos, ntags);
+    pos += tags.byteLength;
+
+    const strings = JSON.parse(
+        new TextDecoder().decode(new Uint8Array(buffer, pos, ntable)));
+
+    let [inumber, iint, itag] = [0, 0, 0];  // positions in the arrays
+
+    function get() {
+        switch (tags[itag++]) {
+        case NUMBER:
+            return numbers[inumber++];
+        case STRING:
+            return strings[ints[iint++]];
+        case LIST: {
+            const n = ints[iint++];
+            const list = new Array(n);
+            for (let i = 0; i < n; i++)
+                list[i] = get();
+            return list;
+        }
+        case DICT: {
+            const n = ints[iint++];
+            const dict = {};
+            for (let i = 0; i < n; i++) {
+                const key = strings[ints[iint++]];
+                dict[key] = get();
+            }
+            return dict;
+        }
+        case NULL:
+            return null;
+        case FALSE:
+            return false;
+        case TRUE:
+            return true;
+        }
+    }
+
+    return get();
+}
+
+
+// Call on_items() with the graphics of each frame as they are read from the
+// given stream (a ReadableStream of frames, each with its size as an uint32
+// followed by the encoded graphics).
+async function read_graphics_stream(stream, on_items) {
+    const reader = stream.getReader();
+    let data = new Uint8Array(0);  // data read and not decoded yet
+
+    while (true) {
+        const { done, value } = await reader.read();
+
+        if (value) {
+            const joined = new Uint8Array(data.length + value.length);
+            joined.set(data);
+            joined.set(value, data.length);
+            data = joined;
+
+            let pos = 0;  // start of the next frame
+            while (data.length - pos >= 4) {
+                const size = new DataView(data.buffer, pos, 4).getUint32(0, true);
+                if (data.length - pos - 4 < size)
+                    break;  // incomplete frame
+
+                const frame = data.slice(pos + 4, pos + 4 + size);  // aligned copy
+                on_items(decode_graphics(frame.buffer));
+                pos += 4 + size;
+            }
+            data = data.slice(pos);
+        }
+
+        if (done)
+            break;
+    }
+
+    if (data.length > 0)
+        throw new Error("Incomplete graphics in the stream");
+}
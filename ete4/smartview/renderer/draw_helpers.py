@@ -1,5 +1,7 @@
 from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from math import sin, cos, pi, sqrt, atan2
+import threading
 
 Box = namedtuple('Box', 'x y dx dy')  # corner and size of a 2D shape
 
@@ -24,10 +26,27 @@ def summary(nodes, prop="name"):
 
 def first_value(tree, prop):
     "Return the value of the requested property for the first node that has it"
+    index = getattr(_context, 'index', None)
+    if index is not None:
+        return index.first_value(tree, prop)  # faster, with saved values
+
     return next((node.props.get(prop) for node in tree.traverse('preorder')
                  if node.props.get(prop)), '')
 
 
+_context = threading.local()  # index of node summaries currently used
+
+@contextmanager
+def using_index(index):
+    "Make summary() and first_value() use the given DrawIndex inside the block"
+    previous = getattr(_context, 'index', None)
+    _context.index = index
+    try:
+        yield
+    finally:
+        _context.index = previous
+
+
 def get_xs(box):
     x, _, dx, _ = box
     return x, x + dx
@@ -12,6 +12,7 @@ from ete4.core import operations as ops
 from .. import TreeStyle
 from .face_positions import FACE_POSITIONS, make_faces
 from . import draw_helpers as dh
+from .drawindex import DrawIndex, first_reaching
 Box = dh.Box  # shortcut, because we use it a lot
 
 Size = namedtuple('Size', 'dx dy')  # size of a 2D shape (sizes are always >= 0)
@@ -77,7 +78,7 @@ class Drawer:
                  limits=None, collapsed_ids=None,
                  active=None, selected=None, searches=None,
                  layouts=None, tree_style=None,
-                 include_props=None, exclude_props=None):
+                 include_props=None, exclude_props=None, draw_index=None):
         self.tree = tree
         self.viewport = Box(*viewport) if viewport else None
         self.panel = panel
@@ -90,6 +91,7 @@ class Drawer:
         self.layouts = layouts or []
         self.include_props = include_props
         self.exclude_props = exclude_props
+        self.draw_index = draw_index or DrawIndex()  # to skip children fast
         self.tree_style = tree_style
         if not self.tree_style:
             self.tree_style = TreeStyle()
@@ -139,7 +141,7 @@ class Drawer:
         if not self.in_viewport(box_node):
             self.bdy_dys[-1].append( (box_node.dy / 2, box_node.dy) )
             it.descend = False  # skip children
-            return x, y + box_node.dy
+            return x, self.skip_siblings(it, y + box_node.dy)
 
         if not it.node.sm_style['draw_descendants']:
             # Skip descendants => in collapsed_ids
@@ -169,6 +171,37 @@ class Drawer:
             self.node_dxs.append([])
             return x + dx, y
 
+    def skip_siblings(self, it, y):
+        "Jump over the next siblings that are out of the viewport, return new y"
+        ys = self.visible_ys()
+        if ys is None or len(it.path) < 2:
+            return y  # nothing to skip (all is visible, or we are at the root)
+
+        parent = it.path[-2]
+        offsets = self.draw_index.offsets(parent)
+        if offsets is None:
+            return y  # not many siblings, they will be skipped one by one
+
+        ymin = next((y0 for y0, y1 in ys if y <= y1), None)  # next visible y
+        scale = self.node_size(parent).dy / parent.size[1]  # offsets -> dys
+
+        i = it.nvisited[-2]  # the current node is the i-th child of its parent
+        j = (first_reaching(offsets, i, (ymin - y) / scale) if ymin is not None
+             else len(parent.children))  # first sibling that may be visible
+
+        if j > i + 1:  # skip siblings i+1 ... j-1
+            # Add their branch dys and total dys, merging all but the last.
+            if j > i + 2:
+                dy = (offsets[j - 1] - offsets[i + 1]) * scale
+                self.bdy_dys[-1].append( (dy / 2, dy) )
+            dy = (offsets[j] - offsets[j - 1]) * scale
+            self.bdy_dys[-1].append( (dy / 2, dy) )
+
+            it.skip_siblings(j - i - 1)
+            y += (offsets[j] - offsets[i + 1]) * scale
+
+        return y
+
     def on_last_visit(self, point, it, graphics):
         "Update list of graphics to draw and return new position"
 
@@ -433,7 +466,8 @@ class Drawer:
     def get_active_children(self):
         nodes = sum(1 for node in self.collapsed if node in self.active.nodes.results)
         nodes += sum(self.active.nodes.parents.get(node, 0) for node in self.collapsed)
-        clades = sum(len(node) for node in self.collapsed if node in self.active.clades.results)
+        clades = sum(int(node.size[1]) for node in self.collapsed  # nleaves
+                     if node in self.active.clades.results)
         clades += sum(self.active.clades.parents.get(node, 0) for node in self.collapsed)
         return TreeActive(nodes, clades)
 
@@ -492,6 +526,10 @@ class DrawerRect(Drawer):
         else:
             return dh.intersects_segment(dh.get_ys(self.viewport), dh.get_ys(box))
 
+    def visible_ys(self):
+        "Return the sorted (y0, y1) segments that nodes must touch to be drawn"
+        return [dh.get_ys(self.viewport)] if self.viewport else None
+
     def node_size(self, node):
         "Return the size of a node (its content and its children)"
         return Size(node.size[0], node.size[1])
@@ -573,12 +611,13 @@ class DrawerCirc(Drawer):
                  limits=None, collapsed_ids=None, active=None,
                  selected=None, searches=None,
                  layouts=None, tree_style=None,
-                 include_props=None, exclude_props=None):
+                 include_props=None, exclude_props=None, draw_index=None):
         super().__init__(tree, viewport, panel, zoom,
                          limits, collapsed_ids, active, selected, searches,
                          layouts, tree_style,
                          include_props=include_props,
-                         exclude_props=exclude_props)
+                         exclude_props=exclude_props,
+                         draw_index=draw_index)
 
         assert self.zoom[0] == self.zoom[1], 'zoom must be equal in x and y'
 
@@ -597,6 +636,17 @@ class DrawerCirc(Drawer):
         else:
             return dh.intersects_angles(self.viewport, box)
 
+    def visible_ys(self):
+        "Return the sorted (a0, a1) angles that nodes must touch to be drawn"
+        if not self.viewport:
+            return [(-pi, +pi)]
+
+        # NOTE: For panel 0, in_viewport() also accepts nodes whose
+        #   circumscribing rectangle touches the viewport even if they are
+        #   out of its angles, but nothing of them would be visible anyway.
+        return sorted(dh.get_ys(dh.circumasec(r))
+                      for r in dh.split_thru_negative_xaxis(self.viewport))
+
     def flush_outline(self, minimum_dr=0):
         "Return box outlining the collapsed nodes"
         r, a, dr, da = super().flush_outline(minimum_dr)
@@ -784,8 +834,9 @@ class DrawerRectFaces(DrawerRect):
             node.is_initialized = True
             node.faces = make_faces()
             node.collapsed_faces = make_faces()
-            for layout in self.layouts:
-                layout.set_node_style(node)
+            with dh.using_index(self.draw_index):  # for faster summaries
+                for layout in self.layouts:
+                    layout.set_node_style(node)
 
         # Render Faces in different panels
         if self.NPANELS > 1:
@@ -913,8 +964,9 @@ class DrawerCircFaces(DrawerCirc):
 
         if not node.is_initialized:
             node.is_initialized = True
-            for layout in self.layouts:
-                layout.set_node_style(node)
+            with dh.using_index(self.draw_index):  # for faster summaries
+                for layout in self.layouts:
+                    layout.set_node_style(node)
 
         # Render Faces in different panels
         if self.NPANELS > 1:
@@ -0,0 +1,107 @@
+"""
+Index of the positions and summaries of nodes, to draw them quickly.
+
+When drawing a viewport, the drawer visits every node in the tree
+order, and skips the descendants of the ones out of the viewport. But
+it still has to visit all the children of a node with many of them
+(as in a big polytomy), even if only a few are in the viewport.
+
+The children of a node are stacked in y, so for each node with many
+children we keep the cumulative sums of their sizes (in y). With them
+we can find with a binary search the first child that reaches a given
+y, and jump over all the children before it.
+
+When zoomed out, many nodes are collapsed and represented by summaries
+of their descendants, like the first name found in each of them. We
+keep those values too, so they are found only once for each node.
+
+The number of leaves and the extent of each node (used to outline the
+collapsed ones) are already kept updated in node.size.
+"""
+
+from array import array
+from bisect import bisect_left
+
+
+class DrawIndex:
+    """Cumulative sizes (in y) of children, and first values of props, of a tree.
+
+    The saved values are not updated when the tree changes, so the
+    index must be cleared (or a new one used) after changing it.
+    """
+
+    MIN_CHILDREN = 32  # nodes with less children are not worth indexing
+
+    def __init__(self):
+        self._offsets = {}  # node -> array of cumulative dys of its children
+        self._first_values = {}  # prop -> {node: first value in its subtree}
+
+    def offsets(self, node):
+        """Return the cumulative sizes in y of the children of node, or None.
+
+        The returned array has len(node.children) + 1 elements, the
+        first being 0 and the last the sum of the sizes of all children.
+        """
+        children = node.children
+        if len(children) < self.MIN_CHILDREN:
+            return None
+
+        offsets = self._offsets.get(node)
+        if (offsets is None or len(offsets) != len(children) + 1 or
+            offsets[-1] != node.size[1]):  # not there or outdated
+            offsets = array('d', [0])
+            total = 0
+            for child in children:
+                total += child.size[1]
+                offsets.append(total)
+            self._offsets[node] = offsets
+
+        return offsets
+
+    def first_value(self, node, prop):
+        """Return the first value of prop found in the subtree of node.
+
+        It is the same as draw_helpers.first_value(node, prop), but the
+        values found for the descendants are saved and used next time.
+        """
+        values = self._first_values.setdefault(prop, {})
+
+        value = node.props.get(prop)
+        stack = [(node, iter(node.children))]  # to traverse in preorder
+        while stack and not value:
+            parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:  # no value in the subtree of parent
+                stack.pop()
+                if stack:
+                    values[parent] = ''
+            elif child in values:
+                value = values[child]
+            else:
+                value = child.props.get(prop)
+                if not value and child.children:
+                    stack.append((child, iter(child.children)))
+                else:
+                    values[child] = value or ''
+
+        for parent, _ in stack[1:]:
+            values[parent] = value  # the first value of all their subtrees
+
+        return value or ''
+        # NOTE: We do not save the value for node itself, which may not be
+        #   in the tree (like the ones made to represent collapsed nodes).
+
+    def clear(self):
+        """Forget all the saved offsets and values."""
+        self._offsets.clear()
+        self._first_values.clear()
+
+
+def first_reaching(offsets, i, dy):
+    """Return the index of the first child after i that reaches dy below it.
+
+    Only the children after the i-th one are considered, and dy is
+    measured from the start of the (i+1)-th child. If no child reaches
+    that far, return the number of children.
+    """
+    return bisect_left(offsets, offsets[i + 1] + dy, lo=i + 2) - 1
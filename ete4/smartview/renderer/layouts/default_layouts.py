@@ -69,7 +69,8 @@ class LayoutNumberLeaves(TreeLayout):
     def set_node_style(self, node):
         if not node.is_leaf:
             face = TextFace(
-                self.formatter % len(node),  # number of leaves
+                self.formatter % sum(int(n.size[1]) for n in node.children),
+                # number of leaves (from the sizes, faster than len(node))
                 color=self.color,
                 min_fsize=self.min_fsize, max_fsize=self.max_fsize,
                 ftype=self.ftype,
@@ -1,5 +1,6 @@
 from .common import as_str, shorten_str, src_tree_iterator, ref_tree_iterator
 
+import os
 import re
 
 DESC = """
@@ -12,6 +13,10 @@ It provides Robinson foulds and tree compatibility measures. Comparisons between
 trees with different sizes and containing duplicated attributes are also
 supported.
 
+With --matrix, it calculates instead the Robinson foulds distances between all
+the source trees (all against all), and writes them as a tab delimited matrix
+(or saves them in numpy format with -o).
+
 %s
 
 """
@@ -49,11 +54,28 @@ def populate_args(compare_args_p):
                               action = "store_true",
                               help="activates the TreeKO duplication aware comparison method")
 
+    matrix_args = compare_args_p.add_argument_group("COMPARE MATRIX OPTIONS")
+
+    matrix_args.add_argument("--matrix", dest="matrix",
+                             action="store_true",
+                             help=("calculate the RF distance between all source trees "
+                                   "(reference trees are ignored)"))
+
+    matrix_args.add_argument("--matrix_norm", dest="matrix_norm",
+                             action="store_true",
+                             help="write normalized RF distances in the matrix")
+
+    matrix_args.add_argument("-C", "--cpu", dest="maxjobs", type=int, default=1,
+                             help="number of processes used to compute the matrix")
+
 
 def run(args):
     from .. import Tree
     from ..utils import print_table
 
+    if args.matrix:
+        return run_matrix(args)
+
     def iter_differences(set1, set2, unrooted=False):
         for s1 in set1:
             pairs = []
@@ -161,6 +183,50 @@ def run(args):
                                 fix_col_width = col_sizes, wrap_style='cut')
 
 
+def run_matrix(args):
+    """Write the RF distances between all the source trees, row by row."""
+    import numpy as np
+    from .. import Tree
+    from ..core import bipartitions as bp
+
+    names = list(src_tree_iterator(args))
+
+    def trees():
+        for name in names:
+            if os.path.isfile(name):
+                with open(name) as fp:
+                    data = fp.read()
+            else:
+                data = name
+            tree = Tree(data, parser=args.src_newick_format)
+            if args.src_attr_parser:
+                for leaf in tree:
+                    leaf.add_prop('tempattr', re.search(
+                        args.src_attr_parser, leaf.get_prop(args.src_tree_attr)).groups()[0])
+            yield tree
+
+    prop = 'tempattr' if args.src_attr_parser else args.src_tree_attr
+    incidence, counts = bp.get_incidence(trees(), prop, args.unrooted)
+
+    if args.output:  # save the matrix in numpy format, as it is computed
+        matrix = np.lib.format.open_memmap(
+            args.output, mode='w+', shape=(len(names), len(names)),
+            dtype=np.float64 if args.matrix_norm else np.int32)
+    else:
+        print('#\t' + '\t'.join(names))
+
+    for start, rows in bp.iter_rf_rows(incidence, counts, args.matrix_norm,
+                                       args.maxjobs):
+        if args.output:
+            matrix[start:start + len(rows)] = rows
+        else:
+            for name, row in zip(names[start:], rows):
+                print(name + '\t' + '\t'.join(map(str, row.tolist())))
+
+    if args.output:
+        matrix.flush()
+
+
 def euc_dist(v1, v2):
     if type(v1) != set: v1 = set(v1)
     if type(v2) != set: v2 = set(v2)
@@ -0,0 +1,108 @@
+"""
+Tests for the array-backed read-only trees.
+"""
+
+from tempfile import NamedTemporaryFile
+
+import pytest
+
+from ete4 import Tree, ArrayTree
+from ete4.core.tree import TreeError
+from . import datasets as ds
+
+
+def get_trees():
+    """Return a tree and its ArrayTree version (from bytes and from file)."""
+    t = Tree(ds.nw_full)
+    t['Hsa0000001'].props['count'] = 3
+    t['Ptr0000001'].props['tags'] = ['a', 'b']
+
+    with NamedTemporaryFile() as fp:
+        t.write(outfile=fp.name, format='ete')
+        at_file = ArrayTree(fp.name)  # memory-mapped
+
+    return t, [at_file, ArrayTree(t.write(format='ete'))]
+
+
+def test_traverse():
+    t, ats = get_trees()
+    for at in ats:
+        assert at.num_nodes == len(list(t.traverse()))
+        assert len(at) == len(t)
+        assert len(at.root[1]) == len(t[1])
+
+        for strategy in ['preorder', 'postorder', 'levelorder']:
+            assert ([n.props for n in at.traverse(strategy)] ==
+                    [n.props for n in t.traverse(strategy)])
+
+        assert list(at.leaf_names()) == list(t.leaf_names())
+        assert [n.name for n in at.root[2].leaves()] == list(t[2].leaf_names())
+
+
+def test_access():
+    t, ats = get_trees()
+    for at in ats:
+        node = at['Hsa0000001']
+        assert node.props == t['Hsa0000001'].props
+        assert node.is_leaf and not node.is_root
+        assert node.dist == t['Hsa0000001'].dist
+        assert at['Ptr0000001'].get_prop('tags') == ['a', 'b']
+
+        assert at[[2, 1]].props == t[[2, 1]].props
+        assert [n.props for n in at[2].children] == \
+            [n.props for n in t[2].children]
+        assert node.up.props == t['Hsa0000001'].up.props
+        assert at.root.up is None
+
+        assert at[2]['Hsa0000001'] == node
+        with pytest.raises(TreeError):
+            at[1]['Hsa0000001']  # not under that node
+        with pytest.raises(TreeError):
+            at['missing']
+        with pytest.raises(TreeError):
+            at[[0, 7]]
+
+
+def test_common_ancestor_and_distance():
+    t, ats = get_trees()
+    names = ['Hsa0000001', 'Ptr0000001', 'Mms0024821']
+    for at in ats:
+        node = at.common_ancestor(names)
+        assert node.props == t.common_ancestor(names).props
+        assert list(node.leaf_names()) == \
+            list(t.common_ancestor(names).leaf_names())
+        assert at.common_ancestor(['Hsa0000001']) == at['Hsa0000001']
+
+        for n1, n2 in [('Hsa0000001', 'Dme0014628'), (names[0], names[1])]:
+            assert at.get_distance(n1, n2) == pytest.approx(
+                t.get_distance(n1, n2))
+            assert (at.get_distance(at[n1], n2, topological=True) ==
+                    t.get_distance(n1, n2, topological=True))
+
+        dists = at.column('dist').array(default=float('nan'))
+        assert at.column('dist').array(default=float('nan')) is dists  # saved
+
+
+def test_to_tree():
+    t, ats = get_trees()
+    for at in ats:
+        nw = at.to_tree().write(props=None, format_root_node=True)
+        assert nw == t.write(props=None, format_root_node=True)
+
+        subtree = at.common_ancestor(['Hsa0000001', 'Mms0024821']).to_tree()
+        original = t.common_ancestor(['Hsa0000001', 'Mms0024821'])
+        assert subtree.is_root
+        assert ([n.props for n in subtree.traverse()] ==
+                [n.props for n in original.traverse()])
+
+
+def test_close():
+    t = Tree(ds.nw_full)
+    with NamedTemporaryFile() as fp:
+        t.write(outfile=fp.name, format='ete')
+
+        with ArrayTree(fp.name) as at:
+            assert at.get_distance('Hsa0000001', 'Ptr0000001') == \
+                pytest.approx(t.get_distance('Hsa0000001', 'Ptr0000001'))
+            assert list(at.leaf_names()) == list(t.leaf_names())
+        assert at._data.closed  # unmapped
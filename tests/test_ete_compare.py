@@ -0,0 +1,43 @@
+import io
+import re
+import unittest
+from contextlib import redirect_stdout
+from tempfile import NamedTemporaryFile
+
+from ete4 import Tree
+from ete4.tools import ete
+
+
+class Test_ete_compare(unittest.TestCase):
+
+    def test_matrix_attr_parser(self):
+        nws = ['((a_1,b_1),(c_1,(d_1,e_1)));',
+               '((a_2,c_2),(b_2,(d_2,e_2)));',
+               '(e_3,(d_3,(c_3,(b_3,a_3))));']
+
+        def run(sources):
+            output = io.StringIO()
+            with redirect_stdout(output):
+                ete._main(['ete4', 'compare', '--matrix', '-t'] + sources +
+                          ['--src_attr_parser', '^(.)_'])
+            return output.getvalue().splitlines()
+
+        lines = run(nws)
+        self.assertEqual(lines[0], '#\t' + '\t'.join(nws))
+
+        with NamedTemporaryFile('wt') as fp:  # a tree from a file too
+            fp.write(nws[0])
+            fp.flush()
+            lines_file = run([fp.name] + nws[1:])
+        self.assertEqual([line.split('\t')[1:] for line in lines_file[1:]],
+                         [line.split('\t')[1:] for line in lines[1:]])
+
+        trees = [Tree(re.sub(r'_\d', '', nw)) for nw in nws]
+        for line, t1 in zip(lines[1:], trees):
+            name, *rfs = line.split('\t')
+            self.assertEqual([int(rf) for rf in rfs],
+                             [t1.robinson_foulds(t2)[0] for t2 in trees])
+
+
+if __name__ == '__main__':
+    unittest.main()
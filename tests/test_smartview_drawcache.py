@@ -0,0 +1,47 @@
+import unittest
+
+from ete4.smartview.gui.drawcache import DrawCache, get_tile
+
+
+class Test_drawcache(unittest.TestCase):
+
+    def test_tile(self):
+        for viewport in [(0, 0, 10, 10), (3.7, -12.1, 5, 0.3),
+                         (1e6, 1e-3, 1e-4, 1e3)]:
+            x, y, w, h = viewport
+            tx, ty, tw, th = get_tile(viewport)
+            self.assertTrue(tx <= x and x + w <= tx + tw)
+            self.assertTrue(ty <= y and y + h <= ty + th)
+            self.assertTrue(tw <= 3 * w and th <= 3 * h)
+
+        # Small pans give the same tile.
+        self.assertEqual(get_tile((0.1, 10.5, 10, 10)),
+                         get_tile((7.9, 15.9, 10, 10)))
+
+    def test_cache(self):
+        cache = DrawCache(max_bytes=10)
+
+        version = cache.version(1)
+        cache.put((1, 'a'), version, b'abcd', {0: 5})
+        self.assertEqual(cache.get((1, 'a')), (b'abcd', {0: 5}))
+        self.assertEqual(cache.get((1, 'b')), None)
+
+        cache.put((1, 'b'), version, b'efgh')
+        cache.put((2, 'c'), cache.version(2), b'ijkl')  # drops (1, 'a')
+        self.assertEqual(cache.get((1, 'a')), None)
+        self.assertEqual(cache.info()['nbytes'], 8)
+
+        cache.invalidate(1)
+        self.assertEqual(cache.get((1, 'b')), None)
+        self.assertEqual(cache.get((2, 'c')), (b'ijkl', None))
+
+        cache.put((1, 'd'), version, b'mnop')  # drawn before invalidating
+        self.assertEqual(cache.get((1, 'd')), None)
+
+        cache.invalidate()
+        self.assertEqual(cache.info()['size'], 0)
+        self.assertEqual(cache.info()['hits'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
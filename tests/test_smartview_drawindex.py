@@ -0,0 +1,104 @@
+import unittest
+import random
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview.renderer import drawer as drawer_module
+from ete4.smartview.renderer import draw_helpers as dh
+from ete4.smartview.renderer.drawindex import DrawIndex, first_reaching
+
+
+def random_polytomies(nleaves, nchildren, seed=0):
+    """Return a tree with nleaves leaves in polytomies of nchildren nodes."""
+    rng = random.Random(seed)
+    nodes = [Tree({'name': f'n{i}', 'dist': rng.random()})
+             for i in range(nleaves)]
+    while len(nodes) > 1:
+        parents = []
+        for i in range(0, len(nodes), nchildren):
+            parent = Tree({'dist': rng.random()})
+            for node in nodes[i:i+nchildren]:
+                parent.add_child(node)
+            parents.append(parent)
+        nodes = parents
+    ops.update_sizes_all(nodes[0])
+    return nodes[0]
+
+
+def all_numbers(graphics):
+    """Yield all the numbers in the given nested graphic elements."""
+    for x in graphics:
+        if type(x) in [list, tuple]:
+            yield from all_numbers(x)
+        elif type(x) in [int, float]:
+            yield x
+
+
+class NoIndex(DrawIndex):
+    def offsets(self, node):
+        return None
+
+
+class Test_drawindex(unittest.TestCase):
+
+    def test_offsets(self):
+        t = random_polytomies(100, 40)
+
+        index = DrawIndex()
+        self.assertEqual(index.offsets(t.children[-1]), None)  # few children
+
+        node = t.children[0]
+        offsets = index.offsets(node)
+        self.assertEqual(list(offsets), list(range(41)))
+        self.assertIs(index.offsets(node), offsets)  # saved
+
+        self.assertEqual(first_reaching(offsets, 0, 0), 1)
+        self.assertEqual(first_reaching(offsets, 0, 2.5), 3)
+        self.assertEqual(first_reaching(offsets, 0, 100), 40)
+
+        node.children[0].detach()
+        ops.update_sizes_from(node)
+        self.assertEqual(list(index.offsets(node)), list(range(40)))  # updated
+
+    def test_first_value(self):
+        t = Tree('((a,(,(c:1,d))),((,),(e,f)),(,));')
+        for node in t.traverse():
+            if node.name in ['c', 'f']:
+                node.props['x'] = node.name.upper()
+
+        index = DrawIndex()
+        for prop in ['name', 'x', 'dist', 'missing']:
+            for node in list(t.traverse()) + list(t.traverse('postorder')):
+                self.assertEqual(index.first_value(node, prop),
+                                 dh.first_value(node, prop))
+
+        self.assertEqual(dh.summary(t.children, 'x'), ['C', 'F', ''])
+        with dh.using_index(index):
+            self.assertEqual(dh.summary(t.children, 'x'), ['C', 'F', ''])
+            self.assertEqual(dh.first_value(t, 'name'), 'a')
+
+    def test_same_drawing(self):
+        t = random_polytomies(5000, 100)
+
+        viewports = [(0, 10, 5, 20), (1, 2300.5, 0.5, 10), (0, 4990, 9, 30)]
+        for Drawer in [drawer_module.DrawerRect, drawer_module.DrawerRectFaces]:
+            for viewport in viewports:
+                for panel in [0, 1]:
+                    args = t, viewport, panel, (100, 50, 10)
+                    graphics_index = list(Drawer(*args).draw())
+                    graphics_full = list(Drawer(*args,
+                                                draw_index=NoIndex()).draw())
+                    self.assertEqual(len(graphics_index), len(graphics_full))
+                    for x1, x2 in zip(all_numbers(graphics_index),
+                                      all_numbers(graphics_full)):
+                        self.assertAlmostEqual(x1, x2)
+
+        for viewport in [None, (0, 0, 1, 1)]:
+            Drawer = drawer_module.DrawerCirc
+            args = t, viewport, 0, (100, 100, 10)
+            self.assertEqual(list(Drawer(*args).draw()),
+                             list(Drawer(*args, draw_index=NoIndex()).draw()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+import io
+import json
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+from unittest.mock import patch
+
+import bottle
+import brotli
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview.gui import server, wireformat
+
+
+def call(method, path, query=None, body=None):
+    """Return status code, headers and body of a request to the server app."""
+    data = json.dumps(body).encode() if body is not None else b''
+
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update({'REQUEST_METHOD': method, 'PATH_INFO': path,
+                    'QUERY_STRING': urlencode(query or {}),
+                    'wsgi.input': io.BytesIO(data),
+                    'CONTENT_LENGTH': str(len(data))})
+
+    started = []
+    result = bottle.default_app()(environ,
+                                  lambda status, headers, exc_info=None:
+                                      started.append((status, headers)))
+    body = b''.join(result)
+
+    status, headers = started[0]
+    return int(status.split()[0]), dict(headers), body
+
+
+class Test_server(unittest.TestCase):
+
+    def setUp(self):
+        server.app = server.initialize()
+
+        t = Tree('((a:1,b:2)x:1,(c:1,d:1)y:2)r;', parser=1)
+        ops.update_sizes_all(t)
+        self.tid = server.add_tree({'id': 1, 'name': 't', 'tree': t})
+
+    def draw(self, **query):
+        query = dict({'x': 0, 'y': 0, 'w': 4, 'h': 5, 'zx': 10, 'zy': 10},
+                     **query)
+        status, _, body = call('GET', f'/trees/{self.tid}/draw', query)
+        self.assertEqual(status, 200)
+        return body
+
+    def draw_stream(self, fmt, **query):
+        """Return the groups of elements drawn in a stream."""
+        data = self.draw(format=fmt, stream=1, **query)
+        if server.app.compress:
+            data = brotli.decompress(data)
+
+        if fmt == 'binary':
+            return list(wireformat.decode_frames(data))
+        else:
+            return [json.loads(line) for line in data.decode().splitlines()]
+
+    def test_cached_drawings(self):
+        cache = server.app.draw_cache
+
+        graphics = self.draw()
+        self.assertEqual(cache.info()['size'], 1)
+
+        self.assertEqual(self.draw(), graphics)  # same view
+        self.assertEqual(self.draw(x=0.1, y=0.2), graphics)  # same tile
+        self.assertEqual(cache.info()['hits'], 2)
+
+        self.draw(zx=20)  # other zoom
+        self.draw(format='binary')  # other format
+        self.assertEqual(cache.info()['size'], 3)
+
+    def test_aligned_grid(self):
+        style = server.app.trees[self.tid].style
+
+        self.draw(panel=0)
+        grid = dict(style.aligned_grid_dxs)
+
+        style.aligned_grid_dxs.clear()
+        self.draw(panel=0)  # from the cache, with the grid that it computed
+        self.assertEqual(server.app.draw_cache.info()['hits'], 1)
+        self.assertEqual(dict(style.aligned_grid_dxs), grid)
+
+    def test_invalidate(self):
+        cache = server.app.draw_cache
+        tree_path = f'/trees/{self.tid}'
+
+        readonly = [('GET', '/size', None, None),
+                    ('GET', '/newick', None, None),
+                    ('GET', '/nodeinfo', None, None),
+                    ('GET', '/searches', None, None)]
+        for method, path, query, body in readonly:
+            self.draw()
+            status, _, _ = call(method, tree_path + path, query, body)
+            self.assertEqual(status, 200)
+            self.assertEqual(cache.info()['size'], 1, path)
+
+        changing = [('PUT', '/rename', None, [[0], 'z']),
+                    ('PUT', '/update_props', None, {'name': 'w'}),
+                    ('GET', '/search', {'text': 'a'}, None),
+                    ('GET', '/select', {'text': 'sel'}, None)]
+        for method, path, query, body in changing:
+            self.draw()
+            status, _, _ = call(method, tree_path + path, query, body)
+            self.assertEqual(status, 200, path)
+            self.assertEqual(cache.info()['size'], 0, path)
+
+    def test_drawn_while_changed(self):
+        cache = server.app.draw_cache
+
+        drawer = server.get_drawer(self.tid, {'zx': 10, 'zy': 10})
+        chunks = server.get_graphics(self.tid, drawer, stream=True)
+        call('PUT', f'/trees/{self.tid}/rename', body=[[0], 'z'])
+        self.assertTrue(b''.join(chunks))  # finished drawing after the change
+        self.assertEqual(cache.info()['size'], 0)  # so it is not cached
+
+        self.draw()
+        self.assertEqual(cache.info()['size'], 1)
+    def test_stream(self):
+        cache = server.app.draw_cache
+
+        for compress in [False, True]:
+            server.app.compress = compress
+            cache.invalidate()
+
+            data = self.draw()
+            elements = json.loads(brotli.decompress(data) if compress else data)
+
+            for fmt in ['json', 'binary']:
+                groups = self.draw_stream(fmt)
+                self.assertEqual(sum(groups, []), elements)
+
+                hits = cache.info()['hits']
+                self.assertEqual(self.draw_stream(fmt), groups)  # cached
+                self.assertEqual(cache.info()['hits'], hits + 1)
+
+        _, headers, _ = call('GET', f'/trees/{self.tid}/draw',
+                             {'format': 'binary', 'stream': 1})
+        self.assertEqual(headers['Content-Type'], wireformat.STREAM_CONTENT_TYPE)
+
+    def test_batches(self):
+        self.assertEqual(list(server.get_batches(range(12), max_size=5)),
+                         [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11]])
+        self.assertEqual(list(server.get_batches([])), [[]])
+
+    def test_stream_errors(self):
+        drawer = server.get_drawer(self.tid, {'zx': 10, 'zy': 10})
+
+        def fail_at_start():
+            raise AssertionError('bad start')
+            yield
+
+        def fail_later():
+            for _ in range(5000):  # a whole group
+                yield ['line', (0, 0), (1, 1), '', [], {}]
+            raise AssertionError('bad end')
+
+        with patch.object(server, 'get_drawer', lambda *args: drawer):
+            drawer.draw = fail_at_start
+            for stream in [0, 1]:
+                status, _, body = call('GET', f'/trees/{self.tid}/draw',
+                                       {'stream': stream})
+                self.assertEqual(status, 400)
+                self.assertEqual(json.loads(body),
+                                 {'message': 'when drawing: bad start'})
+
+            drawer.draw = fail_later
+            for fmt in ['json', 'binary']:
+                groups = self.draw_stream(fmt)
+                self.assertEqual(len(groups[0]), 5000)
+                self.assertEqual(groups[-1],
+                                 {'message': 'when drawing: bad end'})
+
+        self.assertEqual(server.app.draw_cache.info()['size'], 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
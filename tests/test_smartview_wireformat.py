@@ -0,0 +1,51 @@
+import unittest
+import json
+
+from ete4 import Tree
+from ete4.core import operations as ops
+from ete4.smartview.renderer import drawer as drawer_module
+from ete4.smartview.renderer.layouts.default_layouts import (
+    LayoutLeafName, LayoutNumberLeaves)
+from ete4.smartview.gui import wireformat
+
+
+class Test_wireformat(unittest.TestCase):
+
+    def test_values(self):
+        graphics = [['a', 1, -2.5, True, False, None, '', 'a', 'ñ'],
+                    [], {}, {'x': [1, {'y': None}], 2: 'z'},
+                    drawer_module.Box(1, 2, 3, 4), (1e300, -1e-300)]
+
+        data = wireformat.encode(graphics)
+        self.assertEqual(wireformat.decode(data),
+                         json.loads(json.dumps(graphics)))
+
+        self.assertRaises(TypeError, wireformat.encode, [object()])
+
+    def test_frames(self):
+        groups = [[['line', (0, 1), (2, 3)]] * 3, [], [['text', 'a']]]
+
+        data = b''.join(wireformat.encode_frame(g) for g in groups)
+        self.assertEqual(list(wireformat.decode_frames(data)),
+                         json.loads(json.dumps(groups)))
+
+    def test_drawing(self):
+        t = Tree()
+        t.populate(200)
+        ops.update_sizes_all(t)
+
+        layouts = [LayoutLeafName(), LayoutNumberLeaves()]
+        for Drawer in [drawer_module.DrawerRectFaces,
+                       drawer_module.DrawerCircFaces]:
+            graphics = list(Drawer(t, zoom=(20, 20, 1),
+                                   layouts=layouts).draw())
+            self.assertTrue(graphics)
+
+            data = wireformat.encode(graphics)
+            self.assertEqual(wireformat.decode(data),
+                             json.loads(json.dumps(graphics)))
+            self.assertLess(len(data), len(json.dumps(graphics)))
+
+
+if __name__ == '__main__':
+    unittest.main()
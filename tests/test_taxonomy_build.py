@@ -0,0 +1,79 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from ete4 import NCBITaxa
+from ete4.ncbi_taxonomy import ncbiquery
+from ete4.ncbi_taxonomy.taxindex import index_path
+
+
+NODES = """\
+1\t|\t1\t|\tno rank\t|\t\t|
+2\t|\t1\t|\tgenus\t|\t\t|
+5\t|\t1\t|\tgenus\t|\t\t|
+3\t|\t2\t|\tspecies\t|\t\t|
+4\t|\t2\t|\tspecies\t|\t\t|
+6\t|\t5\t|\tspecies\t|\t\t|
+"""
+
+NAMES = """\
+1\t|\troot\t|\t\t|\tscientific name\t|
+2\t|\tA\t|\t\t|\tscientific name\t|
+3\t|\tA b\t|\t\t|\tscientific name\t|
+3\t|\tbee\t|\t\t|\tgenbank common name\t|
+3\t|\tA beta\t|\t\t|\tsynonym\t|
+3\t|\tA BETA\t|\t\t|\tgenbank synonym\t|
+4\t|\t"A c"\t|\t\t|\tscientific name\t|
+5\t|\tD\t|\t\t|\tscientific name\t|
+6\t|\tD e\t|\t\t|\tscientific name\t|
+"""
+
+MERGED = """\
+30\t|\t3\t|
+"""
+
+
+class Test_taxonomy_build(unittest.TestCase):
+
+    def test_update_db(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            taxdump = os.path.join(tmpdir, 'taxdump.tar.gz')
+            with tarfile.open(taxdump, 'w:gz') as tar:
+                for fname, text in [('nodes.dmp', NODES), ('names.dmp', NAMES),
+                                    ('merged.dmp', MERGED)]:
+                    data = text.encode()
+                    info = tarfile.TarInfo(fname)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+
+            dbfile = os.path.join(tmpdir, 'db', 'taxa.sqlite')
+            ncbiquery.update_db(dbfile, taxdump)
+
+            self.assertEqual(sorted(os.listdir(os.path.dirname(dbfile))),
+                             ['taxa.sqlite', 'taxa.sqlite.taxindex.npy',
+                              'taxa.sqlite.traverse.pkl'])  # no temp files
+
+            ncbi = NCBITaxa(dbfile, update=False)
+
+            rows = ncbi.db.execute('SELECT * FROM species ORDER BY taxid')
+            self.assertEqual(rows.fetchall(), [
+                (1, '', 'root', '', 'no rank', '1'),
+                (2, 1, 'A', '', 'genus', '2,1'),
+                (3, 2, 'A b', 'bee', 'species', '3,2,1'),
+                (4, 2, 'A c', '', 'species', '4,2,1'),
+                (5, 1, 'D', '', 'genus', '5,1'),
+                (6, 5, 'D e', '', 'species', '6,5,1')])
+
+            self.assertEqual(ncbi.get_name_translator(['A beta']),
+                             {'A beta': [3]})
+            self.assertEqual(ncbi.get_lineage(30), [1, 2, 3])
+            self.assertEqual(ncbi.get_descendant_taxa(1), [3, 4, 6])
+            self.assertEqual(ncbi.get_topology([1]).write(parser=9),
+                             '((3,4),6);')
+            ncbi.db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import sqlite3
+import unittest
+
+from ete4.ncbi_taxonomy.bulkquery import select_in
+
+
+class Test_bulkquery(unittest.TestCase):
+
+    def setUp(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript("""
+            CREATE TABLE species (taxid INT PRIMARY KEY, spname VARCHAR(50) COLLATE NOCASE);
+            CREATE TABLE merged (taxid_old INT, taxid_new INT);
+        """)
+        self.db.executemany('INSERT INTO species VALUES (?, ?)',
+                            [(i, f'taxon "{i}"') for i in range(1, 2001)])
+        self.db.executemany('INSERT INTO merged VALUES (?, ?)',
+                            [(i, i - 5000) for i in range(5001, 5101)])
+        self.db.commit()
+
+    def test_select_in(self):
+        taxids = list(range(0, 3000, 3)) + ['9', '12']  # ids as str work too
+        expected = {i: f'taxon "{i}"' for i in range(3, 2001, 3)}
+
+        for chunk_size, temp_table_min in [(None, None), (7, 10**9), (7, 1)]:
+            rows = select_in(self.db, 'taxid, spname', 'species', 'taxid',
+                             taxids, chunk_size, temp_table_min)
+            self.assertEqual(dict(rows), expected)
+
+            rows = select_in(self.db, 'spname, taxid', 'species', 'spname',
+                             ['TAXON "5"', 'taxon "6"', 'unknown'],
+                             chunk_size, temp_table_min)
+            self.assertEqual(sorted(rows), [('taxon "5"', 5), ('taxon "6"', 6)])
+
+            rows = select_in(self.db, 'taxid_old, taxid_new', 'merged',
+                             'taxid_old', range(5050, 6000),
+                             chunk_size, temp_table_min)
+            self.assertEqual(dict(rows), {i: i - 5000 for i in range(5050, 5101)})
+
+        self.assertEqual(select_in(self.db, 'taxid', 'species', 'taxid', []), [])
+
+    def test_temp_table_cleanup(self):
+        select_in(self.db, 'taxid', 'species', 'taxid', range(100),
+                  temp_table_min=1)
+        self.assertFalse(self.db.in_transaction)
+        rows = self.db.execute('SELECT * FROM temp.ete_query_values').fetchall()
+        self.assertEqual(rows, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from ete4 import Tree
+from ete4.ncbi_taxonomy.taxindex import (
+    index_from_tree, index_from_prepostorder, index_from_parents, index_path,
+    load_index)
+
+
+class Test_taxindex(unittest.TestCase):
+
+    def setUp(self):
+        self.tree = Tree('((((4,5)3,6)2,(8)7)10,9)1;', parser=1)
+        self.prepostorder = [int(node.name) for post, node
+                             in self.tree.iter_prepostorder()]
+
+    def check_index(self, index):
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index.taxids.tolist(), [1, 10, 2, 3, 4, 5, 6, 7, 8, 9])
+
+        self.assertEqual(index.descendants(2), [3, 4, 5, 6])
+        self.assertEqual(index.descendants(2, intermediate_nodes=False),
+                         [4, 5, 6])
+        self.assertEqual(index.descendants(7), [8])
+        self.assertEqual(index.descendants(9), [])
+        self.assertRaises(ValueError, index.descendants, 99)
+
+        self.assertTrue(index.is_leaf(4))
+        self.assertFalse(index.is_leaf(7))
+        self.assertEqual(index.position(99), None)
+
+        self.assertEqual(index.lineages([5, 8, 1, 99]),
+                         {5: [1, 10, 2, 3, 5], 8: [1, 10, 7, 8], 1: [1]})
+
+        t = index.subtree(10, lambda tid: Tree({'name': str(tid)}))
+        self.assertEqual(t.write(parser=1, format_root_node=True),
+                         '(((4,5)3,6)2,(8)7)10;')
+
+    def test_index(self):
+        index_tree = index_from_tree(self.tree)
+        index_pkl = index_from_prepostorder(self.prepostorder)
+
+        self.assertTrue(np.array_equal(index_tree.data, index_pkl.data))
+        self.check_index(index_tree)
+
+        self.assertEqual(index_tree.prepostorder(), self.prepostorder)
+
+        nodes = list(self.tree.traverse('levelorder'))
+        index_parents = index_from_parents(
+            [int(n.name) for n in nodes],
+            [int(n.up.name) if n.up else 1 for n in nodes])
+        self.assertTrue(np.array_equal(index_tree.data, index_parents.data))
+
+    def test_load_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, 'taxa.sqlite')
+            with open(dbfile + '.traverse.pkl', 'wb') as f:
+                pickle.dump(self.prepostorder, f, 2)
+
+            index = load_index(dbfile)  # built from the pkl, and saved
+            self.check_index(index)
+            self.assertTrue(os.path.exists(index_path(dbfile)))
+
+            index = load_index(dbfile)  # memory-mapped from the npy
+            self.assertIsInstance(index.data, np.memmap)
+            self.check_index(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
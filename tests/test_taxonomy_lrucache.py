@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from ete4 import NCBITaxa
+from ete4.ncbi_taxonomy import ncbiquery
+from ete4.ncbi_taxonomy.lrucache import LRUCache, taxid_set
+
+
+class Test_lrucache(unittest.TestCase):
+
+    def test_lru(self):
+        fetched = []
+        def fetch(keys):
+            fetched.extend(keys)
+            return {k: k * 10 for k in keys if k != 0}  # 0 does not exist
+
+        cache = LRUCache(maxsize=3)
+        self.assertEqual(cache.get_many([1, 2, 0], fetch), {1: 10, 2: 20})
+        self.assertEqual(sorted(fetched), [0, 1, 2])
+        self.assertEqual(cache.info(),
+                         {'hits': 0, 'misses': 3, 'size': 2, 'maxsize': 3})
+
+        fetched.clear()
+        self.assertEqual(cache.get_many([1, 3], fetch), {1: 10, 3: 30})
+        self.assertEqual(fetched, [3])
+        self.assertEqual(cache.info()['hits'], 1)
+
+        cache.get_many([4], fetch)  # drops 2, the least recently used
+        fetched.clear()
+        cache.get_many([1, 2, 3, 4], fetch)
+        self.assertEqual(fetched, [2])
+        self.assertEqual(len(cache), 3)
+
+        cache.clear()
+        self.assertEqual(cache.info(),
+                         {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 3})
+
+        cache = LRUCache(maxsize=0)  # caches nothing
+        self.assertEqual(cache.get_many([1], fetch), {1: 10})
+        self.assertEqual(len(cache), 0)
+
+    def test_threads(self):
+        cache = LRUCache(maxsize=50)
+        fetch = lambda keys: {k: -k for k in keys}
+
+        def work(start):
+            for i in range(200):
+                keys = [(start + i + j) % 100 for j in range(5)]
+                values = cache.get_many(keys, fetch)
+                assert values == {k: -k for k in keys}
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        info = cache.info()
+        self.assertEqual(info['hits'] + info['misses'], 8 * 200 * 5)
+        self.assertLessEqual(info['size'], 50)
+
+    def test_taxid_set(self):
+        self.assertEqual(taxid_set([9606, '9606', '10090', None, '', 'x']),
+                         {9606, 10090})
+
+    def test_ncbitaxa_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dbfile = os.path.join(tmpdir, 'taxa.sqlite')
+            db = sqlite3.connect(dbfile)
+            db.executescript("""
+                CREATE TABLE stats (version INT PRIMARY KEY);
+                CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT);
+                CREATE TABLE synonym (taxid INT,spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid));
+                CREATE TABLE merged (taxid_old INT, taxid_new INT);
+                INSERT INTO species VALUES (1, 1, 'root', '', 'no rank', '1');
+                INSERT INTO species VALUES (2, 1, 'A', '', 'genus', '2,1');
+                INSERT INTO species VALUES (3, 2, 'A b', '', 'species', '3,2,1');
+                INSERT INTO merged VALUES (30, 3);
+            """)
+            db.execute('INSERT INTO stats VALUES (?)', [ncbiquery.DB_VERSION])
+            db.commit()
+            db.close()
+
+            ncbi = NCBITaxa(dbfile, update=False, cache_size=10)
+
+            for _ in range(3):
+                self.assertEqual(ncbi.get_lineage(3), [1, 2, 3])
+                self.assertEqual(ncbi.get_lineage_translator(['3', 2]),
+                                 {3: [1, 2, 3], 2: [1, 2]})
+                self.assertEqual(ncbi.get_rank([2, 3, 99]),
+                                 {2: 'genus', 3: 'species'})
+                self.assertEqual(ncbi.get_taxid_translator([3, 30]),
+                                 {3: 'A b', 30: 'A b'})
+
+            info = ncbi.cache_info()
+            self.assertEqual(info['lineage']['misses'], 2)
+            self.assertEqual(info['lineage']['hits'], 7)
+            self.assertEqual(info['rank']['size'], 2)
+
+            ncbi.clear_cache()
+            self.assertEqual(ncbi.cache_info()['name']['size'], 0)
+            ncbi.db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
+import os
 import sys
+import io
+import gzip
 import random
 import itertools
+import subprocess
 import json
 from tempfile import NamedTemporaryFile
 import unittest
@@ -8,7 +12,10 @@ import unittest
 from ete4 import Tree, PhyloTree
 from ete4.core.tree import TreeError
 from ete4.parser.newick import NewickError
-from ete4.parser import newick
+from ete4.parser import newick, ete_format
+from ete4.core import operations as ops
+from ete4.core import bipartitions as bp
+from ete4.core.nodeindex import NodeIndex
 
 from . import datasets as ds
 
@@ -22,6 +29,14 @@ def strip(text):
         for line in text.splitlines() if line.strip())
 
 
+def write_recursive(tree):
+    """Return the newick of tree, writing recursively each node's content."""
+    content = newick.content_repr(tree)
+    if not tree.children:
+        return content + ';'
+    return ('(' + ','.join(write_recursive(n)[:-1] for n in tree.children) +
+            ')' + content + ';')
+
 class Test_Core_Tree(unittest.TestCase):
     """Test the basic Tree class."""
 
@@ -345,6 +360,144 @@ class Test_Core_Tree(unittest.TestCase):
         # unsupported newick stream
         self.assertRaises(Exception, Tree, [1,2,3])
 
+    def test_read_deep_newick(self):
+        """Test reading trees deeper than the recursion limit."""
+        depth = 10 * sys.getrecursionlimit()
+        nw = '(' * depth + 'a:1' + ''.join(',n%d:1):0.5' % i
+                                           for i in range(depth)) + ';'
+        t = Tree(nw)
+
+        self.assertEqual(len(t), depth + 1)
+        self.assertEqual(t.children[1].name, 'n%d' % (depth - 1))
+
+        node = t
+        while node.children:
+            node = node.children[0]
+        self.assertEqual(node.name, 'a')
+        self.assertEqual(node.level, depth)
+        self.assertEqual(node.up.dist, 0.5)
+
+        # Same results as the recursive reader on a normal tree.
+        nodes, pos = newick.read_nodes(ds.nw_full, None, 0)
+        self.assertEqual([n.props for n in Tree({}, nodes).traverse()],
+                         [n.props for n in Tree(ds.nw_full).traverse()])
+
+    def test_write_deep_newick(self):
+        """Test writing trees deeper than the recursion limit."""
+        depth = 10 * sys.getrecursionlimit()
+        nw = '(' * depth + 'a:1' + ''.join(',n%d:1):0.5' % i
+                                           for i in range(depth)) + ';'
+        t = Tree(nw)
+
+        self.assertEqual(t.write(parser=1, format_root_node=True), nw)
+
+        # Writing to a file gives the same newick, even in small chunks.
+        with NamedTemporaryFile(mode='w+') as fp:
+            t.write(outfile=fp.name, parser=1, format_root_node=True)
+            self.assertEqual(fp.read(), nw + '\n')
+
+            fp.seek(0)
+            fp.truncate()
+            newick.dump(t, fp, chunksize=10)
+            fp.seek(0)
+            self.assertEqual(fp.read(), newick.dumps(t) + '\n')
+
+        # Same results as writing with content_repr() node by node.
+        t = Tree(ds.nw_full)
+        self.assertEqual(t.write(props=None, format_root_node=True),
+                         write_recursive(t))
+
+    def test_ete_format(self):
+        """Test writing and reading trees in ete format."""
+        t = Tree(ds.nw_full)
+        t['Hsa0000001'].props['count'] = 3
+        t['Ptr0000001'].props['seen'] = False
+        t['Cfa0016700'].props['domains'] = ['PF001', 'PF002']
+        t['Mms0024821'].props['big'] = 2**70
+        t.children[0].props['mixed'] = 'a'
+        t.children[1].props['mixed'] = 1.5
+
+        def check(t2):
+            self.assertEqual(t2.write(props=None, format_root_node=True),
+                             t.write(props=None, format_root_node=True))
+            for n1, n2 in zip(t.traverse(), t2.traverse()):
+                self.assertEqual(n1.props, n2.props)
+                self.assertEqual([type(x) for x in n1.props.values()],
+                                 [type(x) for x in n2.props.values()])
+
+        check(Tree(t.write(format='ete')))
+        check(ete_format.loads(ete_format.dumps(t, compression='gzip')))
+
+        with NamedTemporaryFile() as fp:
+            t.write(outfile=fp.name, format='ete')
+            check(Tree(open(fp.name, 'rb')))
+            check(ete_format.load(open(fp.name, 'rb')))
+
+        t2 = Tree(t.write(props=['name', 'count'], format='ete'))
+        self.assertEqual(t2['Hsa0000001'].props, {'name': 'Hsa0000001', 'count': 3})
+        self.assertEqual(list(t2.leaf_names()), list(t.leaf_names()))
+        self.assertFalse(any('dist' in n.props for n in t2.traverse()))
+
+        with self.assertRaises(ete_format.EteFormatError):
+            ete_format.loads(b'(a,b);')
+
+        # The nodes are saved in the order of their ids (see traverse_ids()).
+        props, parents = newick.flatten(t)
+        nodes, parents_ids, _ = ops.flatten(t)
+        self.assertEqual(props, [n.props for n in nodes])
+        self.assertEqual(parents, parents_ids.tolist())
+        self.assertEqual(newick.unflatten(props, parents).write(),
+                         t.write())
+
+    def test_iter_trees(self):
+        """Test reading files with many newicks."""
+        trees = []
+        for _ in range(20):
+            t = Tree()
+            t.populate(10, dist_fn=random.random, support_fn=random.random)
+            trees.append(t)
+
+        text = ('\n'.join(t.write() for t in trees) +  # one tree per line
+                "\n('A;B':1,[comment;]C:2)0.5:3;(E,\nF);\n")  # and some more
+        expected = [t.write() for t in trees] + ["('A;B':1,C:2);", '(E,F);']
+
+        for compress in [False, True]:
+            with NamedTemporaryFile() as fp:
+                fp.write(gzip.compress(text.encode()) if compress
+                         else text.encode())
+                fp.flush()
+
+                for workers in [1, 2]:
+                    trees_read = newick.iter_trees(fp.name, workers=workers,
+                                                   chunksize=3)
+                    self.assertEqual([t.write() for t in trees_read], expected)
+
+                fp.seek(0)
+                self.assertEqual([t.write() for t in newick.iter_trees(fp)],
+                                 [t.write() for t in newick.iter_trees(fp.name)])
+
+        with self.assertRaises(NewickError):
+            list(newick.iter_trees(io.StringIO('(A,B);(C,')))
+
+        # With processes started with "spawn" (the default in macOS and
+        # windows), which need to pickle the parser.
+        with NamedTemporaryFile('wt') as fp:
+            fp.write('(a,b);((d,e),f);')
+            fp.flush()
+
+            code = ('import multiprocessing as mp\n'
+                    'from ete4.parser import newick\n'
+                    'mp.set_start_method("spawn")\n'
+                    f'for t in newick.iter_trees({fp.name!r}, parser=9,\n'
+                    '                          workers=2, chunksize=1):\n'
+                    '    print(t.write(parser=9))\n')
+            path = os.path.dirname(os.path.dirname(newick.__file__))  # ete4
+            result = subprocess.run([sys.executable, '-c', code],
+                                    cwd=os.path.dirname(path),
+                                    capture_output=True, text=True)
+            self.assertEqual(result.stderr, '')
+            self.assertEqual(result.stdout.split(), ['(a,b);', '((d,e),f);'])
+
     def test_quoted_names(self):
         complex_name = "((A:0.0001[&&NHX:hello=true],B:0.011)90:0.01[&&NHX:hello=true],(C:0.01, D:0.001)hello:0.01);"
         # A quoted tree within a tree
@@ -618,6 +771,31 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(matrix1, matrix2)
         self.assertEqual(len(list(t.descendants())), (sample_size*2)-2 )
 
+    def test_pruned(self):
+        t = Tree('(((((A:1,B:1)C:1)D:1,E:1)F:1,G:1)H:1,(I:1,J:1)K:1)root;',
+                 parser=1)
+        nw = t.write(parser=1, format_root_node=True)
+
+        for names in [['A', 'B'], ['A', 'B', 'I'], ['A', 'B', 'F', 'H'],
+                      ['E', 'G', 'J'], ['root', 'E']]:
+            for preserve in [False, True]:
+                t_new = t.pruned(names, preserve_branch_length=preserve)
+                self.assertEqual(t.write(parser=1, format_root_node=True), nw)
+
+                t_pruned = t.copy()
+                t_pruned.prune(names, preserve_branch_length=preserve)
+                self.assertEqual(t_new.write(parser=1, format_root_node=True),
+                                 t_pruned.write(parser=1, format_root_node=True))
+
+        t_new = t.pruned(['A', 'E', 'J'], preserve_branch_length=True)
+        self.assertEqual(t_new.get_distance('A', 'J'), t.get_distance('A', 'J'))
+        self.assertTrue(all(n not in set(t.traverse()) for n in t_new.traverse()))
+
+        with self.assertRaises(TreeError):
+            t['C'].prune([t['A'], t['E']])  # E is not under C
+        with self.assertRaises(TreeError):
+            t.pruned([])
+
     def test_resolve_polytomy(self):
         t = Tree('((a,a,a,a),(b,b,b,(c,c,c)));')
         t.resolve_polytomy()
@@ -730,12 +908,67 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(levelorder,
                          ''.join(n.name for n in t.traverse("levelorder")))
 
+        prepostorder = "12342^5675^1^"
+        self.assertEqual(prepostorder,
+                         ''.join(n.name + ('^' if post else '')
+                                 for post, n in t.iter_prepostorder()))
+
+        # Ids of the nodes (their positions in preorder).
+        nodes = list(t.traverse("preorder"))
+        for strategy, order in [("preorder", preorder),
+                                ("postorder", postorder),
+                                ("levelorder", levelorder)]:
+            self.assertEqual(order, ''.join(nodes[i].name for i in
+                                            t.traverse_ids(strategy)))
+
+        collapsed = lambda n: n.name == "5"
+        self.assertEqual("12345", ''.join(n.name for n in
+                                          t.traverse("preorder", collapsed)))
+        self.assertEqual("34251", ''.join(n.name for n in
+                                          t.traverse("postorder", collapsed)))
+        self.assertEqual([0, 1, 2, 3, 4],
+                         list(t.traverse_ids("preorder", collapsed)))
+        self.assertEqual([2, 3, 1, 4, 0],
+                         list(t.traverse_ids("postorder", collapsed)))
+        self.assertEqual("12342^51^",
+                         ''.join(n.name + ('^' if post else '')
+                                 for post, n in t.iter_prepostorder(collapsed)))
+
+        with self.assertRaises(TreeError):
+            t.traverse_ids("inorder")
+
         # Swap children.
         n = t.get_children()
         t.reverse_children()
         n.reverse()
         self.assertEqual(n, t.get_children())
 
+        # Change the tree while traversing it.
+        t = Tree("((a,b)x,(c,d)y)r;", parser=1)
+        names = []
+        for n in t.traverse("postorder"):
+            names.append(n.name)
+            if n.name in ["a", "c"]:
+                n.detach()
+        self.assertEqual(names, ["a", "b", "x", "c", "d", "y", "r"])
+
+        t = Tree("((a,b)x,(c,(d,e)z)y)r;", parser=1)
+        names = []
+        for n in t.traverse("postorder"):
+            names.append(n.name)
+            if n.children and n.up:
+                n.delete()
+        self.assertEqual(names, ["a", "b", "x", "c", "d", "e", "z", "y", "r"])
+        self.assertEqual(t.write(parser=9), "(a,b,c,d,e);")
+
+        t = Tree("((a,b)x,(c,d)y)r;", parser=1)
+        names = []
+        for post, n in t.iter_prepostorder():
+            names.append(n.name + ('^' if post else ''))
+            if n.name == "a":
+                n.detach()
+        self.assertEqual(''.join(names), "rxabx^ycdy^r^")
+
     def test_distances(self):
         # Distances: get_distance, get_farthest_node,
         # get_farthest_descendant, get_midpoint_outgroup
@@ -784,6 +1017,160 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual((t['F']).get_farthest_node(topological=True), (t['A'], 3.0))
         self.assertEqual((t['F']).get_farthest_node(topological=False), (t['D'], 11.0))
 
+    def test_distance_index(self):
+        t = Tree('(((A:0.5, B:1.0):1.0, C:5.0):1, (D:10.0, F:1.0):2.0);')
+        index = t.build_distance_index()
+
+        nodes = list(t.traverse())
+        for n1, n2 in itertools.product(nodes, nodes):
+            self.assertIs(index.lca(n1, n2), t.common_ancestor([n1, n2]))
+            self.assertAlmostEqual(index.distance(n1, n2), t.get_distance(n1, n2))
+            self.assertEqual(index.distance(n1, n2, topological=True),
+                             t.get_distance(n1, n2, topological=True))
+
+        pairs = [('A', 'B'), ('A', 'D'), (t, 'F')]
+        self.assertEqual(index.distances(pairs).tolist(), [1.5, 14.5, 3.0])
+        self.assertEqual(index.lcas(pairs), [t['A'].up, t, t])
+
+        with self.assertRaises(TreeError):
+            index.distance('A', 'X')
+
+        # It stays valid after the tree changes.
+        t['A'].dist = 2.5
+        self.assertEqual(index.distance('A', 'B'), 3.5)
+
+        t.set_outgroup(t['D'])
+        for n1, n2 in itertools.product(t.traverse(), t.traverse()):
+            self.assertIs(index.lca(n1, n2), t.common_ancestor([n1, n2]))
+            self.assertAlmostEqual(index.distance(n1, n2), t.get_distance(n1, n2))
+
+        t['C'].detach()
+        with self.assertRaises(TreeError):
+            index.distance('A', 'C')
+
+    def test_sizes(self):
+        from ete4.core import operations as ops
+
+        def sizes(t):
+            return [n.size for n in t.traverse()]
+
+        def full_sizes(t):
+            ops.update_sizes_all(t)
+            return sizes(t)
+
+        t = Tree('((A:1,B:2)X:1,(C:1,(D:1,E:3)Y:2)Z:1,F:4)R;', parser=1)
+        self.assertEqual(t.size, (0, 0))  # not computed yet
+
+        ops.update_sizes_all(t)
+        self.assertEqual(t.size, (6, 6))
+
+        # The sizes stay updated after each change.
+        t['E'].dist = 5
+        self.assertEqual(t.size, (8, 6))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t['Z'].add_child(Tree('(G:1,H:1):9;'))
+        self.assertEqual(t.size, (11, 8))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t['Z'].children[-1].detach()
+        self.assertEqual(t.size, (8, 6))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t['X'].remove_child(t['B'])
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t.set_outgroup(t['D'])
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t['Y'].delete()
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t.prune(['A', 'C', 'F'])
+        self.assertEqual(t.size[1], 3)
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        # Changing only a subtree updates its ancestors too.
+        t = Tree('((A:1,B:2,C:5)X:1,D:1)R;', parser=1)
+        ops.update_sizes_all(t)
+        t['X'].prune(['A', 'B'])
+        self.assertEqual(t.size, (3, 3))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        t['X'].to_ultrametric()
+        self.assertAlmostEqual(t.get_distance('X', 'A'),
+                               t.get_distance('X', 'B'))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        # Nodes without dist.
+        t = Tree('(n1,(n3:0.38,n4)n2)n0;', parser=1)
+        ops.update_sizes_all(t)
+        t.set_outgroup(t['n4'])
+        self.assertEqual(t['n4'].size, (1, 1))
+        self.assertEqual(sizes(t), full_sizes(t))
+
+        # A tree without sizes does not get them when changed.
+        t = Tree('((A:1,B:2)X:1,C:1)R;', parser=1)
+        t['X'].add_child(name='D', dist=1)
+        t['A'].dist = 2
+        self.assertEqual(set(sizes(t)), {(0, 0)})
+
+    def test_node_index(self):
+        t = Tree('((A,B)X,(C,(D,E)Y)Z,F)R;', parser=1)
+        index = t.build_index()
+
+        def assert_consistent():
+            fresh = NodeIndex(t)
+            self.assertEqual({k: set(map(id, v)) for k, v in index.nodes['name'].items()},
+                             {k: set(map(id, v)) for k, v in fresh.nodes['name'].items()})
+            for node in t.traverse():
+                if node.name:
+                    self.assertIs(t[node.name], node)
+
+        assert_consistent()
+
+        t.set_outgroup(t['D'])
+        assert_consistent()
+
+        t.unroot()
+        assert_consistent()
+
+        t['Z'].delete()
+        t['A'].detach()
+        t['F'].name = 'G'
+        t['B'].add_child(name='H')
+        t['X'].children = [t['B'], Tree('(I,J)K;', parser=1)]
+        assert_consistent()
+
+        self.assertEqual(list(t.search_nodes(name='G')), [t['G']])
+        self.assertEqual(list(t.search_nodes(name='A')), [])
+        with self.assertRaises(TreeError):
+            t['A']
+
+        t.prune(['C', 'H', 'I'])
+        assert_consistent()
+        self.assertEqual(set(t.leaf_names()), {'C', 'H', 'I'})
+
+        # Repeated names are found too, in the same order as without index.
+        t['I'].name = 'H'
+        self.assertEqual(list(t.search_nodes(name='H')),
+                         [n for n in t.traverse() if n.name == 'H'])
+        with self.assertRaises(AssertionError):
+            t.common_ancestor(['C', 'H'])  # ambiguous name
+
+        # Index by other properties.
+        t = Tree('((A,B),C);')
+        for leaf, taxid in zip(t, [9606, 9606, 10090]):
+            leaf.add_prop('taxid', taxid)
+        t.build_index(['name', 'taxid'])
+        self.assertEqual([n.name for n in t.search_nodes(taxid=9606)], ['A', 'B'])
+        t['A'].del_prop('taxid')
+        self.assertEqual([n.name for n in t.search_nodes(taxid=9606)], ['B'])
+
+        # The index is not copied.
+        self.assertIsNone(t.copy('deepcopy')._index)
+        self.assertIsNone(t.copy('cpickle')._index)
+
     def test_rooting_topology(self):
         """Test topology changes after rooting"""
         t = Tree('((d,e)b,(f,g)c);', parser=1)
@@ -924,6 +1311,48 @@ class Test_Core_Tree(unittest.TestCase):
                  '[&&NHX:color=blue]):0.8[&&NHX:color=red]);')
         self.assertRaises(AssertionError, t.unroot, bprops=['color'])
 
+    def test_columns(self):
+        """Test vectorised queries on properties exported as columns."""
+        t = Tree('((A:1,B:2)0.9:0.5,(C:3,(D:4,E:5)0.3:1)0.7:2);')
+        t['C'].props['kind'] = 'x'
+        t['E'].props['kind'] = 'x'
+
+        cols = t.to_columns(['dist', 'support'])
+
+        self.assertEqual([n.name for n in cols.nodes],
+                         [n.name for n in t.traverse('preorder')])
+        self.assertEqual(cols['support'].tolist()[1], 0.9)
+
+        weak = cols.filter(cols.mask('support', '<', 0.8))
+        self.assertEqual([n.support for n in weak], [0.7, 0.3])
+        self.assertEqual([n.name for n in cols.search(kind='x')], ['C', 'E'])
+        self.assertEqual([n.name for n in cols.search(kind='x', dist=5)], ['E'])
+
+        node = t.common_ancestor(['D', 'E'])
+        i = cols.index(node)
+        self.assertEqual(cols.clade_min('dist')[i], 1)
+        self.assertEqual(cols.clade_max('dist')[i], 5)
+        self.assertEqual(cols.clade_sum('dist')[i], 10)
+        self.assertEqual(cols.clade_mean('dist', leaves_only=True)[i], 4.5)
+        self.assertEqual(cols.clade_max('dist').tolist(),
+                         [max(n.dist or 0 for n in node.traverse())
+                          for node in cols.nodes])
+        self.assertEqual(cols.clade_mask(node).sum(), 3)
+
+        self.assertEqual(cols.stats('dist', leaves_only=True),
+                         {'n': 5, 'min': 1, 'max': 5, 'mean': 3, 'var': 2})
+        with self.assertRaises(ValueError):
+            cols.stats('kind')
+
+        # Sync with the tree.
+        cols.store('dist', cols['dist'] * 2)
+        self.assertEqual(t['E'].dist, 10)
+
+        t['E'].detach()
+        cols.update()
+        self.assertEqual(len(cols), 8)
+        self.assertEqual(cols['dist'].tolist()[-1], 8)
+
     def test_tree_navigation(self):
         t = Tree('(((A,B)H,C)I,(D,F)J)root;', parser=1)
         postorder = [n.name for n in t.traverse("postorder")]
@@ -963,6 +1392,27 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual(cache_many[t], set([(leaf.name, leaf.dist, leaf.support) for leaf in t.leaves()]))
         self.assertEqual(cache_many_lof[t], set((n.name, n.dist, n.support) for n in t.traverse()))
 
+        # Compact representations: positions of leaves (or nodes) in preorder.
+        leaves = list(t.leaves())
+        nodes = list(t.traverse('preorder'))
+        for leaves_only, items in [(True, leaves), (False, nodes)]:
+            content = t.get_cached_content(leaves_only=leaves_only)
+            ranges = t.get_cached_content(container_type=range,
+                                          leaves_only=leaves_only)
+            bitsets = t.get_cached_content(container_type=int,
+                                           leaves_only=leaves_only)
+            for node in t.traverse():
+                self.assertEqual({items[i] for i in ranges[node]}, content[node])
+                self.assertEqual(bitsets[node], sum(1 << i for i in ranges[node]))
+
+        self.assertEqual(t.get_cached_content('name', list)[t], list(t.leaf_names()))
+
+        # Deep trees.
+        depth = 10 * sys.getrecursionlimit()
+        t = Tree('(' * depth + 'a' + ''.join(',n%d)' % i for i in range(depth)) + ';')
+        self.assertEqual(len(t.get_cached_content(container_type=range)[t]),
+                         depth + 1)
+
 
         #self.assertEqual(cache_name_lof[t], [t.name])
 
@@ -1469,6 +1919,57 @@ class Test_Core_Tree(unittest.TestCase):
         #     self.assertEqual(rf_max, real_max)
         #     self.assertEqual(rf, RF)
 
+    def test_bipartitions(self):
+        """Test the splits used to compare trees."""
+        t1 = Tree('(((a,b)0.9,c)0.4,(d,e)0.8);')
+        t2 = Tree('(((a,c),b),(d,e));')
+
+        _, _, _, edges1, edges2, _, _ = t1.robinson_foulds(t2)
+        self.assertEqual(edges1, {('a', 'b'), ('a', 'b', 'c'), ('d', 'e'),
+                                  ('a', 'b', 'c', 'd', 'e'),
+                                  ('a',), ('b',), ('c',), ('d',), ('e',)})
+
+        _, _, _, edges1, _, _, _ = t1.robinson_foulds(t2, unrooted_trees=True)
+        self.assertIn((('a', 'b'), ('c', 'd', 'e')), edges1)
+        self.assertIn((('a', 'b', 'c'), ('d', 'e')), edges1)
+        self.assertIn(((), ('a', 'b', 'c', 'd', 'e')), edges1)
+
+        for unrooted in [False, True]:
+            rfs = set()
+            for method in ['bitset', 'hash']:
+                keys = bp.get_keys('abcde', method)
+                splits1, supports1 = bp.get_splits(t1, 'name', keys, unrooted)
+                splits2, _ = bp.get_splits(t2, 'name', keys, unrooted)
+                rfs.add(bp.rf(splits1, splits2, unrooted=unrooted))
+
+                discard = bp.discarded(splits1, supports1, 0.5,
+                                       bp.total_key(keys), unrooted)
+                self.assertEqual(len(discard), 1)  # the branch with 0.4
+            self.assertEqual(len(rfs), 1)  # same result with both methods
+
+        # All against all.
+        trees = [Tree('((a,b),(c,(d,e)));'), Tree('((a,c),(b,(d,e)));'),
+                 Tree('((a,(b,x)),(c,(d,e)));'), Tree('(e,(d,(c,(b,a))));')]
+        for unrooted in [False, True]:
+            matrix = bp.rf_matrix(trees, unrooted=unrooted)
+            for i, t1 in enumerate(trees):
+                for j, t2 in enumerate(trees):
+                    rf = t1.robinson_foulds(t2, unrooted_trees=unrooted)[0]
+                    self.assertEqual(matrix[i, j], rf)
+
+            incidence, counts = bp.get_incidence(trees, unrooted=unrooted)
+            rows = [row for _, block in bp.iter_rf_rows(incidence, counts,
+                                                        jobs=2, size=1)
+                    for row in block.tolist()]  # computed in parallel
+            self.assertEqual(rows, matrix.tolist())
+
+        # Repeated leaf values.
+        trees = [Tree('((a,a),(b,c));'), Tree('((a,b),(a,c));')]
+        with self.assertRaises(TreeError):
+            trees[0].robinson_foulds(trees[1])
+        with self.assertRaises(TreeError):
+            bp.rf_matrix(trees)
+
     # TODO: Fix the check_monophyly() function and this test.
     def test_monophyly(self):
         """Checks for monophyletic, paraphyletic, and polyphyletic groups."""
@@ -1610,6 +2111,33 @@ class Test_Core_Tree(unittest.TestCase):
         self.assertEqual((t_pkl["A"]).props['complex'][0], [0,1])
         self.assertEqual((t_deep["A"]).props['testfn'](), "YES")
 
+        # Fast copies, node by node.
+        for method in ['fast', 'fast-deep', 'cow']:
+            t_copy = t.copy(method)
+            self.assertEqual(t_copy.write(props=['label'], format_root_node=True),
+                             t.write(props=['label'], format_root_node=True))
+            self.assertTrue(all(n.up is None or n in n.up.children
+                                for n in t_copy.traverse()))
+            self.assertFalse(set(t_copy.traverse()) & set(t.traverse()))
+
+            t_copy['A'].name = 'A2'
+            self.assertEqual(t['A'].name, 'A')
+
+        # Only "fast-deep" copies the values of the props.
+        t_fast, t_fastdeep = t.copy('fast'), t.copy('fast-deep')
+        t['A'].props['complex'].append([5, 5])
+        self.assertEqual(len(t_fast['A'].props['complex']), 5)
+        self.assertEqual(len(t_fastdeep['A'].props['complex']), 4)
+
+        # Copy-on-write: props are shared until accessed or modified.
+        t_cow = t.copy('cow')
+        t_cow['B'].props['label'] = 'changed'  # from the copy
+        self.assertNotIn('label', t['B'].props)
+        t['C'].add_prop('label', 'new')  # from the original
+        self.assertNotIn('label', t_cow['C'].props)
+        t_cow['D'].dist = 10
+        self.assertNotEqual(t['D'].dist, 10)
+
     def test_cophenetic_matrix(self):
         t = Tree(ds.nw_full)
         dists, leaves = t.cophenetic_matrix()
@@ -1686,6 +2214,20 @@ class Test_Core_Tree(unittest.TestCase):
                 self.assertAlmostEqual(actualdists[i][j], dists[i][j], places=4)
         self.assertEqual(actualleaves, leaves)
 
+        # Condensed, in single precision, and stored in a file.
+        n = len(leaves)
+        condensed, _ = t.cophenetic_matrix(condensed=True)
+        self.assertEqual(len(condensed), n * (n - 1) // 2)
+        pairs = itertools.combinations(range(n), 2)
+        for (i, j), d in zip(pairs, condensed):
+            self.assertAlmostEqual(actualdists[i][j], d, places=4)
+
+        with NamedTemporaryFile(suffix='.npy') as fp:
+            dists32, _ = t.cophenetic_matrix(dtype='float32', out=fp.name)
+            self.assertEqual(dists32.dtype.name, 'float32')
+            self.assertEqual(dists32.shape, (n, n))
+            self.assertAlmostEqual(float(dists32[0, 1]), actualdists[0][1], places=4)
+
 
 if __name__ == '__main__':
     unittest.main()